@@ -0,0 +1,174 @@
+# Offline batch-job mode for large (overnight) sheets.
+#
+#   Phase one  (RUN_MODE = "batch_prepare" in main_working_json.py)
+#       fetch + extract the whole input, then write every pending explain() prompt as a
+#       JSONL batch-request line with a stable key, plus a sidecar of the partial rows.
+#   Phase two  (RUN_MODE = "batch_ingest")
+#       read the batch-results JSONL and join the verdicts back into the checkpoint
+#       and results files.
+#
+# The line format is the Gemini Batch API file format:
+#   request : {"key": "...", "request": {"contents": [{"role": "user", "parts": [{"text": "..."}]}]}}
+#   result  : {"key": "...", "response": {"candidates": [{"content": {"parts": [{"text": "..."}]}}]}}
+#
+# To test the flow without any API access, answer the requests file locally:
+#   python batch_job.py batch/<name>_requests.jsonl batch/<name>_results.jsonl
+
+import hashlib
+import json
+import os
+import re
+import sys
+
+from explain_url import GEMINI_MODEL, PROMPT_VERSION, build_prompt, parse_verdict, target
+from llm.parsing import VERDICT_SCHEMA, rest_generation_config
+from llm.verdict_cache import verdict_cache
+
+
+def request_key(page_url: str, keyword: str) -> str:
+    """Stable key for a (URL, keyword) row, identical across runs."""
+    return hashlib.sha1(f"{page_url}\t{keyword}".encode("utf-8")).hexdigest()[:20]
+
+
+def load_pending(pending_path: str) -> dict:
+    """key -> {"result": partial row, "contexts": [...], "extract_seconds": float}"""
+    if not os.path.exists(pending_path):
+        return {}
+    try:
+        with open(pending_path, "r", encoding="utf-8") as f:
+            pending = json.load(f)
+        return pending if isinstance(pending, dict) else {}
+    except (json.JSONDecodeError, IOError) as e:
+        print(f"  [WARNING] Could not read batch pending file {pending_path}: {e}")
+        return {}
+
+
+def save_pending(pending_path: str, pending: dict):
+    os.makedirs(os.path.dirname(pending_path) or ".", exist_ok=True)
+    with open(pending_path, "w", encoding="utf-8") as f:
+        json.dump(pending, f, ensure_ascii=False, indent=4)
+
+
+def write_batch_requests(new_rows: list, requests_path: str, pending_path: str) -> int:
+    """
+    Phase one. `new_rows` are (result, contexts, extract_seconds) tuples for rows that
+    still need a verdict. Rows are merged into the pending sidecar and the requests file
+    is rewritten from it, so re-running phase one never duplicates a key.
+    """
+    pending = load_pending(pending_path)
+    for result, contexts, extract_seconds in new_rows:
+        pending[request_key(result["Page URL"], result["Keyword"])] = {
+            "result": result,
+            "contexts": contexts,
+            "extract_seconds": round(extract_seconds, 2),
+        }
+    save_pending(pending_path, pending)
+
+    os.makedirs(os.path.dirname(requests_path) or ".", exist_ok=True)
+    with open(requests_path, "w", encoding="utf-8") as f:
+        for key, entry in pending.items():
+            prompt = build_prompt(entry["contexts"], entry["result"]["Keyword"], entry["result"]["Company Name"])
+            line = {"key": key, "request": {"contents": [{"role": "user", "parts": [{"text": prompt}]}],
+                                            "generationConfig": rest_generation_config(VERDICT_SCHEMA)}}
+            f.write(json.dumps(line, ensure_ascii=False) + "\n")
+    return len(pending)
+
+
+def _response_text(line: dict) -> str:
+    response = line.get("response") or {}
+    parts = (((response.get("candidates") or [{}])[0]).get("content") or {}).get("parts") or []
+    return "".join(part.get("text", "") for part in parts)
+
+
+def ingest_batch_results(results_path: str, pending_path: str) -> tuple:
+    """
+    Phase two. Joins every answered key back into its pending row and returns
+    (completed rows, what stays pending). Unanswered, failed and unparseable keys stay
+    pending, so the next batch_prepare sends them again. Nothing is written here: the
+    caller saves the pending sidecar only after the completed rows are checkpointed,
+    so a crash in between cannot lose them.
+    """
+    pending = load_pending(pending_path)
+    completed, failed = [], 0
+    with open(results_path, "r", encoding="utf-8") as f:
+        for raw in f:
+            if not raw.strip():
+                continue
+            try:
+                line = json.loads(raw)
+            except json.JSONDecodeError:
+                continue
+            entry = pending.get(line.get("key"))
+            if entry is None:
+                continue
+            if line.get("error"):
+                print(f"  [WARNING] Batch request {line['key']} failed, kept pending: {line['error']}")
+                failed += 1
+                continue
+            try:
+                verdict = parse_verdict(_response_text(line))
+            except Exception as e:
+                print(f"  [WARNING] Batch reply {line['key']} could not be parsed, kept pending: {e}")
+                failed += 1
+                continue
+
+            result = dict(entry["result"])
+            # Same prompt as explain(), so online runs can reuse batch verdicts
+            verdict_cache.put(verdict_cache.key(result["Company Name"], result["Keyword"], entry["contexts"],
+                                                GEMINI_MODEL, PROMPT_VERSION), verdict)
+            result["Usage Indicated"] = "Yes" if verdict.get("uses_tech") else "No"
+            result["Explanation"] = verdict.get("explanation", "No explanation provided.")
+            result["Processing Time (s)"] = entry.get("extract_seconds", 0)
+            completed.append(result)
+            del pending[line["key"]]
+
+    if failed:
+        print(f"  [WARNING] {failed} batch results failed or were unparseable; they stay pending.")
+    return completed, pending
+
+
+# --- Local stand-in for the batch service ---------------------------------------
+
+def keyword_verdict(keyword: str, text) -> dict:
+    """Deterministic verdict: keyword and a usage indicator in the same sentence."""
+    keyword = (keyword or "").lower()
+    text = " ".join(text) if isinstance(text, list) else str(text or "")
+    for sentence in re.split(r"(?<=[.!?])\s+", text):
+        lowered = sentence.lower()
+        if keyword and keyword in lowered:
+            hits = [ind for ind in target if re.search(rf"\b{re.escape(ind.lower())}\b", lowered)]
+            if hits:
+                return {"uses_tech": True, "explanation": f"Local stand-in: '{keyword}' appears with '{hits[0]}'."}
+    return {"uses_tech": False, "explanation": "Local stand-in: no usage indicator next to the keyword."}
+
+
+def local_verdict(prompt: str) -> dict:
+    """keyword_verdict() for the technology and text of a single-row prompt (see explain_url.task_prompt)."""
+    technology = re.search(r"\*\*Technology:\*\* `(.*?)`", prompt)
+    text = re.search(r"\*\*Text to Analyze:\*\* `(.*?)`\s*---", prompt, re.S)
+    return keyword_verdict(technology.group(1) if technology else "", text.group(1) if text else "")
+
+
+def answer_batch_locally(requests_path: str, results_path: str) -> int:
+    """Writes a results JSONL for a requests JSONL, shaped like the real batch output."""
+    count = 0
+    with open(requests_path, "r", encoding="utf-8") as src, open(results_path, "w", encoding="utf-8") as out:
+        for raw in src:
+            if not raw.strip():
+                continue
+            line = json.loads(raw)
+            prompt = "".join(p.get("text", "") for c in line["request"]["contents"] for p in c.get("parts", []))
+            answer = json.dumps(local_verdict(prompt))
+            out.write(json.dumps({
+                "key": line["key"],
+                "response": {"candidates": [{"content": {"role": "model", "parts": [{"text": answer}]}}]},
+            }) + "\n")
+            count += 1
+    return count
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print("Usage: python batch_job.py <requests.jsonl> <results.jsonl>")
+        sys.exit(1)
+    print(f"Answered {answer_batch_locally(sys.argv[1], sys.argv[2])} requests into {sys.argv[2]}")
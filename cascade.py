@@ -0,0 +1,131 @@
+import re
+import sys
+import threading
+from collections import Counter
+from typing import Callable
+
+from explain_url import estimate_tokens, system_prompt, task_prompt
+from rules import mention_kinds
+
+# Cascaded snippet evaluation.
+# Instead of sending all of a row's contexts (up to 5 for HTML, 4 for PDFs) in one
+# prompt, the contexts are ranked by how likely they are to decide the row and sent in
+# growing prefixes (CASCADE_STEPS). The cascade stops at the first "Yes", or at a "No"
+# whose explanation is a context / acronym mismatch; any other "No" only means these
+# snippets are not enough, so the next step adds more. The last step always holds every
+# context, so a row that never exits early gets the same prompt as before.
+#
+# Measure it against the all-at-once prompt on labeled sheets (answered by the local
+# mock server, see llm/mock_server.py):
+#   python cascade.py [rows.json | results.csv ...]
+
+# --- Configuration Constants ---
+CASCADE_STEPS = [1, 2]           # contexts sent at each step before the final all-contexts step
+MISMATCH_PATTERN = re.compile(r"context mismatch|acronym|wrong concept|not the technology|"
+                              r"refers to (?:a |an |the )?(?:different|something else)", re.IGNORECASE)
+
+# How much a context's mentions say about the row; higher is sent first
+KIND_RANK = {"direct_statement": 4, "job_posting": 4, "unclear": 2, "context_mismatch": 1, "third_party": 1,
+             "speculation_only": 0, "education_only": 0}
+
+_STATS = {"rows": 0, "calls": 0, "snippets_sent": 0, "snippets_all": 0, "tokens_sent": 0, "tokens_all": 0}
+_EXITS = Counter()   # "step N yes" / "step N mismatch" / "all contexts" / "error"
+_STATS_LOCK = threading.Lock()
+
+
+def rank_contexts(contexts, keyword: str, page_type: str = None, company_name: str = "") -> list:
+    """Contexts ordered by the strongest rule signal of their keyword mentions (page order breaks ties)."""
+    items = contexts if isinstance(contexts, list) else [contexts]
+
+    def score(item) -> tuple:
+        kinds = mention_kinds([item], keyword, page_type, company_name)
+        return max((KIND_RANK.get(kind, 2) for kind in kinds), default=-1), len(kinds)
+
+    scores = [score(item) for item in items]
+    return [items[i] for i in sorted(range(len(items)), key=lambda i: scores[i], reverse=True)]
+
+
+def decisive(verdict: dict) -> str:
+    """Why a verdict on some snippets already settles the row: "yes", "mismatch", or "" if it does not."""
+    if verdict.get("uses_tech"):
+        return "yes"
+    if MISMATCH_PATTERN.search(verdict.get("explanation") or ""):
+        return "mismatch"
+    return ""
+
+
+def cascade(contexts, keyword: str, company_name: str, page_url: str, explain: Callable,
+            page_type: str = None) -> dict:
+    """
+    Verdict for one row, asking explain(chunk_text=..., keyword_tech=..., company_name=...,
+    page_url=...) about the best-ranked contexts first and widening only while unclear.
+    """
+    ranked = rank_contexts(contexts, keyword, page_type, company_name)
+    sizes = [n for n in CASCADE_STEPS if n < len(ranked)] + [len(ranked)]
+    # Every call re-sends the system prefix, so it counts once per call
+    system_tokens = estimate_tokens(system_prompt())
+    calls, snippets, tokens = 0, 0, 0
+    for step, size in enumerate(sizes, 1):
+        subset = ranked[:size]
+        calls += 1
+        snippets += size
+        tokens += system_tokens + estimate_tokens(task_prompt(subset, keyword, company_name))
+        verdict = explain(chunk_text=subset, keyword_tech=keyword, company_name=company_name, page_url=page_url)
+        if "API or parsing error" in verdict.get("explanation", ""):
+            exit_label = "error"   # widening would only repeat the failing call
+            break
+        if size < len(ranked) and (reason := decisive(verdict)):
+            exit_label = f"step {step} {reason}"
+            break
+    else:
+        exit_label = "all contexts"
+
+    with _STATS_LOCK:
+        _STATS["rows"] += 1
+        _STATS["calls"] += calls
+        _STATS["snippets_sent"] += snippets
+        _STATS["snippets_all"] += len(ranked)
+        _STATS["tokens_sent"] += tokens
+        _STATS["tokens_all"] += system_tokens + estimate_tokens(task_prompt(contexts, keyword, company_name))
+        _EXITS[exit_label] += 1
+    if exit_label.startswith("step"):
+        print(f"--> Cascade settled '{keyword}' on {size} of {len(ranked)} snippets ({exit_label})")
+    return verdict
+
+
+def cascade_stats() -> dict:
+    """
+    Average snippets and prompt tokens (system prefix included) sent per row over all of
+    its calls, and calls per row: cascade vs. all contexts at once.
+    """
+    with _STATS_LOCK:
+        stats, exits = dict(_STATS), dict(_EXITS)
+    rows = stats["rows"] or 1
+    return {
+        "rows": stats["rows"],
+        "avg_calls": round(stats["calls"] / rows, 2),
+        "avg_snippets": round(stats["snippets_sent"] / rows, 2),
+        "avg_snippets_all_at_once": round(stats["snippets_all"] / rows, 2),
+        "avg_tokens": round(stats["tokens_sent"] / rows, 1),
+        "avg_tokens_all_at_once": round(stats["tokens_all"] / rows, 1),
+        "exits": exits,
+    }
+
+
+if __name__ == "__main__":
+    import explain_url
+    from llm.mock_server import use_mock
+    from rules import FIXTURE_ROWS, load_labeled
+
+    server = use_mock()
+    labeled = [row for path in (sys.argv[1:] or [FIXTURE_ROWS]) for row in load_labeled(path)]
+    agree = 0
+    for row in labeled:
+        whole = explain_url.explain(row["contexts"], row["keyword"], row["company_name"], row.get("url", ""))
+        verdict = cascade(row["contexts"], row["keyword"], row["company_name"], row.get("url", ""),
+                          explain_url.explain, row.get("page_type"))
+        agree += verdict.get("uses_tech") == whole.get("uses_tech")
+    server.stop()
+    print(f"Rows: {len(labeled)}, cascade agrees with all-at-once on {agree}")
+    for name, value in cascade_stats().items():
+        print(f"{name:>26}: {value}")
@@ -0,0 +1,135 @@
+import re
+import threading
+from typing import Optional
+from urllib.parse import urlsplit
+
+# Company-level short-circuit.
+# What a sheet really asks is "does company X use keyword Y", and one confirmed page
+# answers it. Rows are grouped by (domain, keyword), each group's URLs are ordered by a
+# cheap evidence score read off the URL alone (nothing is fetched), and once a row of a
+# group comes back "Yes" the group's remaining rows are skipped: no fetch, no parse, no
+# LLM call. The per-company summary still covers every group with its verdict, the
+# evidence URL and how many rows were processed or skipped.
+
+# --- Configuration Constants ---
+# URL path words that make a page likely (or unlikely) to show operational use
+STRONG_PATH_MARKERS = ["careers", "career", "jobs", "job", "engineering", "technology", "tech-stack", "stack",
+                       "platform", "architecture", "infrastructure", "cloud", "partners", "partner"]
+WEAK_PATH_MARKERS = ["about", "solutions", "services", "blog", "insights", "case-study", "case-studies"]
+NEGATIVE_PATH_MARKERS = ["news", "press", "events", "event", "webinar", "training", "academy", "courses",
+                         "course", "privacy", "terms", "cookie", "cookies", "legal", "products", "product"]
+KEYWORD_IN_URL_SCORE = 2         # the keyword in the path is a hint, not proof (e.g. pumps named "AWS")
+PDF_PENALTY = 1                  # PDFs are slow to fetch and parse, so they go after equal HTML pages
+
+
+def group_key(domain: str, keyword: str) -> tuple:
+    """(bare host, keyword) for domains written as "www.x.com", "http://x.com/" or a full page URL."""
+    domain = str(domain or "").strip().lower()
+    host = urlsplit(domain if "//" in domain else f"//{domain}").netloc or domain
+    return host.removeprefix("www.").split(":")[0], str(keyword or "").strip().lower()
+
+
+def evidence_score(url: str, keyword: str) -> float:
+    """How promising a URL looks for the keyword, from its path alone; higher is processed first."""
+    path = urlsplit(str(url)).path.lower()
+    words = set(re.split(r"[^a-z0-9]+", path))
+    slug = re.sub(r"[^a-z0-9]+", "-", str(keyword).lower()).strip("-")
+    score = KEYWORD_IN_URL_SCORE if slug and re.search(rf"(?<![a-z0-9]){re.escape(slug)}(?![a-z0-9])", path) else 0
+    score += 2 * sum(1 for marker in STRONG_PATH_MARKERS if marker in words or f"/{marker}/" in path)
+    score += sum(1 for marker in WEAK_PATH_MARKERS if marker in words or f"/{marker}" in path)
+    score -= 2 * sum(1 for marker in NEGATIVE_PATH_MARKERS if marker in words)
+    if path.endswith(".pdf"):
+        score -= PDF_PENALTY
+    return score
+
+
+def order_rows(df, domain_column: str = "domain", keyword_column: str = "keyword", url_column: str = "company_url"):
+    """Input rows with each (domain, keyword) group's URLs by descending evidence score (groups keep their order)."""
+    keys = [group_key(d, k) for d, k in zip(df[domain_column], df[keyword_column])]
+    first_seen = {}
+    for key in keys:
+        first_seen.setdefault(key, len(first_seen))
+    scores = [evidence_score(u, k) for u, k in zip(df[url_column], df[keyword_column])]
+    return (df.assign(_group=[first_seen[key] for key in keys], _score=scores)
+              .sort_values(["_group", "_score"], ascending=[True, False], kind="stable")
+              .drop(columns=["_group", "_score"]))
+
+
+class CompanyTracker:
+    def __init__(self):
+        self.groups = {}   # group key -> summary dict
+        self._lock = threading.Lock()
+
+    def _group(self, domain: str, keyword: str) -> dict:
+        return self.groups.setdefault(group_key(domain, keyword), {
+            "Domain": group_key(domain, keyword)[0], "Keyword": keyword, "Company Name": "",
+            "Usage Indicated": "Unknown", "Evidence URL": "", "Explanation": "",
+            "URLs": 0, "Processed": 0, "Skipped": 0, "Yes": 0, "No": 0, "Errors": 0,
+        })
+
+    def expect(self, domain: str, keyword: str):
+        """Counts one input row of the group."""
+        with self._lock:
+            self._group(domain, keyword)["URLs"] += 1
+
+    def confirmed(self, domain: str, keyword: str) -> Optional[dict]:
+        """The group's summary if a row of it already came back "Yes", else None."""
+        with self._lock:
+            group = self.groups.get(group_key(domain, keyword))
+            return dict(group) if group and group["Yes"] else None
+
+    def record(self, result: dict):
+        """Folds a finished row (this run or the checkpoint) into its group."""
+        with self._lock:
+            group = self._group(result.get("Domain"), result.get("Keyword"))
+            group["Company Name"] = group["Company Name"] or result.get("Company Name") or ""
+            usage = result.get("Usage Indicated")
+            if usage == "Skipped":
+                group["Skipped"] += 1
+                return
+            group["Processed"] += 1
+            if usage == "Yes":
+                group["Yes"] += 1
+                if not group["Evidence URL"]:
+                    group["Evidence URL"] = result.get("Page URL", "")
+                    group["Explanation"] = result.get("Explanation", "")
+            elif usage == "No":
+                group["No"] += 1
+            else:
+                group["Errors"] += 1
+            group["Usage Indicated"] = ("Yes" if group["Yes"] else "No" if group["No"] else "Error")
+
+    def skip(self, domain: str, keyword: str, page_url: str, company_name: str = "") -> dict:
+        """Output row for a URL that is not processed because its group is already confirmed."""
+        group = self.confirmed(domain, keyword) or {}
+        return {
+            "Company Name": company_name or group.get("Company Name", ""),
+            "Domain": domain,
+            "Page URL": page_url,
+            "Keyword": keyword,
+            "Date": "Not found",
+            "Date Method": "skipped",
+            "Page Type": "",
+            "Usage Indicated": "Skipped",
+            "Explanation": f"Skipped: '{keyword}' use is already confirmed for this company by "
+                           f"{group.get('Evidence URL', 'another page')}.",
+            "Processing Time (s)": 0,
+        }
+
+    def summary_rows(self) -> list:
+        """One row per (domain, keyword) group, in input order."""
+        with self._lock:
+            return [dict(group) for group in self.groups.values()]
+
+    def summary(self) -> dict:
+        with self._lock:
+            groups = list(self.groups.values())
+        return {
+            "groups": len(groups),
+            "confirmed": sum(1 for g in groups if g["Yes"]),
+            "processed": sum(g["Processed"] for g in groups),
+            "skipped": sum(g["Skipped"] for g in groups),
+        }
+
+
+company_tracker = CompanyTracker()
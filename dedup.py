@@ -0,0 +1,165 @@
+import random
+import re
+import sys
+import threading
+import zlib
+from typing import Optional
+
+# Near-duplicate reuse of LLM verdicts within a run.
+# Boilerplate ("We are an AWS Advanced Consulting Partner ...") repeats on many URLs of
+# one company. Every judged row's contexts are MinHashed into an LSH index keyed by
+# (company, keyword); a later row of the same company and keyword whose contexts are at
+# least SIMILARITY_THRESHOLD similar (estimated Jaccard over word shingles) takes the
+# earlier verdict instead of another LLM call. The explanation says which page it came from.
+#
+# Measure it on labeled sheets (see rules.load_labeled):
+#   python dedup.py [rows.json | results.csv ...]
+
+# --- Configuration Constants ---
+DEDUP_ENABLED = True
+SIMILARITY_THRESHOLD = 0.85      # estimated Jaccard similarity needed to reuse a verdict
+NUM_PERM = 64                    # MinHash permutations per signature
+SHINGLE_WORDS = 5                # words per shingle
+SEED = 1
+
+_PRIME = (1 << 61) - 1
+_MASK = (1 << 32) - 1
+_rng = random.Random(SEED)
+_PERMUTATIONS = [(_rng.randrange(1, _PRIME), _rng.randrange(0, _PRIME)) for _ in range(NUM_PERM)]
+
+
+def _bands(threshold: float, num_perm: int) -> tuple:
+    """(bands, rows) whose LSH S-curve crosses `threshold`, leaning towards more candidates."""
+    options = [(b, num_perm // b) for b in range(1, num_perm + 1) if num_perm % b == 0]
+    below = [o for o in options if (1 / o[0]) ** (1 / o[1]) <= threshold]
+    return max(below or options, key=lambda o: (1 / o[0]) ** (1 / o[1]))
+
+
+def _text(contexts) -> str:
+    parts = []
+    for item in contexts if isinstance(contexts, list) else [contexts]:
+        text = item.get("context") if isinstance(item, dict) else item
+        if isinstance(text, str):
+            parts.append(text)
+    return re.sub(r"\s+", " ", re.sub(r"[^\w\s]", " ", " ".join(parts).lower())).strip()
+
+
+def signature(contexts) -> Optional[tuple]:
+    """MinHash signature of the contexts' word shingles; None for empty text."""
+    words = _text(contexts).split()
+    if not words:
+        return None
+    shingles = {" ".join(words[i:i + SHINGLE_WORDS]) for i in range(max(1, len(words) - SHINGLE_WORDS + 1))}
+    hashes = [zlib.crc32(s.encode("utf-8")) for s in shingles]
+    return tuple(min(((a * h + b) % _PRIME) & _MASK for h in hashes) for a, b in _PERMUTATIONS)
+
+
+def similarity(sig_a: tuple, sig_b: tuple) -> float:
+    return sum(1 for x, y in zip(sig_a, sig_b) if x == y) / len(sig_a)
+
+
+def reuse(verdict: dict, page_url: str, score: float) -> dict:
+    """Copy of `verdict` for a near-duplicate row, tagged with where it came from."""
+    return dict(verdict, reused_from=page_url, similarity=round(score, 3),
+                explanation=f"[Reused from near-duplicate page {page_url}, similarity {score:.2f}] "
+                            f"{verdict.get('explanation', '')}")
+
+
+class DedupIndex:
+    def __init__(self, threshold: float = SIMILARITY_THRESHOLD):
+        self.threshold = threshold
+        self.bands, self.rows = _bands(threshold, NUM_PERM)
+        self.stats = {"lookups": 0, "reused": 0, "indexed": 0}
+        self._buckets = {}   # (company, keyword, band, band hash) -> [entry index]
+        self._entries = []   # (signature, verdict, page_url)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _scope(company_name: str, keyword: str) -> tuple:
+        return (company_name or "").strip().lower(), (keyword or "").strip().lower()
+
+    def _band_keys(self, scope: tuple, sig: tuple):
+        for band in range(self.bands):
+            yield scope + (band, hash(sig[band * self.rows:(band + 1) * self.rows]))
+
+    def lookup(self, contexts, keyword: str, company_name: str) -> Optional[dict]:
+        """A verdict reused from a near-duplicate row already judged in this run, or None."""
+        if not DEDUP_ENABLED or (sig := signature(contexts)) is None:
+            return None
+        scope = self._scope(company_name, keyword)
+        with self._lock:
+            self.stats["lookups"] += 1
+            score, best = self._nearest(scope, sig)
+            if best is None:
+                return None
+            self.stats["reused"] += 1
+            _, verdict, page_url = self._entries[best]
+        return reuse(verdict, page_url, score)
+
+    def _nearest(self, scope: tuple, sig: tuple) -> tuple:
+        candidates = {i for key in self._band_keys(scope, sig) for i in self._buckets.get(key, [])}
+        score, best = max(((similarity(sig, self._entries[i][0]), i) for i in candidates), default=(0.0, None))
+        return (score, best) if best is not None and score >= self.threshold else (0.0, None)
+
+    def cluster(self, rows: list) -> list:
+        """
+        For rows judged together (one batch): (index of the earlier row each one duplicates,
+        similarity), or (None, None) for rows that need their own verdict. Followers count as reused.
+        """
+        local = DedupIndex(self.threshold)
+        leaders = []
+        for i, (contexts, keyword, company_name) in enumerate(rows):
+            sig = signature(contexts) if DEDUP_ENABLED else None
+            scope = self._scope(company_name, keyword)
+            score, best = local._nearest(scope, sig) if sig else (0.0, None)
+            if best is not None:
+                leaders.append((local._entries[best][2], score))
+                continue
+            leaders.append((None, None))
+            if sig:
+                local._insert(scope, sig, {}, i)
+        with self._lock:
+            self.stats["reused"] += sum(1 for leader, _ in leaders if leader is not None)
+        return leaders
+
+    def add(self, contexts, keyword: str, company_name: str, verdict: dict, page_url: str = ""):
+        """Indexes a fresh verdict (not a reused one, nor an API error) for later rows."""
+        if not DEDUP_ENABLED or verdict.get("reused_from") or "API or parsing error" in verdict.get("explanation", ""):
+            return
+        if (sig := signature(contexts)) is None:
+            return
+        with self._lock:
+            self._insert(self._scope(company_name, keyword), sig,
+                         {"uses_tech": verdict.get("uses_tech"), "explanation": verdict.get("explanation", "")}, page_url)
+            self.stats["indexed"] += 1
+
+    def _insert(self, scope: tuple, sig: tuple, verdict: dict, ref):
+        self._entries.append((sig, verdict, ref))
+        for key in self._band_keys(scope, sig):
+            self._buckets.setdefault(key, []).append(len(self._entries) - 1)
+
+    def summary(self) -> dict:
+        with self._lock:
+            return dict(self.stats, bands=self.bands, rows=self.rows, threshold=self.threshold)
+
+
+dedup_index = DedupIndex()
+
+
+if __name__ == "__main__":
+    from rules import FIXTURE_ROWS, load_labeled
+
+    labeled = [row for path in (sys.argv[1:] or [FIXTURE_ROWS]) for row in load_labeled(path)]
+    index = DedupIndex()
+    reused = []
+    for row in labeled:
+        verdict = index.lookup(row["contexts"], row["keyword"], row["company_name"])
+        if verdict:
+            reused.append((row, verdict))
+        else:
+            index.add(row["contexts"], row["keyword"], row["company_name"],
+                      {"uses_tech": row["label"] == "Yes", "explanation": row["label"]}, row.get("url", ""))
+    agree = sum(1 for row, v in reused if ("Yes" if v["uses_tech"] else "No") == row["label"])
+    print(f"Rows: {len(labeled)}, verdicts reused: {len(reused)}, "
+          f"label agreement on reused rows: {round(agree / len(reused), 3) if reused else None}")
+    print(f"Index: {index.summary()}")
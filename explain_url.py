@@ -1,7 +1,16 @@
-import google.generativeai as genai
+import asyncio
 import json
+import time
 # import random
-from itertools import cycle
+from llm import aimd, parsing
+from llm.aimd import AIMDController, is_timeout
+from llm.clients import gemini_async_model, gemini_model
+from llm.parsing import (BATCH_SCHEMA, KEYWORDS_SCHEMA, VERDICT_SCHEMA, gemini_generation_config, once, read_stream,
+                         read_stream_async, salvage_list, salvage_verdict, verdict_with_retry, verdict_with_retry_async)
+from llm.prompt_cache import PrefixCache
+from llm.rate_limit import KeyPool, NoHealthyKeys, is_rate_limited
+from llm.usage import gemini_usage, usage_context, usage_log
+from llm.verdict_cache import prompt_version, verdict_cache
 
 # Gemini API KEYs ----------------------------------------------
 
@@ -33,17 +42,48 @@ target = [
     "financial commitment", "spending", "cost", "deal", "payment to", "funding"
 ]
 
-key_cycler = cycle(API_KEYS)
+GEMINI_MODEL = 'gemini-2.0-flash-lite-001'
+REQUEST_TIMEOUT = 300
 
+# Per-key limits (gemini-2.0-flash-lite free tier); every key gets its own RPM/TPM buckets
+GEMINI_RPM = 30
+GEMINI_TPM = 1_000_000
+OUTPUT_TOKENS_ESTIMATE = 300     # reserved per call on top of the prompt tokens
+MAX_RATE_LIMIT_RETRIES = 3       # a 429 retries on another key this many times
+PER_KEY_CONCURRENCY = 2          # in-flight calls per key for explain_many (fixed; with aimd.AIMD_ENABLED
+                                 # each key's limit adapts between 1 and aimd.MAX_CONCURRENCY)
 
-def explain(chunk_text: str, keyword_tech: str, company_name: str,page_url: str, usage_indicators: list = None) -> dict:
+key_pool = KeyPool(API_KEYS, rpm=GEMINI_RPM, tpm=GEMINI_TPM, name="gemini")
+# The static rule block of the prompt is kept in a per-key context cache (see llm/prompt_cache.py)
+prefix_cache = PrefixCache(GEMINI_MODEL)
+
+# Batched explain -------------------------------------------
+BATCH_MAX_ITEMS = 8            # rows packed into one request at most
+BATCH_TOKEN_BUDGET = 24_000    # rough input tokens per batched request
+BATCH_MAX_ITEMS_LIMIT = 32     # with aimd.AIMD_ENABLED, batches grow from BATCH_MAX_ITEMS up to this
+BATCH_LATENCY_TARGET = 30      # seconds; a batch p95 above this shrinks the batches
+
+# Rows per batch adapt like the per-key concurrency: larger while replies come back
+# complete and in time, smaller after 429s, timeouts, slow or incomplete replies.
+batch_size = AIMDController("gemini batch size", BATCH_MAX_ITEMS, minimum=1, maximum=BATCH_MAX_ITEMS_LIMIT,
+                            latency_target=BATCH_LATENCY_TARGET)
+
+# Multi-keyword explain -------------------------------------
+KEYWORDS_MIN_OVERLAP_WORDS = 20   # context windows sharing at least this many words are merged
+
+
+def system_prompt(usage_indicators: list = None) -> str:
+    """
+    The static rule block of the analysis prompt. It is identical for every row (given the
+    indicator list), so it goes first and is sent as a cached system prefix.
+    """
     if usage_indicators is None:
         usage_indicators = target
     # this will kep my code to work with older and new main function together.
     indicators_str = ", ".join([f"'{ind}'" for ind in usage_indicators])
 
-    prompt = f"""
-    You are an objective and meticulous technology analyst. Your primary task is to make a balanced and evidence-based judgment to determine if **{company_name}** is actively and demonstrably using, supporting, developing, or deploying the technology or concept of **'{keyword_tech}'**, based *only* on the provided text.
+    return f"""
+    You are an objective and meticulous technology analyst. Your primary task is to make a balanced and evidence-based judgment to determine if the **company** named in the Analysis Task is actively and demonstrably using, supporting, developing, or deploying the **technology** or concept named in the Analysis Task, based *only* on the provided text.
 
     Your goal is to weigh the positive evidence against the strict exclusion rules to make a final, justifiable determination.
 
@@ -72,6 +112,19 @@ def explain(chunk_text: str, keyword_tech: str, company_name: str,page_url: str,
         * **Speculation:** The text uses conditional or future-looking language (e.g., "might use," "could explore," "plans to adopt").
 
     ---
+    ### **3. Answer Format**
+
+    Provide your answer in a JSON format with two keys: "uses_tech" and "explanation".
+
+    1.  `uses_tech`: A boolean (true/false) value based on a balanced application of the rules above.
+    2.  `explanation`: A single-line, JSON-safe string that justifies the answer. It must quote the key evidence and explicitly name the primary rule that was applied. Example for a false answer: `"The text mentions 'AWS Education Research Grant' which fails the 'CRITICAL - Educational or Certification Use' rule because it describes academic activity, not operational use."` Example for a true answer: `"The text states 'our entire platform is built on AWS' which meets the 'Direct Company Statements' positive indicator."`
+
+    """
+
+
+def task_prompt(chunk_text, keyword_tech: str, company_name: str) -> str:
+    """The per-row part of the analysis prompt, sent after the system prefix."""
+    return f"""
     ### **Analysis Task**
 
     **Company:** `{company_name}`
@@ -81,41 +134,508 @@ def explain(chunk_text: str, keyword_tech: str, company_name: str,page_url: str,
 
     ---
 
-    Provide your answer in a JSON format with two keys: "uses_tech" and "explanation".
+    Apply the rules to this company and technology and answer in the JSON format described above.
+    """
 
-    1.  `uses_tech`: A boolean (true/false) value based on a balanced application of the rules above.
-    2.  `explanation`: A single-line, JSON-safe string that justifies the answer. It must quote the key evidence and explicitly name the primary rule that was applied. Example for a false answer: `"The text mentions 'AWS Education Research Grant' which fails the 'CRITICAL - Educational or Certification Use' rule because it describes academic activity, not operational use."` Example for a true answer: `"The text states 'our entire platform is built on AWS' which meets the 'Direct Company Statements' positive indicator."`
 
+def build_prompt(chunk_text, keyword_tech: str, company_name: str, usage_indicators: list = None) -> str:
+    """The whole single-row prompt as one text (offline batch jobs, verdict-cache versioning)."""
+    return system_prompt(usage_indicators) + task_prompt(chunk_text, keyword_tech, company_name)
+
+
+def parse_verdict(text: str) -> dict:
     """
+    Parses a single-row model reply into {"uses_tech", "explanation"}. Fenced, wrapped or
+    truncated JSON is repaired; raises VerdictParseError when there is no verdict in it.
+    """
+    return salvage_verdict(text)
+
+
+def error_verdict(error) -> dict:
+    """Verdict for a row the LLM could not answer; "retry_later" rows are kept out of the checkpoint."""
+    return {"uses_tech": False, "explanation": f"API or parsing error: {error}",
+            "retry_later": isinstance(error, NoHealthyKeys)}
+
+
+def explain(chunk_text: str, keyword_tech: str, company_name: str,page_url: str, usage_indicators: list = None,
+            on_verdict=None) -> dict:
+    """
+    Verdict dict for one row. With parsing.STREAM_RESPONSES, on_verdict(uses_tech) is
+    called as soon as the verdict arrives, before the explanation has finished streaming.
+    """
+    on_verdict = once(on_verdict)
+    system = system_prompt(usage_indicators)
+    task = task_prompt(chunk_text, keyword_tech, company_name)
+    version = template_version(usage_indicators)
+
+    # Identical inputs under the same model and prompt text were already judged
+    cache_key = verdict_cache.key(company_name, keyword_tech, chunk_text, GEMINI_MODEL, version)
+    if (cached := verdict_cache.get(cache_key)) is not None:
+        print(f"--> Verdict cache hit for keyword '{keyword_tech}'")
+        return cached
 
     try:
+        # Only a reply that cannot be salvaged is asked again (once)
+        with usage_context(kind="single", page_url=page_url, keyword=keyword_tech, prompt_version=version):
+            verdict = verdict_with_retry(lambda text: _generate(text, system=system, on_verdict=on_verdict), task)
+        verdict_cache.put(cache_key, verdict)
+        return verdict
+    except Exception as e:
+        print(f"Error calling Gemini API or parsing response for keyword '{keyword_tech}': {e}")
+        return error_verdict(e)
 
-        # Key Rotation logic
-        # current_key = random.choice(API_KEYS)
-        # current_key = ""
-        current_key = next(key_cycler)
-        print(f"--> Using API Key ending in: ...{current_key[-4:]}")
-        # Call Gemini API
-        genai.configure(api_key=current_key)
-
-        # model = genai.GenerativeModel('gemini-1.5-flash')
-        model = genai.GenerativeModel('gemini-2.0-flash-lite-001')
-
-        # response = model.generate_content(prompt)
-        response = model.generate_content(
-            prompt,
-            request_options={"timeout": 300}
-        )
-        # Clean and parse JSON response
-        cleaned_text = response.text.strip().replace("```json\n", "").replace("\n```", "")
-        parsed_response = json.loads(cleaned_text)
-        return {
-            "uses_tech": parsed_response.get("uses_tech", False),
-            "explanation": parsed_response.get("explanation", "No explanation from LLM.")
-        }
+def _generate(prompt: str, system: str = None, schema: dict = VERDICT_SCHEMA, retry_rate_limits: bool = True,
+              on_verdict=None) -> str:
+    """
+    Sends one prompt to Gemini on whichever key has capacity and returns the raw response text.
+    A `system` prefix is served from that key's context cache when possible, and the reply
+    is constrained to JSON matching `schema`. Single verdicts are streamed when
+    parsing.STREAM_RESPONSES is set; the key's slot is then released as soon as the verdict
+    arrives, and on_verdict(uses_tech) is called. A 429 is retried on another key unless
+    retry_rate_limits is False, in which case it is raised at once (the Router fails over).
+    """
+    tokens = estimate_tokens(prompt) + estimate_tokens(system or "") + OUTPUT_TOKENS_ESTIMATE
+    stream = parsing.STREAM_RESPONSES and schema is VERDICT_SCHEMA
+    max_retries = MAX_RATE_LIMIT_RETRIES if retry_rate_limits else 0
+    for attempt in range(max_retries + 1):
+        # Key Rotation logic: the pool picks the key with the most headroom
+        queued = time.perf_counter()
+        state = key_pool.acquire(tokens)
+        started = time.perf_counter()
+        print(f"--> Using API Key ending in: ...{state.suffix}")
+        released = []
+
+        def verdict_arrived(uses_tech: bool, state=state, started=started):
+            # The rest of the stream is only explanation; let the next call have this slot
+            key_pool.release(state, latency=time.perf_counter() - started)
+            released.append(True)
+            if on_verdict:
+                on_verdict(uses_tech)
+        try:
+            # Call Gemini API on the long-lived client for this key
+            # model = gemini_model(state.key, 'gemini-1.5-flash')
+            model = prefix_cache.model(state.key, system) if system else gemini_model(state.key, GEMINI_MODEL)
+
+            response = model.generate_content(
+                prompt,
+                generation_config=gemini_generation_config(schema),
+                stream=stream,
+                request_options={"timeout": REQUEST_TIMEOUT}
+            )
+            # Stream errors surface while reading, so the key is not released before that
+            text = read_stream(_chunk_texts(response), verdict_arrived) if stream else None
+        except Exception as e:
+            usage_log.record("gemini", GEMINI_MODEL, state.suffix, latency=time.perf_counter() - started,
+                             wait=started - queued, retries=attempt, error=e)
+            if is_rate_limited(e):
+                key_pool.penalize(state, error=e)
+                if attempt < max_retries:
+                    continue
+            else:
+                key_pool.release(state, ok=False, error=e)
+            raise
+        if not released:
+            key_pool.release(state, latency=time.perf_counter() - started)
+        prefix_cache.record_usage(response)
+        text = response.text if text is None else text
+        _record_usage(response, text, prompt, system, state.suffix, started, queued, attempt)
+        return text
+
+
+async def _generate_async(prompt: str, system: str = None, schema: dict = VERDICT_SCHEMA, on_verdict=None) -> str:
+    """Async _generate. Many of these run at once, each on a key that has capacity."""
+    tokens = estimate_tokens(prompt) + estimate_tokens(system or "") + OUTPUT_TOKENS_ESTIMATE
+    stream = parsing.STREAM_RESPONSES and schema is VERDICT_SCHEMA
+    for attempt in range(MAX_RATE_LIMIT_RETRIES + 1):
+        queued = time.perf_counter()
+        state = await key_pool.acquire_async(tokens)
+        started = time.perf_counter()
+        released = []
+
+        def verdict_arrived(uses_tech: bool, state=state, started=started):
+            key_pool.release(state, latency=time.perf_counter() - started)
+            released.append(True)
+            if on_verdict:
+                on_verdict(uses_tech)
+        try:
+            model = prefix_cache.async_model(state.key, system) if system else gemini_async_model(state.key, GEMINI_MODEL)
+            response = await model.generate_content_async(
+                prompt,
+                generation_config=gemini_generation_config(schema),
+                stream=stream,
+                request_options={"timeout": REQUEST_TIMEOUT}
+            )
+            text = await read_stream_async(_chunk_texts_async(response), verdict_arrived) if stream else None
+        except Exception as e:
+            usage_log.record("gemini", GEMINI_MODEL, state.suffix, latency=time.perf_counter() - started,
+                             wait=started - queued, retries=attempt, error=e)
+            if is_rate_limited(e):
+                key_pool.penalize(state, error=e)
+                if attempt < MAX_RATE_LIMIT_RETRIES:
+                    continue
+            else:
+                key_pool.release(state, ok=False, error=e)
+            raise
+        if not released:
+            key_pool.release(state, latency=time.perf_counter() - started)
+        prefix_cache.record_usage(response)
+        text = response.text if text is None else text
+        _record_usage(response, text, prompt, system, state.suffix, started, queued, attempt)
+        return text
+
+
+def _record_usage(response, text: str, prompt: str, system: str, key_suffix: str, started: float,
+                  queued: float, attempt: int):
+    # Streams cut short may not report usage; fall back to estimates for those
+    usage_log.record("gemini", GEMINI_MODEL, key_suffix, gemini_usage(response),
+                     latency=time.perf_counter() - started, wait=started - queued, retries=attempt,
+                     estimated={"input_tokens": estimate_tokens(prompt) + estimate_tokens(system or ""),
+                                "output_tokens": estimate_tokens(text)})
+
+
+def _chunk_texts(response):
+    """Text of each streamed chunk (chunks that carry only metadata yield "")."""
+    for chunk in response:
+        yield "".join(part.text for candidate in chunk.candidates[:1] for part in candidate.content.parts)
+
+
+async def _chunk_texts_async(response):
+    async for chunk in response:
+        yield "".join(part.text for candidate in chunk.candidates[:1] for part in candidate.content.parts)
+
+
+# Concurrent explain ========================================================
+# explain_many() runs many independent explain calls at once. Concurrency is
+# PER_KEY_CONCURRENCY x number of keys (with AIMD: each key's adaptive limit), and
+# each call still waits for its key's RPM/TPM buckets, so adding keys adds throughput
+# without adding 429s.
+
+async def explain_async(chunk_text, keyword_tech: str, company_name: str, page_url: str = "",
+                        usage_indicators: list = None, on_verdict=None) -> dict:
+    on_verdict = once(on_verdict)
+    system = system_prompt(usage_indicators)
+    task = task_prompt(chunk_text, keyword_tech, company_name)
+    version = template_version(usage_indicators)
+    cache_key = verdict_cache.key(company_name, keyword_tech, chunk_text, GEMINI_MODEL, version)
+    if (cached := verdict_cache.get(cache_key)) is not None:
+        return cached
+    try:
+        with usage_context(kind="single", page_url=page_url, keyword=keyword_tech, prompt_version=version):
+            verdict = await verdict_with_retry_async(
+                lambda text: _generate_async(text, system=system, on_verdict=on_verdict), task)
+        verdict_cache.put(cache_key, verdict)
+        return verdict
     except Exception as e:
         print(f"Error calling Gemini API or parsing response for keyword '{keyword_tech}': {e}")
-        return {"uses_tech": False, "explanation": f"API or parsing error: {e}"}
+        return error_verdict(e)
+
+
+_loop = None
+
+
+def _event_loop() -> asyncio.AbstractEventLoop:
+    """One event loop for the whole run, so the per-loop async clients are reused across calls."""
+    global _loop
+    if _loop is None or _loop.is_closed():
+        _loop = asyncio.new_event_loop()
+    return _loop
+
+
+def explain_many(items: list, usage_indicators: list = None, on_verdict=None) -> list:
+    """
+    Concurrent counterpart of explain() for a list of items (dicts with chunk_text,
+    keyword_tech, company_name, page_url). Returns verdicts in the same order.
+    With streaming, on_verdict(item id, uses_tech) is called as each verdict arrives.
+    """
+    async def run():
+        # With AIMD the pool holds each key to its current limit; this only caps the total
+        per_key = aimd.MAX_CONCURRENCY if aimd.AIMD_ENABLED else PER_KEY_CONCURRENCY
+        semaphore = asyncio.Semaphore(max(1, len(key_pool) * per_key))
+
+        async def one(item):
+            await semaphore.acquire()
+            held = [True]
+
+            def verdict_arrived(uses_tech: bool):
+                # Only the explanation is still streaming; the next item can start
+                if held:
+                    held.clear()
+                    semaphore.release()
+                if on_verdict:
+                    on_verdict(item.get("id"), uses_tech)
+            try:
+                return await explain_async(item["chunk_text"], item["keyword_tech"], item["company_name"],
+                                           item.get("page_url", ""), usage_indicators, verdict_arrived)
+            finally:
+                if held:
+                    semaphore.release()
+
+        return await asyncio.gather(*(one(item) for item in items))
+
+    return list(_event_loop().run_until_complete(run())) if items else []
+
+
+
+# Batched explain ===========================================================
+# Several independent rows share one request, so the rule block (the same system
+# prefix as explain(), context cache included) is sent once per batch instead of once
+# per row. Each row carries an id and the model answers with a JSON array of verdicts
+# keyed by those ids.
+
+def estimate_tokens(text) -> int:
+    """Cheap token estimate (~4 characters per token) used for batch budgeting."""
+    return len(str(text)) // 4 + 1
+
+
+def plan_batches(items: list, max_items: int = BATCH_MAX_ITEMS, token_budget: int = BATCH_TOKEN_BUDGET) -> list:
+    """Greedily groups items into batches that stay within `max_items` and `token_budget`."""
+    batches, current, current_tokens = [], [], 0
+    for item in items:
+        tokens = estimate_tokens(item["chunk_text"])
+        if current and (len(current) >= max_items or current_tokens + tokens > token_budget):
+            batches.append(current)
+            current, current_tokens = [], 0
+        current.append(item)
+        current_tokens += tokens
+    if current:
+        batches.append(current)
+    return batches
+
+
+def batch_task_prompt(items: list) -> str:
+    """The per-batch part of the batched prompt, sent after the same system prefix as explain()."""
+    rows = [
+        {
+            "id": str(item["id"]),
+            "company": item["company_name"],
+            "technology": item["keyword_tech"],
+            "text": item["chunk_text"],
+        }
+        for item in items
+    ]
+    return f"""
+    ### **Analysis Task**
+
+    You will receive several independent analysis items. Each item names its own **company** and **technology**; judge every item separately and based *only* on that item's text. Never use one item's text to judge another item.
+
+    ### **Items to Analyze (JSON)**
+
+    {json.dumps(rows, ensure_ascii=False)}
+
+    ---
+
+    Apply the rules to each item. Instead of a single JSON object, answer with a JSON array containing exactly one object per item, in any order, each with three keys: `id` (the item's id, copied exactly), `uses_tech` and `explanation` as described above.
+    """
+
+
+def _parse_batch_response(text: str) -> dict:
+    """
+    Maps id -> verdict for every well-formed entry; malformed entries are simply absent.
+    A reply cut off mid-array still yields the entries completed before the cut.
+    """
+    verdicts = {}
+    for entry in salvage_list(text):
+        if isinstance(entry, dict) and "id" in entry and isinstance(entry.get("uses_tech"), bool):
+            verdicts[str(entry["id"])] = {
+                "uses_tech": entry["uses_tech"],
+                "explanation": entry.get("explanation") or "No explanation from LLM.",
+            }
+    return verdicts
+
+
+def explain_batch(items: list, usage_indicators: list = None) -> list:
+    """
+    Batched counterpart of explain(). `items` are dicts with id, chunk_text, keyword_tech,
+    company_name and page_url. Returns one verdict per item, in the same order. Items the
+    batch reply does not cover (partial parse failure) fall back to a per-row explain().
+    """
+    system = system_prompt(usage_indicators)
+    version = batch_template_version(usage_indicators)
+    cache_keys = {
+        str(item["id"]): verdict_cache.key(item["company_name"], item["keyword_tech"], item["chunk_text"],
+                                           GEMINI_MODEL, version)
+        for item in items
+    }
+    verdicts = {}
+    for item in items:
+        if (cached := verdict_cache.get(cache_keys[str(item["id"])])) is not None:
+            verdicts[str(item["id"])] = cached
+    uncached = [item for item in items if str(item["id"]) not in verdicts]
+
+    max_items = batch_size.value if aimd.AIMD_ENABLED else BATCH_MAX_ITEMS
+    for batch in plan_batches(uncached, max_items=max_items):
+        if len(batch) == 1:
+            continue  # nothing to share; the fallback below makes the plain call
+        try:
+            print(f"--> Batched explain: {len(batch)} rows in one request")
+            started = time.perf_counter()
+            with usage_context(kind="batch", rows=len(batch), page_url=None, prompt_version=version):
+                answered = _parse_batch_response(_generate(batch_task_prompt(batch), system=system,
+                                                           schema=BATCH_SCHEMA))
+            # Only ids of this batch count: a made-up or shifted id must not answer for a
+            # row the model skipped (that row falls back to explain() below)
+            batch_ids = {str(item["id"]) for item in batch}
+            answered = {item_id: verdict for item_id, verdict in answered.items() if item_id in batch_ids}
+            if len(answered) < len(batch):
+                batch_size.on_overload("incomplete")
+            else:
+                batch_size.on_success(time.perf_counter() - started)
+            for item_id, verdict in answered.items():
+                verdict_cache.put(cache_keys[item_id], verdict)
+            verdicts.update(answered)
+        except Exception as e:
+            if is_rate_limited(e) or is_timeout(e):
+                batch_size.on_overload("429" if is_rate_limited(e) else "timeout")
+            print(f"Error calling Gemini API for a batch of {len(batch)} rows: {e}")
+
+    results = []
+    for item in items:
+        verdict = verdicts.get(str(item["id"]))
+        if verdict is None:
+            verdict = explain(chunk_text=item["chunk_text"], keyword_tech=item["keyword_tech"],
+                              company_name=item["company_name"], page_url=item.get("page_url", ""),
+                              usage_indicators=usage_indicators)
+        results.append(verdict)
+    return results
+
+
+# Multi-keyword explain =====================================================
+# A URL with several keyword rows is judged in one request: the keywords' context
+# windows (cut from the same page text, so they often overlap) are merged, and the
+# model answers with one verdict per keyword. Same system prefix as explain(), so the
+# context cache still applies.
+
+def keywords_task_prompt(chunk_text, keywords: list, company_name: str) -> str:
+    """The per-URL part of the multi-keyword prompt, sent after the system prefix."""
+    return f"""
+    ### **Analysis Task**
+
+    **Company:** `{company_name}`
+    **Technologies:** `{json.dumps(keywords, ensure_ascii=False)}`
+
+    **Text to Analyze:** `{chunk_text}`
+
+    ---
+
+    Apply the rules to this company and to **each technology separately**, judging each one only on what the text says about it. Instead of a single JSON object, answer with a JSON array containing exactly one object per technology, each with three keys: `keyword` (the technology, copied exactly), `uses_tech` and `explanation` as described above.
+    """
+
+
+def _join_windows(a: list, b: list) -> list:
+    """a and b merged into one word sequence if one contains or continues the other, else None."""
+    head = b[:KEYWORDS_MIN_OVERLAP_WORDS]
+    for start in range(len(a) - len(head) + 1):
+        if a[start:start + len(head)] == head:
+            tail = a[start:]
+            if b[:len(tail)] == tail:
+                return a + b[len(tail):]
+            if tail[:len(b)] == b:
+                return a
+    return None
+
+
+def merge_contexts(contexts_by_keyword: dict) -> list:
+    """
+    One list of {"keywords", "context"} windows for all keywords of a URL. Identical and
+    overlapping windows are joined, so text shared by several keywords is sent once.
+    """
+    merged = []   # [keywords, words]
+    for keyword, contexts in contexts_by_keyword.items():
+        for item in contexts if isinstance(contexts, list) else [contexts]:
+            text = item.get("context") if isinstance(item, dict) else item
+            if not isinstance(text, str) or not text.strip():
+                continue
+            words = text.split()
+            for entry in merged:
+                joined = _join_windows(entry[1], words) or _join_windows(words, entry[1])
+                if joined is not None:
+                    entry[1] = joined
+                    entry[0] += [keyword] if keyword not in entry[0] else []
+                    break
+            else:
+                merged.append([[keyword], words])
+    return [{"keywords": keywords, "context": " ".join(words)} for keywords, words in merged]
+
+
+def _parse_keywords_response(text: str, keywords: list) -> dict:
+    """Maps keyword -> verdict for every well-formed entry (keywords matched case-insensitively)."""
+    by_name = {k.strip().lower(): k for k in keywords}
+    verdicts = {}
+    for entry in salvage_list(text):
+        if not isinstance(entry, dict) or not isinstance(entry.get("uses_tech"), bool):
+            continue
+        keyword = by_name.get(str(entry.get("keyword", "")).strip().lower())
+        if keyword is not None:
+            verdicts[keyword] = {"uses_tech": entry["uses_tech"],
+                                 "explanation": entry.get("explanation") or "No explanation from LLM."}
+    return verdicts
+
+
+def explain_keywords(contexts_by_keyword: dict, company_name: str, page_url: str = "",
+                     usage_indicators: list = None) -> dict:
+    """
+    Multi-keyword counterpart of explain() for one URL: `contexts_by_keyword` maps each
+    keyword to its contexts, and the result maps each keyword to its verdict. Keywords
+    the reply does not cover fall back to a per-keyword explain() on their own contexts.
+    """
+    keywords = list(contexts_by_keyword)
+    merged = merge_contexts(contexts_by_keyword)
+    system = system_prompt(usage_indicators)
+    version = keywords_template_version(usage_indicators)
+
+    cache_keys = {k: verdict_cache.key(company_name, k, merged, GEMINI_MODEL, version) for k in keywords}
+    verdicts = {}
+    for keyword in keywords:
+        if (cached := verdict_cache.get(cache_keys[keyword])) is not None:
+            verdicts[keyword] = cached
+    uncached = [k for k in keywords if k not in verdicts]
+
+    if len(uncached) > 1:
+        try:
+            print(f"--> Multi-keyword explain: {len(uncached)} keywords of {page_url} in one request")
+            with usage_context(kind="keywords", rows=len(uncached), page_url=page_url, prompt_version=version):
+                answered = _parse_keywords_response(
+                    _generate(keywords_task_prompt(merged, uncached, company_name), system=system,
+                              schema=KEYWORDS_SCHEMA), uncached)
+            for keyword, verdict in answered.items():
+                verdict_cache.put(cache_keys[keyword], verdict)
+            verdicts.update(answered)
+        except Exception as e:
+            print(f"Error calling Gemini API for {len(uncached)} keywords of {page_url}: {e}")
+
+    for keyword in keywords:
+        if keyword not in verdicts:
+            verdicts[keyword] = explain(chunk_text=contexts_by_keyword[keyword], keyword_tech=keyword,
+                                        company_name=company_name, page_url=page_url,
+                                        usage_indicators=usage_indicators)
+    return verdicts
+
+# Prompt fingerprints for the verdict cache: editing either prompt above invalidates its entries
+PROMPT_VERSION = prompt_version(build_prompt("\x00chunk", "\x00keyword", "\x00company"))
+
+
+def template_version(usage_indicators: list = None) -> str:
+    """Fingerprint of the single-row prompt template (not of one row's prompt) for these indicators."""
+    if usage_indicators is None or usage_indicators == target:
+        return PROMPT_VERSION
+    return prompt_version(build_prompt("\x00chunk", "\x00keyword", "\x00company", usage_indicators))
+
+BATCH_PROMPT_VERSION = prompt_version(system_prompt() + batch_task_prompt([]))
+KEYWORDS_PROMPT_VERSION = prompt_version(system_prompt() + keywords_task_prompt("\x00chunk", ["\x00keyword"], "\x00company"))
+
+
+def keywords_template_version(usage_indicators: list = None) -> str:
+    """Fingerprint of the multi-keyword prompt template for these indicators."""
+    if usage_indicators is None or usage_indicators == target:
+        return KEYWORDS_PROMPT_VERSION
+    return prompt_version(system_prompt(usage_indicators) + keywords_task_prompt("\x00chunk", ["\x00keyword"],
+                                                                                  "\x00company"))
+
+def batch_template_version(usage_indicators: list = None) -> str:
+    """Fingerprint of the batched prompt template for these indicators."""
+    if usage_indicators is None or usage_indicators == target:
+        return BATCH_PROMPT_VERSION
+    return prompt_version(system_prompt(usage_indicators) + batch_task_prompt([]))
 
 # Test -------------------
 # """
@@ -8,6 +8,9 @@ from datetime import datetime, date
 from typing import Optional, Tuple
 # from pdf_3 import *
 from extract.pdf_3 import *
+from extract.date_regex import cache_stats, find_date, memoized, precompute_dates, precomputed_date
+from extract.sitemap_date import last_modified_header, sitemap_lastmod
+from extract.structured_data import extract_metadata, page_metadata
 
 # --- Configuration Constants ---
 # USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
@@ -18,10 +21,28 @@ MAX_FUTURE_YEAR_OFFSET = 0
 
 # --- Private Helper Functions for Each Step ---
 
+def _first_date(text: str) -> Optional[date]:
+    """Compiled regex fast path first; datefinder only when it finds nothing."""
+    if dt := find_date(text, min_year=2002, max_year=datetime.now().year + MAX_FUTURE_YEAR_OFFSET):
+        return dt
+    found_dates = list(find_dates(text))
+    if found_dates:
+        dt = found_dates[0]
+        if 2001 < dt.year <= datetime.now().year + MAX_FUTURE_YEAR_OFFSET:
+            return dt.date()
+    return None
+
+
 def _parse_and_get_date(date_string: str) -> Optional[date]:
     """Safely parses a string and returns only the date part."""
-    if not date_string:
+    if not date_string or not isinstance(date_string, str):
         return None
+    return _parse_date_string(date_string)
+
+
+@memoized
+def _parse_date_string(date_string: str) -> Optional[date]:
+    """Memoized for the run: dateutil's fuzzy parse is expensive and meta values repeat across a site."""
     try:
         # fuzzy=True helps parse dates from surrounding text
         dt_object = parse(date_string, fuzzy=True)
@@ -32,47 +53,24 @@ def _parse_and_get_date(date_string: str) -> Optional[date]:
         return None
 
 
+@memoized
 def _find_date_in_url(url: str) -> Optional[date]:
     """Step 1: Find a plausible date within the URL string."""
-    found_dates = list(find_dates(url))
-    if found_dates:
-        first_date = found_dates[0]
-        # Sanity check to avoid matching version numbers like /v2024/
-        # This line helps use limit the date range
-        if 2001 < first_date.year <= datetime.now().year + MAX_FUTURE_YEAR_OFFSET:
-            return first_date.date()
-    return None
+    # Resolved up front for the whole input by precompute_url_dates
+    if dt := precomputed_date(url, min_year=2002, max_year=datetime.now().year + MAX_FUTURE_YEAR_OFFSET):
+        return dt
+    # The year bounds in _first_date avoid matching version numbers like /v2024/
+    return _first_date(url)
 
 
-def _find_date_in_metadata(soup: BeautifulSoup) -> Tuple[Optional[date], Optional[str]]:
-    """Step 2: Search structured metadata (JSON-LD, meta tags). This is highly reliable."""
-    # 2a: JSON-LD (often used by news sites and blogs)
-    json_ld_keys = ['dateModified','datePublished', 'publishedDate', 'dateCreated', 'uploadDate']
-    for script in soup.find_all('script', type='application/ld+json'):
-        try:
-            data = json.loads(script.string)
-            for key in json_ld_keys:
-                if dt := _parse_and_get_date(data.get(key)):
-                    return dt, "json-ld"
-        except (json.JSONDecodeError, TypeError):
-            continue
-
-    # 2b: Meta Tags
-    # ------------------------------------------------------------------------
-    # last modified this list
-
-    meta_selectors = {
-        "meta[name='dateModified']": "meta_tag",
-        "meta[property='article:modified_time']": "meta_tag",
-        "meta[name='datePublished']": "meta_tag",
-        "meta[property='article:published_time']": "meta_tag",
-        "meta[name='pubdate']": "meta_tag",
-        "meta[name='date']": "meta_tag",
-    }
-    for selector, method in meta_selectors.items():
-        if tag := soup.select_one(selector):
-            if dt := _parse_and_get_date(tag.get('content')):
-                return dt, method
+def _find_date_in_metadata(metadata: dict) -> Tuple[Optional[date], Optional[str]]:
+    """
+    Step 2: Search structured metadata (JSON-LD, microdata, RDFa, meta tags). This is highly reliable.
+    Reads the single-pass record from structured_data instead of re-walking the soup.
+    """
+    for value, method in metadata.get("dates", []):
+        if dt := _parse_and_get_date(value):
+            return dt, method
     return None, None
 
 
@@ -89,20 +87,11 @@ def _find_date_in_visible_text(soup: BeautifulSoup, text: str) -> Optional[date]
     for selector in date_selectors:
         for tag in soup.select(selector):
             tag_text = tag.get_text() or tag.get('datetime', '')
-            found_dates = list(find_dates(tag_text))
-            if found_dates:
-                dt = found_dates[0]
-                if 2001 < dt.year <= datetime.now().year + MAX_FUTURE_YEAR_OFFSET:
-                    return dt.date()
+            if dt := _first_date(tag_text):
+                return dt
 
     # 3b: Fallback to a broader search on the first 10,000 characters
-    found_dates = list(find_dates(text[:10000]))
-    if found_dates:
-        dt = found_dates[0]
-        if 2001 < dt.year <= datetime.now().year + MAX_FUTURE_YEAR_OFFSET:
-            return dt.date()
-
-    return None
+    return _first_date(text[:10000])
 
 
 def _find_date_in_copyright(text: str) -> Optional[date]:
@@ -118,12 +107,63 @@ def _find_date_in_copyright(text: str) -> Optional[date]:
     return None
 
 
+def _copyright_text(soup: BeautifulSoup) -> str:
+    """The keyword-stage text leaves out <footer>, which is where copyright lines live."""
+    return " ".join(tag.get_text(separator=' ', strip=True) for tag in soup.find_all('footer'))
+
+
+def _date_strategies(url: str, soup: BeautifulSoup, text: Optional[str], headers=None, metadata=None):
+    """
+    Yields (date, method) for each step in order of reliability. It is a generator so
+    that later (more expensive) steps never run once a caller has a confident hit.
+    """
+    # Step 1: Check the URL itself (fast and often accurate)
+    yield _find_date_in_url(url), "url_path"
+
+    # Step 1b: Free signals that need no DOM work (sitemap is cached per domain)
+    yield sitemap_lastmod(url), "sitemap_lastmod"
+    yield last_modified_header(headers), "http_last_modified"
+
+    # Step 2: Check structured metadata (very reliable)
+    if metadata is None:
+        metadata = extract_metadata(str(soup), url, soup)
+    yield _find_date_in_metadata(metadata)
+
+    # Step 3: Perform the improved search on visible page text
+    if text is None:
+        text = soup.get_text(separator=' ', strip=True)
+    yield _find_date_in_visible_text(soup, text), "body_text_targeted"
+
+    # Step 4: As a last resort, check for a copyright year
+    yield _find_date_in_copyright(text) or _find_date_in_copyright(_copyright_text(soup)), "copyright_inference"
+
+
 # --- Main Public Function ---
 
+def find_best_date_in_document(url: str, soup: BeautifulSoup, text: Optional[str] = None,
+                               headers=None, metadata: Optional[dict] = None) -> Tuple[Optional[str], str]:
+    """
+    Finds the best date from an already parsed page, so no extra download or parse is needed.
+    `text` is the cleaned text from the keyword stage; when omitted it is derived from `soup`.
+    `headers` are the page's response headers (for Last-Modified) and `metadata` its
+    structured_data record; when omitted it is only built if the earlier steps find nothing.
+    """
+    for dt, method in _date_strategies(url, soup, text, headers, metadata):
+        if dt:
+            return dt.strftime("%m/%Y"), method
+    return None, "not_found"
+
+
 def find_best_date_on_page(url: str) -> Tuple[Optional[str], str]:
     """
     Finds the best possible date on a webpage using a prioritized 4-step strategy.
     """
+    # A date in the URL or the sitemap needs no download of the page at all
+    if dt := _find_date_in_url(url):
+        return dt.strftime("%m/%Y"), "url_path"
+    if dt := sitemap_lastmod(url):
+        return dt.strftime("%m/%Y"), "sitemap_lastmod"
+
     try:
         response = requests.get(url, headers={'User-Agent': USER_AGENT}, timeout=REQUEST_TIMEOUT)
         response.raise_for_status()
@@ -132,26 +172,8 @@ def find_best_date_on_page(url: str) -> Tuple[Optional[str], str]:
         # Let the main script handle the error by re-raising it
         raise
 
-    # --- Execute search strategy in order of reliability ---
-
-    # Step 1: Check the URL itself (fast and often accurate)
-    if dt := _find_date_in_url(url):
-        return dt.strftime("%m/%Y"), "url_path"
-
-    # Step 2: Check structured metadata (very reliable)
-    if (dt_meta := _find_date_in_metadata(soup))[0]:
-        return dt_meta[0].strftime("%m/%Y"), dt_meta[1]
-
-    # Step 3: Perform the improved search on visible page text
-    text_to_search = soup.get_text(separator=' ', strip=True)
-    if dt := _find_date_in_visible_text(soup, text_to_search):
-        return dt.strftime("%m/%Y"), "body_text_targeted"
-
-    # Step 4: As a last resort, check for a copyright year
-    if dt := _find_date_in_copyright(text_to_search):
-        return dt.strftime("%m/%Y"), "copyright_inference"
-
-    return None, "not_found"
+    page = {"url": url, "html": response.text, "headers": response.headers, "soup": soup}
+    return find_best_date_in_document(url, soup, headers=response.headers, metadata=page_metadata(page))
 
 def date_pdf (url: str):
     try:
@@ -177,4 +199,24 @@ def date_me(url):
         # print(f"Method: {method}\n")
         return found_date
     except Exception as e:
-        print(f"An unexpected error occurred: {e}")
\ No newline at end of file
+        print(f"An unexpected error occurred: {e}")
+
+
+def date_from_page(page: dict) -> Tuple[Optional[str], str]:
+    """date_me for a page record from normal_3.load_page: reuses its soup and cleaned text."""
+    try:
+        return find_best_date_in_document(page["url"], page["soup"], page.get("text"), page.get("headers"),
+                                          page_metadata(page))
+    except Exception as e:
+        print(f"An unexpected error occurred: {e}")
+        return None, "error"
+
+
+def precompute_url_dates(urls) -> int:
+    """Resolves URL dates for a whole input column in one vectorized pass, before any fetching."""
+    return precompute_dates(urls)
+
+
+def date_cache_stats() -> dict:
+    """Hit-rate counters of the memoized date helpers (see extract.date_regex.cache_stats)."""
+    return cache_stats()
@@ -0,0 +1,223 @@
+import re
+import time
+from datetime import date, datetime
+from functools import lru_cache
+from typing import Iterator, Optional
+
+import pandas as pd
+
+# find_date is the main function.
+# A compiled, multi-format date matcher that runs ahead of datefinder. It only
+# recognises real date shapes (ISO, "March 2023", "12 March 2023", "03/2023", ...),
+# so it is both much faster and far less noisy than datefinder on page text.
+
+# --- Configuration Constants ---
+MIN_YEAR = 2001
+MAX_FUTURE_YEAR_OFFSET = 0
+DATE_CACHE_SIZE = 4096    # per memoized helper, for the whole run
+
+MONTHS = {
+    "jan": 1, "feb": 2, "mar": 3, "apr": 4, "may": 5, "jun": 6,
+    "jul": 7, "aug": 8, "sep": 9, "oct": 10, "nov": 11, "dec": 12,
+}
+
+_MONTH = (r"(?:jan(?:uary)?|feb(?:ruary)?|mar(?:ch)?|apr(?:il)?|may|june?|july?|aug(?:ust)?"
+          r"|sep(?:t(?:ember)?)?|oct(?:ober)?|nov(?:ember)?|dec(?:ember)?)")
+_YEAR = r"(?:19|20)\d{2}"
+_MM = r"(?:0?[1-9]|1[0-2])"
+_DD = r"(?:0?[1-9]|[12]\d|3[01])"
+_SEP = r"[\s\-_]+"  # spaces in text, dashes/underscores in URL slugs
+
+# Alternatives are tried left to right at each position, so longer forms come first.
+# A single alternation means one scan of the text and the earliest date wins,
+# which matches the "first date on the page" behaviour of datefinder.
+# The all-numeric forms must not follow a digit or "-" (phone numbers, "555-12-2023"),
+# and month/year takes no "." separator (version numbers, "Version 3.2023").
+DATE_PATTERN = re.compile(
+    rf"""
+    (?<![\w.])(?:
+        (?P<iso_y>{_YEAR})[-/.](?P<iso_m>{_MM})(?:[-/.](?P<iso_d>{_DD}))?(?!\d)              # 2023-03-15, 2023/03
+      | (?P<dmy_d>{_DD})(?:st|nd|rd|th)?{_SEP}(?:of{_SEP})?(?P<dmy_m>{_MONTH})\.?,?{_SEP}(?P<dmy_y>{_YEAR})  # 15 March 2023
+      | (?P<mdy_m>{_MONTH})\.?{_SEP}(?P<mdy_d>{_DD})(?:st|nd|rd|th)?,?{_SEP}(?P<mdy_y>{_YEAR})             # March 15, 2023
+      | (?P<my_m>{_MONTH})\.?,?{_SEP}(?P<my_y>{_YEAR})                                       # March 2023
+      | (?<![\d-])(?P<num_a>\d{{1,2}})[/.-](?P<num_b>\d{{1,2}})[/.-](?P<num_y>{_YEAR})       # 03/15/2023, 15.03.2023
+      | (?<![\d-])(?P<mmyy_m>{_MM})[/-](?P<mmyy_y>{_YEAR})                                   # 03/2023 (not 3.2023)
+    )(?!\d)
+    """,
+    re.IGNORECASE | re.VERBOSE,
+)
+
+
+def _max_year() -> int:
+    return datetime.now().year + MAX_FUTURE_YEAR_OFFSET
+
+
+def _to_date(match: re.Match) -> Optional[date]:
+    """Builds a date from whichever alternative matched, or None if it is not a real date."""
+    g = match.groupdict()
+    try:
+        if g["iso_y"]:
+            return date(int(g["iso_y"]), int(g["iso_m"]), int(g["iso_d"] or 1))
+        if g["dmy_y"]:
+            return date(int(g["dmy_y"]), MONTHS[g["dmy_m"][:3].lower()], int(g["dmy_d"]))
+        if g["mdy_y"]:
+            return date(int(g["mdy_y"]), MONTHS[g["mdy_m"][:3].lower()], int(g["mdy_d"]))
+        if g["my_y"]:
+            return date(int(g["my_y"]), MONTHS[g["my_m"][:3].lower()], 1)
+        if g["num_y"]:
+            a, b = int(g["num_a"]), int(g["num_b"])
+            # Month-first like dateutil/datefinder, unless that cannot be a month.
+            month, day = (a, b) if a <= 12 else (b, a)
+            return date(int(g["num_y"]), month, day)
+        if g["mmyy_y"]:
+            return date(int(g["mmyy_y"]), int(g["mmyy_m"]), 1)
+    except (ValueError, KeyError):
+        return None
+    return None
+
+
+def iter_dates(text: str, min_year: int = MIN_YEAR, max_year: Optional[int] = None) -> Iterator[date]:
+    """Yields every well-formed date in `text` whose year is within [min_year, max_year], in order."""
+    if not text:
+        return
+    if max_year is None:
+        max_year = _max_year()
+    for match in DATE_PATTERN.finditer(text):
+        dt = _to_date(match)
+        if dt and min_year <= dt.year <= max_year:
+            yield dt
+
+
+def find_date(text: str, min_year: int = MIN_YEAR, max_year: Optional[int] = None) -> Optional[date]:
+    """Returns the first plausible date in `text`, or None so the caller can fall back to datefinder."""
+    return next(iter_dates(text, min_year, max_year), None)
+
+
+# --- Batch memoization -------------------------------------------------------------
+# Date helpers are pure and see the same strings over and over within one batch (the
+# same meta values and URL prefixes across many pages of one site), so they are
+# memoized for the whole run. cache_stats() reports the hit rates.
+
+_MEMOIZED = {}
+_PRECOMPUTED = {}    # text -> first well-formed date in it, from precompute_dates
+_PRECOMPUTED_STATS = {"hits": 0, "misses": 0}
+
+
+def memoized(func):
+    """Bounded LRU memoization that is registered for cache_stats()."""
+    cached = lru_cache(maxsize=DATE_CACHE_SIZE)(func)
+    _MEMOIZED[f"{func.__module__}.{func.__name__}"] = cached
+    return cached
+
+
+def precompute_dates(texts) -> int:
+    """
+    Resolves the first date of every text in a column (e.g. all input URLs) in one
+    vectorized pass before any fetching. Only first matches that are real calendar
+    dates are stored; anything else is left to the per-row path.
+    """
+    series = pd.Series(texts, dtype="object").dropna().astype(str).drop_duplicates()
+    if series.empty:
+        return 0
+    g = series.str.extract(DATE_PATTERN)
+
+    def number(col):
+        return pd.to_numeric(g[col], errors="coerce")
+
+    def month_name(col):
+        return g[col].str[:3].str.lower().map(MONTHS).astype(float)
+
+    num_a, num_b = number("num_a"), number("num_b")
+    # Month-first like _to_date, unless that cannot be a month
+    num_month = num_a.where(num_a <= 12, num_b)
+    num_day = num_b.where(num_a <= 12, num_a)
+
+    year = (number("iso_y").fillna(number("dmy_y")).fillna(number("mdy_y")).fillna(number("my_y"))
+            .fillna(number("num_y")).fillna(number("mmyy_y")))
+    month = (number("iso_m").fillna(month_name("dmy_m")).fillna(month_name("mdy_m"))
+             .fillna(month_name("my_m")).fillna(num_month).fillna(number("mmyy_m")))
+    day = (number("iso_d").fillna(number("dmy_d")).fillna(number("mdy_d")).fillna(num_day)
+           .where(g["num_y"].notna() | g["iso_d"].notna() | g["dmy_d"].notna() | g["mdy_d"].notna(), 1))
+
+    dates = pd.to_datetime(pd.DataFrame({"year": year, "month": month, "day": day}), errors="coerce")
+    valid = dates.notna()
+    _PRECOMPUTED.update(zip(series[valid], dates[valid].dt.date))
+    return int(valid.sum())
+
+
+def precomputed_date(text: str, min_year: int = MIN_YEAR, max_year: Optional[int] = None) -> Optional[date]:
+    """The precomputed first date of `text` if it is within the year bounds, else None."""
+    dt = _PRECOMPUTED.get(text)
+    if dt is None:
+        _PRECOMPUTED_STATS["misses"] += 1
+        return None
+    _PRECOMPUTED_STATS["hits"] += 1
+    return dt if min_year <= dt.year <= (max_year or _max_year()) else None
+
+
+def cache_stats() -> dict:
+    """Hit/miss counters and hit rate of every memoized date helper and the precomputed table."""
+    stats = {}
+    counters = [(name, func.cache_info()) for name, func in _MEMOIZED.items()]
+    for name, info in counters:
+        stats[name] = {"hits": info.hits, "misses": info.misses, "size": info.currsize}
+    stats["precomputed"] = dict(_PRECOMPUTED_STATS, size=len(_PRECOMPUTED))
+    for entry in stats.values():
+        total = entry["hits"] + entry["misses"]
+        entry["hit_rate"] = round(entry["hits"] / total, 3) if total else 0.0
+    return stats
+
+
+# --- Benchmark -------------------------------------------------------------------
+# python -m extract.date_regex [corpus_path]
+# Times the fast path against the datefinder path on the fixture corpus and
+# reports how often they agree on the month/year we actually store.
+
+FIXTURE_CORPUS = "extract/fixtures/date_corpus.txt"
+
+
+def _datefinder_first(text: str, min_year: int, max_year: int) -> Optional[date]:
+    from datefinder import find_dates
+    for dt in find_dates(text):
+        return dt.date() if min_year <= dt.year <= max_year else None
+    return None
+
+
+def benchmark(corpus_path: str = FIXTURE_CORPUS, rounds: int = 20) -> dict:
+    with open(corpus_path, "r", encoding="utf-8") as f:
+        samples = [line.strip() for line in f if line.strip() and not line.startswith("#")]
+
+    min_year, max_year = MIN_YEAR + 1, _max_year()
+    results = {}
+    for name, func in (("regex", find_date), ("datefinder", _datefinder_first)):
+        start = time.perf_counter()
+        for _ in range(rounds):
+            found = [func(s, min_year, max_year) for s in samples]
+        results[name] = {
+            "seconds_per_round": round((time.perf_counter() - start) / rounds, 5),
+            "found": sum(1 for d in found if d),
+            "dates": found,
+        }
+
+    fast, slow = results["regex"]["dates"], results["datefinder"]["dates"]
+    fmt = lambda d: d.strftime("%m/%Y") if d else None
+    agree = sum(1 for a, b in zip(fast, slow) if fmt(a) == fmt(b))
+    # What the pipeline does: regex first, datefinder only when the regex finds nothing.
+    combined = sum(1 for a, b in zip(fast, slow) if a or b)
+    return {
+        "samples": len(samples),
+        "regex_s": results["regex"]["seconds_per_round"],
+        "datefinder_s": results["datefinder"]["seconds_per_round"],
+        "speedup": round(results["datefinder"]["seconds_per_round"] / max(results["regex"]["seconds_per_round"], 1e-9), 1),
+        "regex_found": results["regex"]["found"],
+        "datefinder_found": results["datefinder"]["found"],
+        "combined_found": combined,
+        "month_year_agreement": f"{agree}/{len(samples)}",
+    }
+
+
+if __name__ == "__main__":
+    import sys
+    report = benchmark(sys.argv[1] if len(sys.argv) > 1 else FIXTURE_CORPUS)
+    for k, v in report.items():
+        print(f"{k:>22}: {v}")
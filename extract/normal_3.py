@@ -1,6 +1,6 @@
 import re
 import requests
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, CData, NavigableString, Tag
 import json
 import os
 from datetime import datetime
@@ -44,27 +44,65 @@ def _save_result_to_json(url: str, keyword: str, contexts: list):
         print(f"  [WARNING] Could not save result to JSON file: {e}")
 
 
-def fetch_html(url: str) -> str:
-    """
-    Fetches HTML content from a URL with a timeout and error handling.
-    This will now let the main script catch network errors.
-    """
+# Common non-content tags that are left out of the keyword text (includes <header>)
+NON_CONTENT_TAGS = ("script", "style", "nav", "footer", "aside", "header")
+
+
+def _fetch(url: str) -> requests.Response:
     # Using a realistic user-agent and a timeout is good practice
     headers = {
         'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'}
     response = requests.get(url, headers=headers, timeout=15)
     response.raise_for_status()  # Raise an exception for bad status codes (4xx or 5xx)
-    return response.text
+    return response
+
+
+def fetch_html(url: str) -> str:
+    """
+    Fetches HTML content from a URL with a timeout and error handling.
+    This will now let the main script catch network errors.
+    """
+    return _fetch(url).text
+
+
+def visible_text(soup: BeautifulSoup) -> str:
+    """
+    Same text as clean_html, but skips non-content tags instead of decomposing them,
+    so the soup stays intact for the date and metadata steps.
+    """
+    parts = []
+    stack = [iter(soup.children)]  # explicit stack: deep DOMs would blow the recursion limit
+    while stack:
+        child = next(stack[-1], None)
+        if child is None:
+            stack.pop()
+        elif isinstance(child, Tag):
+            if child.name not in NON_CONTENT_TAGS:
+                stack.append(iter(child.children))
+        elif type(child) in (NavigableString, CData):
+            parts.append(child)
+    return re.sub(r"\s+", " ", " ".join(parts)).strip()
 
 
 def clean_html(html: str) -> str:
     """Removes unwanted tags and extra whitespace from HTML."""
-    soup = BeautifulSoup(html, "lxml")
-    # Added <header> to the list of common non-content tags to remove
-    for tag in soup(["script", "style", "nav", "footer", "aside", "header"]):
-        tag.decompose()
-    text = soup.get_text(separator=" ")
-    return re.sub(r"\s+", " ", text).strip()
+    return visible_text(BeautifulSoup(html, "lxml"))
+
+
+def load_page(url: str) -> dict:
+    """
+    Fetches and parses a page exactly once. The returned page record is shared by the
+    keyword stage (normal_from_page) and the date stage (date_from_page).
+    """
+    response = _fetch(url)
+    soup = BeautifulSoup(response.text, "lxml")
+    return {
+        "url": url,
+        "html": response.text,
+        "headers": response.headers,
+        "soup": soup,
+        "text": visible_text(soup),
+    }
 
 
 def context_around_keyword(text: str, keyword: str, context_words: int = 250, max_matches: int = 5) -> list:
@@ -97,17 +135,20 @@ def context_around_keyword(text: str, keyword: str, context_words: int = 250, ma
     return matches
 
 
+def normal_from_page(page: dict, keyword: str) -> list:
+    """Extracts keyword contexts from an already loaded page record (see load_page)."""
+    contexts = context_around_keyword(page["text"], keyword)
+
+    # --- NEW: Automatically save the result to a JSON file ---
+    _save_result_to_json(page["url"], keyword, contexts)
+
+    return contexts
+
+
 def normal(url: str, keyword: str) -> list:
     """
     Main function to fetch, clean, and extract keyword contexts from a URL.
     Returns a list of context dictionaries.
     """
     # Let exceptions from fetch_html be caught by the main script
-    html = fetch_html(url)
-    text = clean_html(html)
-    contexts = context_around_keyword(text, keyword)
-
-    # --- NEW: Automatically save the result to a JSON file ---
-    _save_result_to_json(url, keyword, contexts)
-
-    return contexts
\ No newline at end of file
+    return normal_from_page(load_page(url), keyword)
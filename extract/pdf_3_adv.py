@@ -9,6 +9,8 @@ import re
 from io import BytesIO
 from datetime import datetime
 from datefinder import find_dates
+from extract.date_regex import find_date, memoized, precomputed_date
+from extract.sitemap_date import last_modified_header, sitemap_lastmod
 
 
 USER_AGENT = 'Chrome/108.0.0.0'
@@ -72,19 +74,18 @@ def pdf_content(url: str, keyword: str, max_per_page=2, max_total=4) -> list:
         return [{"error": str(e)}]
 
 # date_pdf =====================================================================
+@memoized
 def _find_date_in_url(url: str) -> str | None:
     """
     DATE STEP 1: Finds a date in the URL using a reliable hybrid approach.
-    1. A precise regex for common /YYYY/MM/ or /YYYY-MM-DD/ patterns.
+    1. The compiled multi-format regex engine (/YYYY/MM/, /YYYY-MM-DD/, march-2023, ...).
     2. A fallback to the more general datefinder library.
     """
-    # 1. Precise Regex Search (Extremely reliable for this pattern)
-    # This looks for a 4-digit year (2000-2029) followed by a 2-digit month (01-12)
-    match = re.search(r'/(20[0-2]\d)[/-]([01]\d)/', url)
-    if match:
-        year, month = int(match.group(1)), int(match.group(2))
-        if 2000 <= year <= datetime.now().year + 1 and 1 <= month <= 12:
-            return f"{month:02d}/{year}"
+    # 1. Compiled Regex Search (fast, and only matches real date shapes)
+    if dt := precomputed_date(url, min_year=2000, max_year=datetime.now().year + 1):
+        return dt.strftime("%m/%Y")
+    if dt := find_date(url, min_year=2000, max_year=datetime.now().year + 1):
+        return dt.strftime("%m/%Y")
 
     # 2. Fallback to datefinder for other, less common formats
     try:
@@ -104,6 +105,8 @@ def _find_date_in_pages(doc: fitz.Document) -> str | None:
         text_to_search += doc[i].get_text("text") + "\n"
 
     if text_to_search:
+        if dt := find_date(text_to_search, min_year=2000, max_year=datetime.now().year + 1):
+            return dt.strftime("%m/%Y")
         try:
             found_dates = list(find_dates(text_to_search, strict=True))
             if found_dates:
@@ -127,33 +130,41 @@ def _find_date_in_metadata (doc: fitz.Document) -> str | None:
         return None
 # ==============================================================================
 
-# pdf_date function returns date
+# pdf_date function returns (date, method)
 def pdf_date(url: str) -> tuple[str, str]:
     """
     Orchestrates the entire PDF processing pipeline: content and date extraction.
     """
     date = _find_date_in_url(url)
+    if date:
+        return date, "url_path"
+    if dt := sitemap_lastmod(url):
+        return dt.strftime("%m/%Y"), "sitemap_lastmod"
     try:
         response = requests.get(url, timeout=REQUEST_TIMEOUT, headers={'User-Agent': USER_AGENT})
         response.raise_for_status()
 
+        # Static files keep a meaningful Last-Modified, and reading it needs no PDF parsing
+        if dt := last_modified_header(response.headers):
+            return dt.strftime("%m/%Y"), "http_last_modified"
+
         with fitz.open(stream=BytesIO(response.content), filetype="pdf") as doc:
-            if not date:
-                date = _find_date_in_pages(doc)
-                if not date:
-                    date = _find_date_in_metadata(doc)
+            if date := _find_date_in_pages(doc):
+                return date, "pdf_text"
+            if date := _find_date_in_metadata(doc):
+                return date, "pdf_metadata"
 
-        return date or "Not found"
+        return "Not found", "not_found"
 
     except (requests.RequestException, fitz.fitz.FitzError, ValueError) as e:
         print(f"  [PDF Processing Error] Could not process {url}. Reason: {e}")
-        return date or "Not found"
+        return "Not found", "error"
 # ==============================================================================
 
 def pdf(url,keyword):
     chunk = pdf_content(url,keyword)
-    date = pdf_date(url)
-    return chunk, date
+    date, method = pdf_date(url)
+    return chunk, date, method
 
 
 
@@ -169,8 +180,8 @@ if __name__ == "__main__":
     ]
 
     for test_url in test_urls:
-        cont, date = pdf(test_url, test_keyword)
+        cont, date, method = pdf(test_url, test_keyword)
         print("-" * 20)
         print(f"URL: {test_url}")
         print(f"Content Found: '{cont}'\n")
-        print(f"Date Found: '{date}'\n")
+        print(f"Date Found: '{date}' (method: {method})\n")
@@ -0,0 +1,160 @@
+import gzip
+import re
+import threading
+import requests
+import xml.etree.ElementTree as ET
+from datetime import date, datetime, timedelta, timezone
+from email.utils import parsedate_to_datetime
+from typing import Optional
+from urllib.parse import urlparse
+
+# sitemap_lastmod & last_modified_header are the main functions.
+# Both are "free" date signals that need no DOM work: the <lastmod> of the page in
+# its domain's sitemap and the Last-Modified response header.
+
+# --- Configuration Constants ---
+USER_AGENT = 'Chrome/91.0.4472.124'
+SITEMAP_TIMEOUT = 10
+MAX_CHILD_SITEMAPS = 10    # how many sitemaps of a sitemap index we follow per domain
+MIN_YEAR = 2001
+
+# domain -> {normalised page url: lastmod date}. Filled once per domain and kept for the whole batch.
+_SITEMAP_CACHE = {}
+_DOMAIN_LOCKS = {}
+_LOCKS_GUARD = threading.Lock()
+
+
+def _normalize_url(url: str) -> str:
+    """Scheme, www., query, fragment and trailing slash do not change which page a URL is."""
+    parsed = urlparse(url.strip())
+    host = parsed.netloc.lower().removeprefix("www.")
+    return f"{host}{parsed.path.rstrip('/')}"
+
+
+def _domain_root(url: str) -> tuple[str, str]:
+    parsed = urlparse(url)
+    return parsed.netloc.lower().removeprefix("www."), f"{parsed.scheme or 'https'}://{parsed.netloc}"
+
+
+def _plausible(dt: date) -> bool:
+    return MIN_YEAR < dt.year <= datetime.now().year
+
+
+def _parse_lastmod(value: str) -> Optional[date]:
+    # W3C datetime: YYYY, YYYY-MM, YYYY-MM-DD or a full timestamp
+    match = re.match(r"\s*(\d{4})(?:-(\d{2}))?(?:-(\d{2}))?", value or "")
+    if not match:
+        return None
+    try:
+        dt = date(int(match.group(1)), int(match.group(2) or 1), int(match.group(3) or 1))
+    except ValueError:
+        return None
+    return dt if _plausible(dt) else None
+
+
+def _get(url: str) -> Optional[bytes]:
+    try:
+        response = requests.get(url, headers={'User-Agent': USER_AGENT}, timeout=SITEMAP_TIMEOUT)
+        if response.status_code != 200:
+            return None
+        content = response.content
+        if content[:2] == b"\x1f\x8b":  # .xml.gz sitemaps are served as raw gzip
+            content = gzip.decompress(content)
+        return content
+    except (requests.RequestException, OSError, EOFError):
+        return None
+
+
+def _parse_sitemap(content: bytes) -> tuple[dict, list]:
+    """Returns ({page url: lastmod}, [child sitemap urls]) for a urlset or a sitemap index."""
+    entries, children = {}, []
+    try:
+        root = ET.fromstring(content)
+    except ET.ParseError:
+        return entries, children
+
+    is_index = root.tag.rsplit('}', 1)[-1] == "sitemapindex"
+    for node in root:
+        fields = {child.tag.rsplit('}', 1)[-1]: (child.text or "").strip() for child in node}
+        loc = fields.get("loc")
+        if not loc:
+            continue
+        if is_index:
+            children.append(loc)
+        elif dt := _parse_lastmod(fields.get("lastmod")):
+            entries[_normalize_url(loc)] = dt
+    return entries, children
+
+
+def _sitemap_urls(root_url: str) -> list:
+    """Sitemaps declared in robots.txt, then the conventional locations."""
+    urls = []
+    robots = _get(f"{root_url}/robots.txt")
+    if robots:
+        for line in robots.decode("utf-8", errors="ignore").splitlines():
+            if line.lower().startswith("sitemap:"):
+                urls.append(line.split(":", 1)[1].strip())
+    for fallback in (f"{root_url}/sitemap.xml", f"{root_url}/sitemap_index.xml"):
+        if fallback not in urls:
+            urls.append(fallback)
+    return urls
+
+
+def _load_domain(root_url: str) -> dict:
+    entries = {}
+    queue = _sitemap_urls(root_url)
+    fetched = 0
+    while queue and fetched < MAX_CHILD_SITEMAPS:
+        content = _get(queue.pop(0))
+        if not content:
+            continue
+        fetched += 1
+        found, children = _parse_sitemap(content)
+        entries.update(found)
+        queue.extend(children)
+        # A plain urlset at a conventional location is enough; do not probe the rest
+        if found and not children:
+            break
+    return entries
+
+
+def load_sitemap(url: str) -> dict:
+    """Sitemap lastmod map for the URL's domain, fetched at most once per domain per run."""
+    domain, root_url = _domain_root(url)
+    if domain in _SITEMAP_CACHE:
+        return _SITEMAP_CACHE[domain]
+
+    with _LOCKS_GUARD:
+        lock = _DOMAIN_LOCKS.setdefault(domain, threading.Lock())
+    with lock:
+        # Another thread may have loaded it while we waited
+        if domain not in _SITEMAP_CACHE:
+            _SITEMAP_CACHE[domain] = _load_domain(root_url)
+    return _SITEMAP_CACHE[domain]
+
+
+def sitemap_lastmod(url: str) -> Optional[date]:
+    """Date from the page's <lastmod> entry in its domain sitemap, if it is listed."""
+    try:
+        return load_sitemap(url).get(_normalize_url(url))
+    except Exception:
+        return None
+
+
+def last_modified_header(headers) -> Optional[date]:
+    """
+    Date from the Last-Modified response header. Dynamic pages stamp it with the
+    time of the request, so a value from the last day is treated as no signal.
+    """
+    value = headers.get("Last-Modified") if headers else None
+    if not value:
+        return None
+    try:
+        dt = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    if datetime.now(timezone.utc) - dt < timedelta(days=1):
+        return None
+    return dt.date() if _plausible(dt.date()) else None
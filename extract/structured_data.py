@@ -0,0 +1,150 @@
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+import extruct
+from bs4 import BeautifulSoup
+
+# page_metadata is the main function.
+# One structured-data pass per page (JSON-LD, microdata, OpenGraph, RDFa via extruct,
+# plus every <meta> tag in a single loop). The resulting record is cached and read by
+# date extraction (date_me_3), company-name inference (info) and page-type detection.
+
+# --- Configuration Constants ---
+SYNTAXES = ['json-ld', 'microdata', 'opengraph', 'rdfa']
+MAX_CACHED_RECORDS = 256
+
+# Same priority the date ladder has always used
+DATE_KEYS = ['dateModified', 'datePublished', 'publishedDate', 'dateCreated', 'uploadDate']
+META_DATE_KEYS = ['datemodified', 'article:modified_time', 'datepublished',
+                  'article:published_time', 'pubdate', 'date']
+
+ORGANIZATION_TYPES = {'Organization', 'Corporation', 'LocalBusiness', 'OnlineBusiness', 'NGO'}
+ARTICLE_TYPES = {'Article', 'NewsArticle', 'BlogPosting', 'TechArticle', 'Report'}
+
+_CACHE = OrderedDict()  # url -> metadata record (LRU)
+_CACHE_LOCK = threading.Lock()
+
+
+def _types(item: dict) -> set:
+    value = item.get('@type') or []
+    values = value if isinstance(value, list) else [value]
+    # RDFa and microdata may give full IRIs such as http://schema.org/Article
+    return {str(v).rsplit('/', 1)[-1] for v in values}
+
+
+def _flatten(items) -> list:
+    """All dict items, with JSON-LD @graph containers and nested lists unpacked."""
+    flat, stack = [], list(items or [])
+    while stack:
+        item = stack.pop(0)
+        if isinstance(item, list):
+            stack[:0] = item
+        elif isinstance(item, dict):
+            flat.append(item)
+            if isinstance(item.get('@graph'), list):
+                stack[:0] = item['@graph']
+    return flat
+
+
+def _first_text(value) -> Optional[str]:
+    if isinstance(value, list):
+        value = value[0] if value else None
+    if isinstance(value, dict):
+        value = value.get('name') or value.get('@value')
+    return value.strip() if isinstance(value, str) and value.strip() else None
+
+
+def _collect_meta(soup: BeautifulSoup) -> dict:
+    meta = {}
+    for tag in soup.find_all('meta'):
+        key = (tag.get('name') or tag.get('property') or tag.get('itemprop') or '').strip().lower()
+        if key and key not in meta and tag.get('content'):
+            meta[key] = tag['content']
+    if 'title' not in meta and soup.title and soup.title.string:
+        meta['title'] = soup.title.string.strip()
+    return meta
+
+
+def _dates(typed_items: list, meta: dict) -> list:
+    """Candidate date strings as (value, method), most reliable first."""
+    candidates = []
+    for key in DATE_KEYS:
+        for syntax, item in typed_items:
+            if value := _first_text(item.get(key)):
+                candidates.append((value, syntax))
+    for key in META_DATE_KEYS:
+        if value := meta.get(key):
+            candidates.append((value, "meta_tag"))
+    return candidates
+
+
+def _organization(typed_items: list, meta: dict) -> Optional[str]:
+    for _, item in typed_items:
+        if _types(item) & ORGANIZATION_TYPES and (name := _first_text(item.get('name'))):
+            return name
+    if name := _first_text(meta.get('og:site_name')):
+        return name
+    for _, item in typed_items:
+        if name := _first_text(item.get('publisher')):
+            return name
+    return None
+
+
+def _page_type(url: str, typed_items: list, meta: dict) -> Optional[str]:
+    types = set().union(*(_types(item) for _, item in typed_items)) if typed_items else set()
+    title = " ".join(filter(None, [meta.get('og:title'), meta.get('title')] +
+                            [_first_text(item.get('headline')) for _, item in typed_items])).lower()
+    haystack = f"{url.lower()} {title}"
+
+    if 'JobPosting' in types or meta.get('og:type') == 'job':
+        return "job_posting"
+    if any(marker in haystack for marker in ("case-stud", "case stud", "success-stor", "success stor")):
+        return "case_study"
+    if 'PressRelease' in types or any(marker in haystack for marker in ("press-release", "press release", "/press/")):
+        return "press_release"
+    if types & ARTICLE_TYPES or meta.get('og:type') == 'article':
+        return "article"
+    return None
+
+
+def extract_metadata(html: str, url: str, soup: Optional[BeautifulSoup] = None) -> dict:
+    """Builds the structured metadata record for one page (no caching)."""
+    try:
+        data = extruct.extract(html, base_url=url, syntaxes=SYNTAXES, uniform=True, errors='ignore')
+    except Exception as e:
+        print(f"  [WARNING] Structured data extraction failed for {url}: {e}")
+        data = {}
+
+    # JSON-LD first: it is what the date ladder has always trusted most
+    typed_items = [(syntax, item) for syntax in SYNTAXES for item in _flatten(data.get(syntax))]
+    meta = _collect_meta(soup if soup is not None else BeautifulSoup(html, 'lxml'))
+
+    return {
+        "url": url,
+        "items": typed_items,
+        "meta": meta,
+        "dates": _dates(typed_items, meta),
+        "organization": _organization(typed_items, meta),
+        "page_type": _page_type(url, typed_items, meta),
+    }
+
+
+def cached_metadata(url: str) -> Optional[dict]:
+    """The record for `url` if this run has already extracted it."""
+    with _CACHE_LOCK:
+        if url in _CACHE:
+            _CACHE.move_to_end(url)
+            return _CACHE[url]
+    return None
+
+
+def page_metadata(page: dict) -> dict:
+    """Metadata record for a page from normal_3.load_page, computed once and cached."""
+    if page.get("metadata") is None:
+        page["metadata"] = cached_metadata(page["url"]) or extract_metadata(page["html"], page["url"], page["soup"])
+        with _CACHE_LOCK:
+            _CACHE[page["url"]] = page["metadata"]
+            if len(_CACHE) > MAX_CACHED_RECORDS:
+                _CACHE.popitem(last=False)
+    return page["metadata"]
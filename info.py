@@ -26,11 +26,15 @@ def info(url):
     return company_name
 '''
 
-def info(url, company_name_from_csv=None):
+def info(url, company_name_from_csv=None, metadata=None):
 
     if pd.notna(company_name_from_csv) and isinstance(company_name_from_csv, str) and company_name_from_csv.strip():
         return company_name_from_csv.strip()
 
+    # --- Next best: the organization named in the page's structured data (extract.structured_data) ---
+    if metadata and metadata.get("organization"):
+        return metadata["organization"]
+
     # --- Fallback: Derive the name from the URL if no valid name was provided ---
     if not isinstance(url, str) or not url.strip():
         return "Unknown Company"  # Handle cases where URL is also invalid
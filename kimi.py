@@ -1,6 +1,6 @@
 import os
 import json
-from openai import OpenAI
+from llm.clients import openai_client
 
 
 OPENROUTER_API_KEY = ""
@@ -73,11 +73,8 @@ def explain(chunk_text: str, keyword_tech: str, company_name: str, usage_indicat
         return {"uses_tech": False, "explanation": "API key is not configured."}
 
     try:
-        # --- Step 2: Initialize the OpenAI client pointing to OpenRouter ---
-        client = OpenAI(
-            base_url=BASE_URL,
-            api_key=OPENROUTER_API_KEY,
-        )
+        # --- Step 2: Get the shared OpenAI client pointing to OpenRouter (built once per key) ---
+        client = openai_client(BASE_URL, OPENROUTER_API_KEY)
         print(f"--> Using Kimi model: {KIMI_MODEL} via OpenRouter")
 
         # --- Step 3: Call the Chat Completions API with the Kimi model ---
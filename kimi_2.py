@@ -2,9 +2,10 @@
 import os
 import json
 import time
-import random
 from typing import Dict
-from openai import OpenAI, RateLimitError
+from openai import RateLimitError
+from llm.clients import openai_client
+from llm.rate_limit import KeyPool
 
 # -------------------- CONFIG --------------------
 API_KEY     = ""
@@ -14,7 +15,7 @@ KIMI_MODEL = "kimi-k2-0711-preview"
 # Your project limits
 MAX_RPM      = 6          # requests per minute
 MAX_TPM      = 64_000     # tokens per minute
-SAFE_DELAY   = 60 / MAX_RPM   # 10 s between calls
+MAX_OUTPUT_TOKENS = 400
 MAX_RETRIES  = 3
 
 # Indicator list (unchanged)
@@ -33,12 +34,8 @@ target = [
 ]
 # ------------------------------------------------
 
-client = OpenAI(base_url=BASE_URL, api_key=API_KEY)
-
-def _safe_sleep(attempt: int):
-    """Exponential back-off with jitter."""
-    delay = SAFE_DELAY * (2 ** attempt) + random.uniform(0, 1)
-    time.sleep(delay)
+# Waits only as long as the RPM/TPM buckets require, instead of a fixed delay per call
+key_pool = KeyPool([API_KEY], rpm=MAX_RPM, tpm=MAX_TPM, name="kimi")
 
 def explain(chunk_text: str,
             keyword_tech: str,
@@ -82,32 +79,45 @@ def explain(chunk_text: str,
     }}
     """
 
+    tokens = len(prompt) // 4 + MAX_OUTPUT_TOKENS
     for attempt in range(MAX_RETRIES + 1):
         try:
-            resp = client.chat.completions.create(
+            state = key_pool.acquire(tokens)
+        except RuntimeError as e:
+            # No API key configured, or every key disabled by its circuit breaker
+            return {"uses_tech": False, "explanation": f"Error: {e}"}
+        started = time.perf_counter()
+        try:
+            resp = openai_client(BASE_URL, API_KEY).chat.completions.create(
                 model=KIMI_MODEL,
                 messages=[{"role": "user", "content": prompt}],
-                max_tokens=400,           # keep TPM usage low
+                max_tokens=MAX_OUTPUT_TOKENS,   # keep TPM usage low
                 temperature=0.2,
                 timeout=30
             )
-
-            raw = resp.choices[0].message.content.strip()
-            return json.loads(raw)
-
-        except RateLimitError:
+        except RateLimitError as e:
+            key_pool.penalize(state, error=e)   # exponential cooldown before the next acquire
             if attempt == MAX_RETRIES:
                 return {"uses_tech": False, "explanation": "Rate limit exceeded after retries."}
-            _safe_sleep(attempt)
+            continue
+        except Exception as e:
+            # Network hiccups, auth errors, etc.
+            key_pool.release(state, ok=False, error=e)
+            return {"uses_tech": False, "explanation": f"Error: {e}"}
+        key_pool.release(state, latency=time.perf_counter() - started)
 
+        try:
+            raw = resp.choices[0].message.content.strip()
+            return json.loads(raw)
         except Exception as e:
-            # Catch-all for JSON parse errors, network hiccups, etc.
+            # JSON parse errors, empty responses
             return {"uses_tech": False, "explanation": f"Error: {e}"}
 
 # ------------------- SELF-TEST -------------------
 
-chunk_text = "This is an sample chunck where we belive Google use GCP"
-keyword_tech = "GCP"
-company_name = "Google"
-x = explain(chunk_text,keyword_tech,company_name)
-print(x)
+if __name__ == "__main__":
+    chunk_text = "This is an sample chunck where we belive Google use GCP"
+    keyword_tech = "GCP"
+    company_name = "Google"
+    x = explain(chunk_text,keyword_tech,company_name)
+    print(x)
@@ -0,0 +1,130 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+from typing import Optional
+
+# Additive-increase / multiplicative-decrease controllers for the LLM dispatcher.
+# Each key of each provider pool has one for its in-flight calls (llm.rate_limit), and
+# explain_batch has one for rows per request. A controller grows its limit by about one
+# per window of successful calls and cuts it on overload signals:
+#   * a 429 or a timeout        -> limit * BACKOFF
+#   * p95 latency above target  -> limit * LATENCY_BACKOFF (target: LATENCY_TOLERANCE x the
+#                                  best p95 seen so far, or a fixed number of seconds)
+# Cuts are spaced by the recent median latency, so the calls already in flight when the
+# limit dropped cannot cut it again. Every change is appended to TRACE_FILE, so a run's
+# convergence can be watched live (tail -f) or plotted afterwards.
+
+# --- Configuration Constants ---
+AIMD_ENABLED = True
+INITIAL_CONCURRENCY = 2          # in-flight calls per key at the start
+MAX_CONCURRENCY = 8              # in-flight calls per key at most
+ADDITIVE_STEP = 1.0              # limit grows by this much per `limit` successful calls
+BACKOFF = 0.5                    # on 429s and timeouts
+LATENCY_BACKOFF = 0.8            # on p95 latency above the target
+LATENCY_TOLERANCE = 2.0          # p95 may grow to this multiple of the best p95 before it counts
+LATENCY_WINDOW = 20              # recent latencies the p95 is taken over
+MIN_HOLD_SECONDS = 1.0           # shortest gap between two cuts
+TRACE_FILE = "llm_state/aimd_trace.jsonl"
+
+_CONTROLLERS = {}
+_REGISTRY_LOCK = threading.Lock()
+_TRACE_LOCK = threading.Lock()
+
+
+def is_timeout(exc: Exception) -> bool:
+    """Timeouts from either SDK (google DeadlineExceeded, openai APITimeoutError) or the network stack."""
+    if isinstance(exc, TimeoutError) or type(exc).__name__ in ("DeadlineExceeded", "APITimeoutError",
+                                                                "ReadTimeout", "ConnectTimeout", "Timeout"):
+        return True
+    message = str(exc).lower()
+    return "timed out" in message or "deadline exceeded" in message
+
+
+class AIMDController:
+    def __init__(self, name: str, initial: float, minimum: float = 1, maximum: float = MAX_CONCURRENCY,
+                 latency_target: Optional[float] = None, ident: Optional[str] = None):
+        self.name = name
+        self.ident = ident or name   # registry key; per-key controllers pass the key's fingerprint
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.latency_target = latency_target   # None: relative to the best p95 seen
+        self.best_p95 = None
+        self.stats = {"successes": 0, "increases": 0, "cuts_429": 0, "cuts_timeout": 0, "cuts_latency": 0,
+                      "cuts_other": 0}
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+        self._since_check = 0
+        self._last_cut = 0.0
+        self._lock = threading.Lock()
+        with _REGISTRY_LOCK:
+            _CONTROLLERS[self.ident] = self
+
+    @property
+    def value(self) -> int:
+        """The current limit as a whole number of calls / rows."""
+        return max(int(self.minimum), int(self.limit))
+
+    def _p(self, q: float) -> Optional[float]:
+        ordered = sorted(self._latencies)
+        return ordered[int(q * (len(ordered) - 1))] if ordered else None
+
+    def on_success(self, latency: Optional[float] = None):
+        with self._lock:
+            self.stats["successes"] += 1
+            before = self.value
+            if latency is not None:
+                self._latencies.append(latency)
+                self._since_check += 1
+                if self._since_check >= LATENCY_WINDOW and len(self._latencies) == LATENCY_WINDOW:
+                    self._since_check = 0
+                    p95 = self._p(0.95)
+                    target = self.latency_target or (self.best_p95 or p95) * LATENCY_TOLERANCE
+                    if p95 > target:
+                        self._cut("latency", LATENCY_BACKOFF, p95=round(p95, 3))
+                        return
+                    self.best_p95 = p95 if self.best_p95 is None else min(self.best_p95, p95)
+            self.limit = min(self.maximum, self.limit + ADDITIVE_STEP / max(self.limit, 1.0))
+            if self.value > before:
+                self.stats["increases"] += 1
+                self._trace("increase")
+
+    def on_overload(self, kind: str = "429"):
+        """A 429, a timeout, or (for batches) a reply that did not cover every row."""
+        with self._lock:
+            self._cut(kind, BACKOFF)
+
+    def _cut(self, kind: str, factor: float, **extra):
+        now = time.monotonic()
+        hold = max(MIN_HOLD_SECONDS, self._p(0.5) or 0.0)
+        if now - self._last_cut < hold:
+            return   # calls started before the last cut are still coming back
+        self._last_cut = now
+        self.limit = max(self.minimum, self.limit * factor)
+        self.stats[f"cuts_{kind}" if f"cuts_{kind}" in self.stats else "cuts_other"] += 1
+        self._trace(f"cut_{kind}", **extra)
+
+    def _trace(self, event: str, **extra):
+        entry = dict(time=round(time.time(), 3), controller=self.name, id=self.ident, event=event,
+                     limit=round(self.limit, 2), **extra)
+        with _TRACE_LOCK:
+            try:
+                os.makedirs(os.path.dirname(TRACE_FILE) or ".", exist_ok=True)
+                with open(TRACE_FILE, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(entry) + "\n")
+            except IOError as e:
+                print(f"  [WARNING] Could not write AIMD trace {TRACE_FILE}. {e}")
+
+    def state(self) -> dict:
+        with self._lock:
+            p95 = self._p(0.95)
+            return dict(self.stats, name=self.name, limit=round(self.limit, 2), p95=round(p95, 3) if p95 is not None else None,
+                        best_p95=round(self.best_p95, 3) if self.best_p95 is not None else None)
+
+
+def controller_state() -> dict:
+    """Current limit, latency and cut counts of every controller, by id (names of keys' controllers can repeat)."""
+    with _REGISTRY_LOCK:
+        controllers = list(_CONTROLLERS.values())
+    return {c.ident: c.state() for c in controllers}
@@ -0,0 +1,149 @@
+import asyncio
+import threading
+import weakref
+from urllib.parse import urlsplit
+
+import google.ai.generativelanguage as glm
+import google.generativeai as genai
+from google.ai.generativelanguage_v1beta.services.cache_service.transports.rest import CacheServiceRestTransport
+from google.ai.generativelanguage_v1beta.services.generative_service.transports.rest import GenerativeServiceRestTransport
+from google.auth import api_key
+from openai import OpenAI
+
+# One long-lived client per (provider, key) for the whole process.
+# Building a client opens a gRPC channel / HTTP connection pool, so doing it per call
+# pays connection setup on every row, and genai.configure() swaps a process-wide
+# global, which is unsafe as soon as two threads use different keys. Clients made
+# here carry their own key instead, and are shared by every caller.
+#
+# Gemini: GenerativeModel only falls back to the global (configure()) client when its
+# _client / _async_client is unset, so the models handed out here come with a per-key
+# client already attached. gRPC asyncio channels belong to the event loop that created
+# them, so async models are cached per running loop.
+#
+# With MOCK_LLM_URL set, every client built here talks to that local server instead
+# (llm/mock_server.py): Gemini clients over the REST transport, OpenAI-compatible
+# clients with the mock as base_url. Nothing else in the pipeline changes.
+
+# --- Configuration Constants ---
+MOCK_LLM_URL = None              # e.g. "http://127.0.0.1:8787" to load-test against the mock server
+
+_LOCK = threading.Lock()
+_GEMINI_CLIENTS = {}                               # key -> GenerativeServiceClient
+_GEMINI_CACHE_CLIENTS = {}                         # key -> CacheServiceClient
+_GEMINI_MODELS = {}                                # (key, model_name, system, cache) -> GenerativeModel
+_GEMINI_ASYNC = weakref.WeakKeyDictionary()        # loop -> {(key, model_name, system, cache): GenerativeModel}
+_GEMINI_ASYNC_CLIENTS = weakref.WeakKeyDictionary() # loop -> {key: GenerativeServiceAsyncClient}
+_OPENAI_CLIENTS = {}                               # (base_url, key) -> OpenAI
+_STATS = {"created": 0, "reused": 0}
+
+
+def _mock_transport(transport_class, key: str):
+    url = urlsplit(MOCK_LLM_URL)
+    return transport_class(host=url.netloc, url_scheme=url.scheme, credentials=api_key.Credentials(key))
+
+
+class _ThreadedAsyncClient:
+    """Async face of a sync (REST) client, which has no asyncio transport: each call runs in a thread."""
+
+    def __init__(self, client):
+        self._client = client
+
+    async def generate_content(self, request, **kwargs):
+        return await asyncio.to_thread(self._client.generate_content, request, **kwargs)
+
+    async def stream_generate_content(self, request, **kwargs):
+        chunks = iter(await asyncio.to_thread(self._client.stream_generate_content, request, **kwargs))
+
+        async def pieces():
+            while (chunk := await asyncio.to_thread(next, chunks, None)) is not None:
+                yield chunk
+        return pieces()
+
+
+def _gemini_client(key: str) -> glm.GenerativeServiceClient:
+    if key not in _GEMINI_CLIENTS:
+        if MOCK_LLM_URL:
+            _GEMINI_CLIENTS[key] = glm.GenerativeServiceClient(
+                transport=_mock_transport(GenerativeServiceRestTransport, key))
+        else:
+            _GEMINI_CLIENTS[key] = glm.GenerativeServiceClient(client_options={"api_key": key})
+        _STATS["created"] += 1
+    return _GEMINI_CLIENTS[key]
+
+
+def gemini_cache_client(key: str) -> glm.CacheServiceClient:
+    """Client for the context-caching API (CachedContent resources) of `key`."""
+    with _LOCK:
+        if key not in _GEMINI_CACHE_CLIENTS:
+            if MOCK_LLM_URL:
+                _GEMINI_CACHE_CLIENTS[key] = glm.CacheServiceClient(
+                    transport=_mock_transport(CacheServiceRestTransport, key))
+            else:
+                _GEMINI_CACHE_CLIENTS[key] = glm.CacheServiceClient(client_options={"api_key": key})
+            _STATS["created"] += 1
+        return _GEMINI_CACHE_CLIENTS[key]
+
+
+def _new_model(model_name: str, system_instruction: str = None, cached_content: str = None) -> genai.GenerativeModel:
+    if cached_content:
+        # What GenerativeModel.from_cached_content does, minus its lookup on the global client
+        model = genai.GenerativeModel(model_name)
+        model._cached_content = cached_content
+        return model
+    return genai.GenerativeModel(model_name, system_instruction=system_instruction)
+
+
+def gemini_model(key: str, model_name: str, system_instruction: str = None,
+                 cached_content: str = None) -> genai.GenerativeModel:
+    """Thread-safe GenerativeModel bound to `key`, built once per (key, model, system prefix / cache)."""
+    with _LOCK:
+        model = _GEMINI_MODELS.get((key, model_name, system_instruction, cached_content))
+        if model is None:
+            model = _new_model(model_name, system_instruction, cached_content)
+            model._client = _gemini_client(key)
+            _GEMINI_MODELS[(key, model_name, system_instruction, cached_content)] = model
+        else:
+            _STATS["reused"] += 1
+        return model
+
+
+def gemini_async_model(key: str, model_name: str, system_instruction: str = None,
+                       cached_content: str = None) -> genai.GenerativeModel:
+    """GenerativeModel for generate_content_async, bound to `key` and the running event loop."""
+    loop = asyncio.get_running_loop()
+    with _LOCK:
+        models = _GEMINI_ASYNC.setdefault(loop, {})
+        model = models.get((key, model_name, system_instruction, cached_content))
+        if model is None:
+            model = _new_model(model_name, system_instruction, cached_content)
+            clients = _GEMINI_ASYNC_CLIENTS.setdefault(loop, {})
+            if key not in clients and MOCK_LLM_URL:
+                clients[key] = _ThreadedAsyncClient(_gemini_client(key))
+            elif key not in clients:
+                clients[key] = glm.GenerativeServiceAsyncClient(client_options={"api_key": key})
+                _STATS["created"] += 1
+            model._async_client = clients[key]
+            models[(key, model_name, system_instruction, cached_content)] = model
+        else:
+            _STATS["reused"] += 1
+        return model
+
+
+def openai_client(base_url: str, key: str) -> OpenAI:
+    """OpenAI-compatible client (OpenRouter, Moonshot, ...); its httpx pool is shared across calls and threads."""
+    with _LOCK:
+        client = _OPENAI_CLIENTS.get((base_url, key))
+        if client is None:
+            client = OpenAI(base_url=f"{MOCK_LLM_URL}/v1" if MOCK_LLM_URL else base_url, api_key=key)
+            _OPENAI_CLIENTS[(base_url, key)] = client
+            _STATS["created"] += 1
+        else:
+            _STATS["reused"] += 1
+        return client
+
+
+def client_stats() -> dict:
+    """How many clients were built vs. reused this run."""
+    with _LOCK:
+        return dict(_STATS)
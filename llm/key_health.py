@@ -0,0 +1,155 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+# Circuit breaker per API key, persisted across runs.
+#   closed    : the key is used normally; consecutive failures are counted.
+#   open      : after FAILURE_THRESHOLD consecutive failures (or one auth / daily-quota
+#               error) the key is skipped for a cooldown that doubles on every trip.
+#   half_open : once the cooldown is over, a single probe call is let through. Success
+#               closes the breaker, failure re-opens it with the next cooldown.
+# The state lives in HEALTH_FILE, keyed by a hash of the key (never the key itself), so
+# a restart skips keys that were dead in the last run instead of rediscovering them.
+
+# --- Configuration Constants ---
+HEALTH_FILE = "llm_state/key_health.json"
+FAILURE_THRESHOLD = 3            # consecutive failures that trip the breaker
+BREAKER_BASE_SECONDS = 60        # first open period; doubles on every consecutive trip
+BREAKER_MAX_SECONDS = 6 * 3600   # cap, so a key that was revoked yesterday is re-probed eventually
+PROBE_POLL_SECONDS = 1.0         # how often callers look again while a probe is out
+
+AUTH_ERROR_NAMES = ("PermissionDenied", "Unauthenticated", "AuthenticationError", "PermissionDeniedError")
+AUTH_ERROR_MARKERS = ("api key not valid", "api_key_invalid", "invalid api key", "incorrect api key", "revoked")
+QUOTA_EXHAUSTED_MARKERS = ("per day", "perday", "daily", "insufficient_quota", "billing")
+
+
+def fingerprint(key: str) -> str:
+    """Short hash that identifies a key in state files and logs without revealing it."""
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()[:16]
+
+
+def is_fatal_error(exc: Exception) -> bool:
+    """Errors that will not go away by retrying soon: bad / revoked keys and exhausted daily quota."""
+    code = getattr(exc, "code", None) or getattr(exc, "status_code", None)
+    message = str(exc).lower()
+    try:
+        if int(code) in (401, 403):
+            return True
+    except (TypeError, ValueError):
+        pass
+    if type(exc).__name__ in AUTH_ERROR_NAMES or any(m in message for m in AUTH_ERROR_MARKERS):
+        return True
+    return any(m in message for m in QUOTA_EXHAUSTED_MARKERS) and ("quota" in message or "429" in message)
+
+
+class KeyHealth:
+    def __init__(self, path: str = HEALTH_FILE):
+        self.path = path
+        self.stats = {"trips": 0, "probes": 0, "recovered": 0}
+        self._breakers = None   # fingerprint -> {"state", "failures", "trips", "open_until", "suffix", "last_error"}
+        self._probing = set()   # fingerprints with a half-open probe in flight (never persisted)
+        self._lock = threading.RLock()
+
+    def _load(self):
+        if self._breakers is not None:
+            return
+        self._breakers = {}
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                if isinstance(data, dict):
+                    self._breakers.update(data)
+            except (json.JSONDecodeError, IOError) as e:
+                print(f"  [WARNING] Key health file {self.path} is unreadable, treating every key as healthy. {e}")
+
+    def _breaker(self, key: str) -> dict:
+        self._load()
+        return self._breakers.setdefault(fingerprint(key), {
+            "state": "closed", "failures": 0, "trips": 0, "open_until": 0.0, "suffix": key[-4:], "last_error": "",
+        })
+
+    def wait_time(self, key: str) -> float:
+        """Seconds until the key may be called again: 0 if closed or due for a probe."""
+        with self._lock:
+            breaker = self._breaker(key)
+            if breaker["state"] == "closed":
+                return 0.0
+            if fingerprint(key) in self._probing:
+                return PROBE_POLL_SECONDS   # the one probe is still out; its result decides
+            return max(0.0, breaker["open_until"] - time.time())
+
+    def tripped(self, key: str) -> bool:
+        """Open and not yet due for a probe (a key with a probe in flight may recover any moment)."""
+        with self._lock:
+            breaker = self._breaker(key)
+            return (breaker["state"] != "closed" and fingerprint(key) not in self._probing
+                    and breaker["open_until"] > time.time())
+
+    def on_acquire(self, key: str):
+        """A call is about to go out on `key`; a due open breaker turns half-open and this call is the probe."""
+        with self._lock:
+            breaker = self._breaker(key)
+            if breaker["state"] != "closed":
+                breaker["state"] = "half_open"
+                self._probing.add(fingerprint(key))
+                self.stats["probes"] += 1
+
+    def record_success(self, key: str):
+        with self._lock:
+            breaker = self._breaker(key)
+            self._probing.discard(fingerprint(key))
+            if breaker["state"] == "closed" and not breaker["failures"]:
+                return
+            if breaker["state"] != "closed":
+                self.stats["recovered"] += 1
+                print(f"  [Key health] Key ...{breaker['suffix']} recovered, closing its breaker")
+            breaker.update(state="closed", failures=0, trips=0, open_until=0.0, last_error="")
+            self.save()
+
+    def record_throttled(self, key: str):
+        """A transient 429: not a failure of the key, but a probe that hit it is over (the pool cools the key down)."""
+        with self._lock:
+            self._probing.discard(fingerprint(key))
+
+    def record_failure(self, key: str, error: Exception = None):
+        with self._lock:
+            breaker = self._breaker(key)
+            self._probing.discard(fingerprint(key))
+            breaker["failures"] += 1
+            breaker["last_error"] = str(error)[:200] if error else ""
+            fatal = error is not None and is_fatal_error(error)
+            if breaker["state"] == "half_open" or fatal or breaker["failures"] >= FAILURE_THRESHOLD:
+                cooldown = min(BREAKER_BASE_SECONDS * 2 ** breaker["trips"], BREAKER_MAX_SECONDS)
+                breaker.update(state="open", trips=breaker["trips"] + 1, open_until=time.time() + cooldown)
+                self.stats["trips"] += 1
+                print(f"  [Key health] Key ...{breaker['suffix']} disabled for {cooldown:.0f}s "
+                      f"after {breaker['failures']} failure(s): {breaker['last_error'][:80]}")
+                self.save()
+
+    def save(self):
+        with self._lock:
+            if self._breakers is None:
+                return
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            tmp_path = f"{self.path}.tmp"
+            try:
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump(self._breakers, f, indent=1)
+                os.replace(tmp_path, self.path)
+            except IOError as e:
+                print(f"  [WARNING] Could not save key health {self.path}. {e}")
+
+    def summary(self) -> dict:
+        with self._lock:
+            self._load()
+            now = time.time()
+            unhealthy = {b["suffix"]: round(b["open_until"] - now) for b in self._breakers.values()
+                         if b["state"] != "closed" and b["open_until"] > now}
+            return dict(self.stats, unhealthy=unhealthy)
+
+
+# Shared by every KeyPool; state is saved on every breaker transition
+key_health = KeyHealth()
@@ -0,0 +1,427 @@
+import json
+import random
+import re
+import sys
+import threading
+import time
+from collections import defaultdict, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from batch_job import keyword_verdict, local_verdict
+from llm import aimd
+
+# Local stand-in for the LLM APIs, for load-testing concurrency, batching and
+# rate-limit handling without spending quota.
+#   * OpenAI chat completions (kimi / kimi_2 / router providers), plain and streamed (SSE)
+#   * Gemini generateContent / streamGenerateContent and cachedContents (REST shape)
+# Verdicts are deterministic (batch_job.keyword_verdict on the prompt's technology and
+# text; batched prompts get one entry per item). Latency is lognormal plus a per-token
+# generation time, and a share of calls is answered with a 429 or a malformed reply.
+# Every key also has its own MOCK_RPM limit, so KeyPool throttling is exercised for real.
+#
+# Point the pipeline at it with llm.clients.MOCK_LLM_URL = "http://127.0.0.1:8787", or run
+#   python -m llm.mock_server serve
+#   python -m llm.mock_server bench [rows] [serial|concurrent|batch|router ...] [stream]
+
+# --- Configuration Constants ---
+MOCK_HOST = "127.0.0.1"
+MOCK_PORT = 8787
+LATENCY_MEDIAN_SECONDS = 0.6     # lognormal time to the first token
+LATENCY_SIGMA = 0.5              # spread of that lognormal; 0 gives a fixed latency
+SECONDS_PER_OUTPUT_TOKEN = 0.004 # generation time on top, per output token
+RATE_429 = 0.02                  # share of calls answered with a 429 regardless of load
+MOCK_RPM = 120                   # requests per minute per key before 429s; None for no limit
+MALFORMED_RATE = 0.05            # share of replies that come back malformed
+MALFORMED_KINDS = ["fenced", "prose", "truncated", "python", "refusal"]
+STREAM_PIECES = 8                # chunks a streamed reply is split into
+SEED = 7
+
+BENCH_ROWS = 60
+BENCH_MODES = ["serial", "concurrent", "batch", "router"]
+BENCH_KEYS = 4                   # fake keys per provider
+BENCH_ROUTER_WORKERS = 8         # rows routed at once in "router" mode
+
+BATCH_ITEMS_MARKER = "### **Items to Analyze (JSON)**"
+KEYWORDS_PATTERN = re.compile(r"\*\*Technologies:\*\* `(\[.*?\])`")
+TEXT_PATTERN = re.compile(r"\*\*Text to Analyze:\*\* `(.*?)`\s*---", re.S)
+FIXTURE_ROWS = "llm/fixtures/explain_rows.json"
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // 4 + 1
+
+
+def expected_verdicts(prompt: str):
+    """
+    What the mock answers for a prompt: a verdict, or a list of verdicts tagged with their
+    item id (batched prompt) or keyword (multi-keyword prompt).
+    """
+    if keywords := KEYWORDS_PATTERN.search(prompt):
+        text = TEXT_PATTERN.search(prompt)
+        return [dict(keyword_verdict(k, text.group(1) if text else ""), keyword=k)
+                for k in json.loads(keywords.group(1))]
+    start = prompt.find(BATCH_ITEMS_MARKER)
+    if start < 0:
+        return local_verdict(prompt)
+    try:
+        items, _ = json.JSONDecoder().raw_decode(prompt, prompt.index("[", start))
+    except ValueError:
+        return []
+    return [dict(keyword_verdict(item.get("technology"), item.get("text")), id=str(item.get("id")))
+            for item in items if isinstance(item, dict)]
+
+
+def malform(text: str, kind: str) -> str:
+    """The kinds of broken replies models actually send, all but "refusal" salvageable by llm.parsing."""
+    if kind == "fenced":
+        return f"```json\n{text}\n```"
+    if kind == "prose":
+        return f"Here is my analysis:\n{text}\nLet me know if you need anything else."
+    if kind == "truncated":
+        return text[:max(1, int(len(text) * 0.7))]
+    if kind == "python":
+        return text.replace("true", "True").replace("false", "False").replace('"', "'")
+    return "I am unable to determine this from the text provided."
+
+
+class MockLLMServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, host: str = MOCK_HOST, port: int = MOCK_PORT, seed: int = SEED):
+        super().__init__((host, port), _Handler)
+        self.rng = random.Random(seed)
+        self.stats = defaultdict(int)
+        self.caches = {}                     # cachedContents name -> system text
+        self._calls = defaultdict(deque)     # key -> call times in the last minute
+        self._lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.server_address[0]}:{self.server_address[1]}"
+
+    def start(self) -> "MockLLMServer":
+        threading.Thread(target=self.serve_forever, name="mock-llm", daemon=True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def count(self, stat: str, n: int = 1):
+        with self._lock:
+            self.stats[stat] += n
+
+    def summary(self) -> dict:
+        with self._lock:
+            return dict(self.stats)
+
+    def throttle(self, key: str):
+        """Seconds the caller should wait if this call is answered with a 429, else None."""
+        with self._lock:
+            if self.rng.random() < RATE_429:
+                self.stats["429_injected"] += 1
+                return 1.0
+            now = time.monotonic()
+            calls = self._calls[key]
+            while calls and calls[0] <= now - 60:
+                calls.popleft()
+            if MOCK_RPM and len(calls) >= MOCK_RPM:
+                self.stats["429_rpm"] += 1
+                return max(1.0, calls[0] + 60 - now)
+            calls.append(now)
+            return None
+
+    def reply_text(self, prompt: str) -> str:
+        text = json.dumps(expected_verdicts(prompt))
+        with self._lock:
+            if self.rng.random() >= MALFORMED_RATE:
+                return text
+            kind = self.rng.choice(MALFORMED_KINDS)
+            self.stats[f"malformed_{kind}"] += 1
+        return malform(text, kind)
+
+    def latency(self, output_tokens: int) -> tuple:
+        """(seconds to the first token, seconds to generate the rest)."""
+        with self._lock:
+            first = self.rng.lognormvariate(0, LATENCY_SIGMA) * LATENCY_MEDIAN_SECONDS if LATENCY_SIGMA else \
+                LATENCY_MEDIAN_SECONDS
+        return first, output_tokens * SECONDS_PER_OUTPUT_TOKEN
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"        # keep-alive, as with the real APIs
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status: int, body, headers: dict = None):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _start_chunked(self, content_type: str):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+    def _chunk(self, data: str):
+        raw = data.encode("utf-8")
+        self.wfile.write(f"{len(raw):X}\r\n".encode("ascii") + raw + b"\r\n")
+        self.wfile.flush()
+
+    def _stream(self, text: str, first: float, rest: float, frame):
+        """Sends `text` as STREAM_PIECES frames paced by the latency; frame(index, piece, last) -> wire text."""
+        step = max(1, -(-len(text) // STREAM_PIECES))
+        pieces = [text[i:i + step] for i in range(0, len(text), step)] or [""]
+        time.sleep(first)
+        for i, piece in enumerate(pieces):
+            if i:
+                time.sleep(rest / len(pieces))
+            self._chunk(frame(i, piece, i == len(pieces) - 1))
+
+    def do_GET(self):
+        if self.path.rstrip("/") == "/stats":
+            return self._send_json(200, self.server.summary())
+        self._send_json(404, {"error": {"code": 404, "message": f"No route {self.path}"}})
+
+    def do_POST(self):
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+        except json.JSONDecodeError:
+            return self._send_json(400, {"error": {"code": 400, "message": "Request body is not JSON"}})
+        path = self.path.split("?", 1)[0]
+        self.server.count("requests")
+        try:
+            if path.endswith("/chat/completions"):
+                return self._openai(body)
+            if path.endswith("/cachedContents"):
+                return self._gemini_cache(body)
+            if match := re.search(r"/models/([^/:]+):(generateContent|streamGenerateContent)$", path):
+                return self._gemini(body, match.group(1), stream=match.group(2) == "streamGenerateContent")
+            self._send_json(404, {"error": {"code": 404, "message": f"No route {path}"}})
+        except (BrokenPipeError, ConnectionResetError):
+            self.server.count("client_disconnects")   # e.g. a stream closed early on purpose
+            self.close_connection = True
+
+    # OpenAI chat completions ------------------------------------------------
+
+    def _openai(self, body: dict):
+        key = self.headers.get("Authorization", "").removeprefix("Bearer ").strip()
+        if (retry_after := self.server.throttle(key)) is not None:
+            return self._send_json(429, {"error": {"message": "Rate limit reached for requests", "type": "requests",
+                                                   "code": "rate_limit_exceeded"}},
+                                   {"Retry-After": f"{retry_after:.0f}"})
+        self.server.count("openai_calls")
+        messages = body.get("messages") or []
+        prompt = "\n".join(str(m.get("content", "")) for m in messages)
+        text = self.server.reply_text(prompt)
+        usage = {"prompt_tokens": estimate_tokens(prompt), "completion_tokens": estimate_tokens(text),
+                 "total_tokens": estimate_tokens(prompt) + estimate_tokens(text)}
+        first, rest = self.server.latency(usage["completion_tokens"])
+        reply_id, created, model = f"chatcmpl-mock-{self.server.stats['requests']}", int(time.time()), body.get("model")
+
+        if not body.get("stream"):
+            time.sleep(first + rest)
+            return self._send_json(200, {
+                "id": reply_id, "object": "chat.completion", "created": created, "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+                "usage": usage,
+            })
+
+        def frame(index: int, piece: str, last: bool) -> str:
+            chunk = {"id": reply_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                     "choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": "stop" if last else None}]}
+            out = f"data: {json.dumps(chunk)}\n\n"
+            if last and (body.get("stream_options") or {}).get("include_usage"):
+                out += f"data: {json.dumps(dict(chunk, choices=[], usage=usage))}\n\n"
+            return out + ("data: [DONE]\n\n" if last else "")
+
+        self._start_chunked("text/event-stream")
+        self._stream(text, first, rest, frame)
+        self._chunk("")
+
+    # Gemini -----------------------------------------------------------------
+
+    def _gemini_throttled(self) -> bool:
+        if (retry_after := self.server.throttle(self.headers.get("x-goog-api-key", ""))) is None:
+            return False
+        self._send_json(429, {"error": {"code": 429, "message": "Resource has been exhausted (e.g. check quota).",
+                                        "status": "RESOURCE_EXHAUSTED"}}, {"Retry-After": f"{retry_after:.0f}"})
+        return True
+
+    def _gemini_cache(self, body: dict):
+        system = "".join(p.get("text", "") for p in (body.get("systemInstruction") or {}).get("parts", []))
+        with self.server._lock:
+            name = f"cachedContents/mock-{len(self.server.caches) + 1}"
+            self.server.caches[name] = system
+            self.server.stats["caches_created"] += 1
+        self._send_json(200, {"name": name, "model": body.get("model"),
+                              "usageMetadata": {"totalTokenCount": estimate_tokens(system)}})
+
+    def _gemini(self, body: dict, model: str, stream: bool):
+        if self._gemini_throttled():
+            return
+        self.server.count("gemini_calls")
+        system = "".join(p.get("text", "") for p in (body.get("systemInstruction") or {}).get("parts", []))
+        cached = self.server.caches.get(body.get("cachedContent"), "")
+        task = "".join(p.get("text", "") for c in body.get("contents", []) for p in c.get("parts", []))
+        text = self.server.reply_text(cached + system + task)
+        usage = {"promptTokenCount": estimate_tokens(cached + system + task),
+                 "cachedContentTokenCount": estimate_tokens(cached) if cached else 0,
+                 "candidatesTokenCount": estimate_tokens(text)}
+        first, rest = self.server.latency(usage["candidatesTokenCount"])
+
+        def candidate(piece: str, last: bool) -> dict:
+            return dict({"content": {"role": "model", "parts": [{"text": piece}]}}, **({"finishReason": 1} if last else {}))
+
+        if not stream:
+            time.sleep(first + rest)
+            return self._send_json(200, {"candidates": [candidate(text, True)], "usageMetadata": usage,
+                                         "modelVersion": model})
+
+        def frame(index: int, piece: str, last: bool) -> str:
+            # The REST stream is one JSON array, sent element by element
+            chunk = {"candidates": [candidate(piece, last)], "modelVersion": model}
+            return ("," if index else "[") + json.dumps(dict(chunk, usageMetadata=usage) if last else chunk) + \
+                ("]" if last else "")
+
+        self._start_chunked("application/json")
+        self._stream(text, first, rest, frame)
+        self._chunk("")
+
+
+# Benchmark -----------------------------------------------------------------
+
+def _percentile(values: list, q: float):
+    ordered = sorted(values)
+    return round(ordered[int(q * (len(ordered) - 1))], 3) if ordered else None
+
+
+def use_mock(keys: int = BENCH_KEYS) -> MockLLMServer:
+    """
+    Starts a mock server on a free port and points the pipeline at it: every client,
+    `keys` fake Gemini keys, and caches, usage log and key health in a temp directory,
+    so nothing from a test run leaks into the real state files.
+    """
+    import tempfile
+
+    import explain_url
+    from llm import clients
+    from llm.key_health import KeyHealth
+    from llm.rate_limit import KeyPool
+    from llm.usage import usage_log
+    from llm.verdict_cache import verdict_cache
+
+    server = MockLLMServer(port=0).start()
+    clients.MOCK_LLM_URL = server.url
+    state_dir = tempfile.mkdtemp(prefix="mock_llm_")
+    verdict_cache.path = f"{state_dir}/verdicts.json"
+    usage_log.path = f"{state_dir}/usage.jsonl"
+    aimd.TRACE_FILE = f"{state_dir}/aimd_trace.jsonl"
+    explain_url.key_pool = KeyPool([f"mock-gemini-{i:04d}" for i in range(keys)], rpm=MOCK_RPM or 10_000,
+                                   tpm=10_000_000, health=KeyHealth(f"{state_dir}/key_health.json"), name="gemini")
+    return server
+
+
+def benchmark(rows: int = BENCH_ROWS, modes: list = None, stream: bool = False) -> dict:
+    """
+    Runs `rows` fixture rows through each explain path against a fresh mock server and
+    reports throughput, call latency, 429s, malformed replies and whether every verdict
+    matches what the mock meant to answer.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    import explain_url
+    from llm import parsing, providers
+    from llm.rate_limit import KeyPool
+    from llm.usage import usage_log
+
+    server = use_mock()
+    parsing.STREAM_RESPONSES = stream
+    gemini = providers.GeminiProvider()
+    openrouter = providers.OpenAICompatibleProvider("kimi_openrouter", "http://unused", "moonshotai/kimi-k2", [],
+                                                    rpm=MOCK_RPM or 10_000, tpm=10_000_000)
+    openrouter.pool = KeyPool([f"mock-openrouter-{i:04d}" for i in range(BENCH_KEYS)], rpm=MOCK_RPM or 10_000,
+                              tpm=10_000_000, health=explain_url.key_pool.health, name="kimi_openrouter")
+    router = providers.Router({"gemini": gemini, "kimi_openrouter": openrouter})
+
+    with open(FIXTURE_ROWS, "r", encoding="utf-8") as f:
+        fixtures = json.load(f)
+
+    report = {}
+    for mode in modes or BENCH_MODES:
+        # Company names are unique per mode and row, so no verdict is served from a cache
+        items = [dict(fixtures[i % len(fixtures)], id=str(i), page_url=f"https://mock.test/{mode}/{i}",
+                      company_name=f"{fixtures[i % len(fixtures)]['company_name']} {mode} {i}")
+                 for i in range(rows)]
+        calls_before, stats_before, parse_before = len(usage_log.calls), server.summary(), parsing.parse_stats()
+        started = time.perf_counter()
+        if mode == "serial":
+            verdicts = [explain_url.explain(item["chunk_text"], item["keyword_tech"], item["company_name"],
+                                            item["page_url"]) for item in items]
+        elif mode == "concurrent":
+            verdicts = explain_url.explain_many(items)
+        elif mode == "batch":
+            verdicts = explain_url.explain_batch(items)
+        elif mode == "router":
+            with ThreadPoolExecutor(max_workers=BENCH_ROUTER_WORKERS) as executor:
+                verdicts = list(executor.map(lambda item: router.explain(
+                    item["chunk_text"], item["keyword_tech"], item["company_name"], item["page_url"]), items))
+        else:
+            print(f"  [WARNING] Unknown benchmark mode '{mode}', skipped")
+            continue
+        seconds = time.perf_counter() - started
+
+        calls = usage_log.calls[calls_before:]
+        stats = server.summary()
+        parse = parsing.parse_stats()
+        errors = sum(1 for v in verdicts if "API or parsing error" in v.get("explanation", ""))
+        expected = [keyword_verdict(item["keyword_tech"], item["chunk_text"])["uses_tech"] for item in items]
+        report[mode] = {
+            "rows": rows,
+            "seconds": round(seconds, 2),
+            "rows_per_second": round(rows / seconds, 2),
+            "llm_calls": len(calls),
+            "call_p50_s": _percentile([c["latency_s"] for c in calls if not c["error"]], 0.5),
+            "call_p95_s": _percentile([c["latency_s"] for c in calls if not c["error"]], 0.95),
+            "key_wait_s": round(sum(c["wait_s"] for c in calls), 2),
+            "429s": sum(stats.get(k, 0) - stats_before.get(k, 0) for k in ("429_injected", "429_rpm")),
+            "malformed": sum(v - stats_before.get(k, 0) for k, v in stats.items() if k.startswith("malformed_")),
+            "parse_retries": parse["retries"] - parse_before["retries"],
+            "row_errors": errors,
+            "verdicts_as_intended": sum(1 for v, e in zip(verdicts, expected) if v.get("uses_tech") == e),
+        }
+    rows_run = sum(result["rows"] for result in report.values())   # unknown modes are not counted
+    report["server"] = server.summary()
+    # Keyed by controller id: display names ("llm key ...abcd") can repeat across pools
+    report["aimd"] = {ident: {k: state[k] for k in ("name", "limit", "increases", "cuts_429", "cuts_latency", "p95")}
+                      for ident, state in aimd.controller_state().items()}
+    report["usage"] = {k: v for k, v in usage_log.summary(rows_run).items()
+                       if k in ("calls", "errors", "input_tokens", "cached_tokens", "output_tokens")}
+    server.stop()
+    return report
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "serve":
+        server = MockLLMServer()
+        print(f"Mock LLM server on {server.url} (set llm.clients.MOCK_LLM_URL to this); stats at {server.url}/stats")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            server.server_close()
+    elif len(sys.argv) > 1 and sys.argv[1] == "bench":
+        args = sys.argv[2:]
+        rows = int(args.pop(0)) if args and args[0].isdigit() else BENCH_ROWS
+        result = benchmark(rows, [a for a in args if a != "stream"] or None, stream="stream" in args)
+        for name, values in result.items():
+            print(f"{name:>12}: {values}")
+    else:
+        print("Usage: python -m llm.mock_server serve | bench [rows] [serial|concurrent|batch|router ...] [stream]")
+        sys.exit(1)
@@ -0,0 +1,354 @@
+import json
+import re
+import threading
+import time
+from typing import AsyncIterable, Awaitable, Callable, Iterable, Optional
+
+# Structured output for the LLM layer.
+#   * VERDICT_SCHEMA / BATCH_SCHEMA are sent as response schemas where the API supports
+#     them (Gemini response_schema, OpenAI-style json_schema response_format).
+#   * salvage_json() repairs what still comes back malformed: markdown fences, prose
+#     around the JSON, Python literals, trailing commas, and replies cut off mid-object.
+#   * verdict_with_retry() re-asks once, with a stricter instruction, only when salvage
+#     fails. Every reply is counted in parse_stats().
+#   * With STREAM_RESPONSES, replies are read incrementally (read_stream). As soon as
+#     "uses_tech" arrives, on_verdict is called: callers free the key / AIMD / concurrency
+#     slot and record the row's verdict, while the explanation keeps streaming in. With
+#     MAX_EXPLANATION_CHARS the stream is closed once the explanation reaches that length,
+#     instead of waiting for the model to finish; MAX_EXPLANATION_CHARS = 0 keeps only the
+#     verdict. A stream that breaks after the verdict keeps its partial reply.
+
+# --- Configuration Constants ---
+MAX_PARSE_RETRIES = 1
+RETRY_NUDGE = "\n\nReturn ONLY the JSON object described above, with no other text.\n"
+STREAM_RESPONSES = False
+MAX_EXPLANATION_CHARS = None     # None: keep the whole explanation; an int clips it (and ends streams early)
+
+VERDICT_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "uses_tech": {"type": "boolean"},
+        "explanation": {"type": "string"},
+    },
+    "required": ["uses_tech", "explanation"],
+}
+
+BATCH_SCHEMA = {
+    "type": "array",
+    "items": {
+        "type": "object",
+        "properties": {
+            "id": {"type": "string"},
+            "uses_tech": {"type": "boolean"},
+            "explanation": {"type": "string"},
+        },
+        "required": ["id", "uses_tech", "explanation"],
+    },
+}
+
+KEYWORDS_SCHEMA = {
+    "type": "array",
+    "items": {
+        "type": "object",
+        "properties": {
+            "keyword": {"type": "string"},
+            "uses_tech": {"type": "boolean"},
+            "explanation": {"type": "string"},
+        },
+        "required": ["keyword", "uses_tech", "explanation"],
+    },
+}
+
+_STATS = {"replies": 0, "clean": 0, "salvaged": 0, "failed": 0, "retries": 0, "retry_recovered": 0}
+_STREAM_STATS = {"streams": 0, "verdicts": 0, "cut_early": 0, "seconds_to_verdict": 0.0, "seconds_total": 0.0}
+_USES_TECH = re.compile(r'["\']?uses_tech["\']?\s*:\s*["\']?(true|false)', re.IGNORECASE)
+_EXPLANATION_OPEN = re.compile(r'["\']explanation["\']\s*:\s*["\']')
+_STATS_LOCK = threading.Lock()
+
+
+class VerdictParseError(ValueError):
+    """The reply could not be turned into a verdict, even after salvage."""
+
+
+def max_output_tokens() -> Optional[int]:
+    # Room for the JSON keys plus the capped explanation (~3 characters per token, to be safe)
+    return MAX_EXPLANATION_CHARS // 3 + 40 if MAX_EXPLANATION_CHARS is not None else None
+
+
+def gemini_generation_config(schema: dict) -> dict:
+    config = {"response_mime_type": "application/json", "response_schema": schema}
+    if STREAM_RESPONSES and schema is VERDICT_SCHEMA:
+        # Schema output comes back in alphabetical key order (explanation first) and this SDK
+        # cannot set property ordering, so streams use plain JSON mode and the prompt's order
+        del config["response_schema"]
+        # Only in prompt order ("uses_tech" first) can a token cap clip the explanation
+        # without cutting off the verdict itself
+        if (max_tokens := max_output_tokens()) is not None:
+            config["max_output_tokens"] = max_tokens
+    return config
+
+
+def rest_generation_config(schema: dict) -> dict:
+    """Same as gemini_generation_config, spelled for the REST / batch request JSON."""
+    def upper_types(node):
+        if isinstance(node, dict):
+            return {k: (v.upper() if k == "type" else upper_types(v)) for k, v in node.items()}
+        return node
+    return {"responseMimeType": "application/json", "responseSchema": upper_types(schema)}
+
+
+def openai_response_format(mode: Optional[str], schema: dict = VERDICT_SCHEMA) -> dict:
+    """response_format for chat.completions: "json_schema" (strict), "json_object" (JSON mode) or None."""
+    if mode == "json_schema" and not STREAM_RESPONSES:
+        return {"type": "json_schema", "json_schema": {"name": "verdict", "schema": schema, "strict": True}}
+    if mode == "json_object":
+        return {"type": "json_object"}
+    return {}
+
+
+def _count(stat: str):
+    with _STATS_LOCK:
+        _STATS[stat] += 1
+
+
+def _close_truncated(text: str) -> str:
+    """Closes an unterminated string and any open brackets of JSON that was cut off."""
+    stack, in_string, escaped = [], False, False
+    for char in text:
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char in "{[":
+            stack.append("}" if char == "{" else "]")
+        elif char in "}]" and stack:
+            stack.pop()
+    if in_string:
+        text += '"'
+    # A dangling key, colon or comma cannot be completed; drop it
+    text = re.sub(r'(,\s*"[^"]*"\s*:?\s*|,\s*|:\s*)$', "", text.rstrip())
+    return text + "".join(reversed(stack))
+
+
+def _candidates(text: str):
+    """Progressively more aggressive repairs of `text`, cheapest first."""
+    text = text.strip().lstrip("﻿")
+    yield text
+    unfenced = re.sub(r"^```[a-zA-Z]*\s*|\s*```\s*$", "", text)
+    yield unfenced
+    starts = [i for i in (unfenced.find("{"), unfenced.find("[")) if i >= 0]
+    if not starts:
+        return
+    body = unfenced[min(starts):]
+    end = max(body.rfind("}"), body.rfind("]"))
+    if end >= 0:
+        yield body[:end + 1]
+    repaired = re.sub(r"\bTrue\b", "true", re.sub(r"\bFalse\b", "false", re.sub(r"\bNone\b", "null", body)))
+    repaired = re.sub(r",\s*([}\]])", r"\1", repaired.replace("“", '"').replace("”", '"'))
+    yield repaired
+    yield _close_truncated(repaired)
+    if "}" in repaired:
+        # Batched reply cut off inside an item: keep the complete items before it
+        yield _close_truncated(repaired[:repaired.rfind("}") + 1])
+
+
+def salvage_json(text: str) -> tuple:
+    """(value, clean) for the first repair that parses; raises VerdictParseError if none does."""
+    if not isinstance(text, str) or not text.strip():
+        raise VerdictParseError("empty reply")
+    for i, candidate in enumerate(_candidates(text)):
+        try:
+            return json.loads(candidate), i == 0
+        except json.JSONDecodeError:
+            continue
+    raise VerdictParseError(f"unparseable reply: {text[:120]!r}")
+
+
+def _as_bool(value) -> Optional[bool]:
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, str) and value.strip().lower() in ("true", "yes"):
+        return True
+    if isinstance(value, str) and value.strip().lower() in ("false", "no"):
+        return False
+    return None
+
+
+def salvage_verdict(text: str) -> dict:
+    """{"uses_tech", "explanation"} from a single-row reply, repairing it if needed."""
+    _count("replies")
+    try:
+        value, clean = salvage_json(text)
+    except VerdictParseError:
+        value, clean = None, False
+    if isinstance(value, list) and value and isinstance(value[0], dict):
+        value = value[0]
+    uses_tech = _as_bool(value.get("uses_tech")) if isinstance(value, dict) else None
+
+    if uses_tech is None:
+        # Last resort: the two fields by pattern, e.g. from a reply cut off inside the explanation
+        match = re.search(r'["\']?uses_tech["\']?\s*:\s*["\']?(true|false)', text or "", re.IGNORECASE)
+        if not match:
+            _count("failed")
+            raise VerdictParseError(f"no uses_tech in reply: {(text or '')[:120]!r}")
+        uses_tech = match.group(1).lower() == "true"
+        explanation = re.search(r'["\']explanation["\']\s*:\s*(["\'])((?:(?!\1)[^\\]|\\.)*)', text)
+        value, clean = {"explanation": explanation.group(2) if explanation else None}, False
+
+    _count("clean" if clean else "salvaged")
+    explanation = value.get("explanation") or ""
+    if MAX_EXPLANATION_CHARS is not None and len(explanation) > MAX_EXPLANATION_CHARS:
+        explanation = explanation[:MAX_EXPLANATION_CHARS].rstrip() + "..."
+    return {
+        "uses_tech": uses_tech,
+        "explanation": explanation or ("No explanation from LLM." if MAX_EXPLANATION_CHARS != 0 else ""),
+    }
+
+
+def salvage_list(text: str) -> list:
+    """Entries of a batched reply (a JSON array, or an object wrapping one); [] if hopeless."""
+    try:
+        value, _ = salvage_json(text)
+    except VerdictParseError:
+        return []
+    if isinstance(value, dict):
+        value = value.get("items") or value.get("results") or [value]
+    return value if isinstance(value, list) else []
+
+
+def verdict_with_retry(generate: Callable[[str], str], prompt: str) -> dict:
+    """generate(prompt) -> reply text; one stricter re-ask if the reply cannot be salvaged."""
+    for attempt in range(MAX_PARSE_RETRIES + 1):
+        try:
+            verdict = salvage_verdict(generate(prompt if attempt == 0 else prompt + RETRY_NUDGE))
+        except VerdictParseError:
+            if attempt == MAX_PARSE_RETRIES:
+                raise
+            _count("retries")
+            continue
+        if attempt:
+            _count("retry_recovered")
+        return verdict
+
+
+async def verdict_with_retry_async(generate: Callable[[str], Awaitable[str]], prompt: str) -> dict:
+    for attempt in range(MAX_PARSE_RETRIES + 1):
+        try:
+            verdict = salvage_verdict(await generate(prompt if attempt == 0 else prompt + RETRY_NUDGE))
+        except VerdictParseError:
+            if attempt == MAX_PARSE_RETRIES:
+                raise
+            _count("retries")
+            continue
+        if attempt:
+            _count("retry_recovered")
+        return verdict
+
+
+def once(callback: Optional[Callable]) -> Optional[Callable]:
+    """callback, run on the first call only (a re-asked or hedged reply reports its verdict again)."""
+    if callback is None:
+        return None
+    lock, called = threading.Lock(), []
+
+    def wrapper(*args):
+        with lock:
+            if called:
+                return
+            called.append(True)
+        callback(*args)
+    return wrapper
+
+
+class StreamReader:
+    """Accumulates a streamed verdict reply and says when the rest of it is not needed."""
+
+    def __init__(self, on_verdict: Callable[[bool], None] = None):
+        self.text = ""
+        self.uses_tech = None
+        self.on_verdict = on_verdict
+        self.started = time.perf_counter()
+        self.verdict_at = None
+
+    def feed(self, piece: str) -> bool:
+        """Adds one streamed piece; True once reading further would only lengthen a clipped explanation."""
+        self.text += piece or ""
+        if self.uses_tech is None and (match := _USES_TECH.search(self.text)):
+            self.uses_tech = match.group(1).lower() == "true"
+            self.verdict_at = time.perf_counter()
+            if self.on_verdict:
+                self.on_verdict(self.uses_tech)
+        if MAX_EXPLANATION_CHARS is None or self.uses_tech is None:
+            return False
+        if MAX_EXPLANATION_CHARS == 0:
+            return True
+        opened = _EXPLANATION_OPEN.search(self.text)
+        return bool(opened) and len(self.text) - opened.end() > MAX_EXPLANATION_CHARS
+
+    def broken(self, error: Exception) -> str:
+        """Reply so far when the stream fails; re-raises unless the verdict was already handed out."""
+        if self.on_verdict is None or self.uses_tech is None:
+            raise error
+        print(f"  [WARNING] Stream broke after the verdict; keeping the partial explanation. {error}")
+        return self.finish(cut=True)
+
+    def finish(self, cut: bool) -> str:
+        with _STATS_LOCK:
+            _STREAM_STATS["streams"] += 1
+            _STREAM_STATS["cut_early"] += cut
+            _STREAM_STATS["seconds_total"] += time.perf_counter() - self.started
+            if self.verdict_at is not None:
+                _STREAM_STATS["verdicts"] += 1
+                _STREAM_STATS["seconds_to_verdict"] += self.verdict_at - self.started
+        return self.text
+
+
+def read_stream(pieces: Iterable[str], on_verdict: Callable[[bool], None] = None) -> str:
+    """
+    Reply text from a stream of text pieces, stopping early per MAX_EXPLANATION_CHARS.
+    on_verdict(uses_tech) is called as soon as the verdict has been parsed.
+    """
+    reader = StreamReader(on_verdict)
+    try:
+        for piece in pieces:
+            if reader.feed(piece):
+                return reader.finish(cut=True)
+    except Exception as e:
+        return reader.broken(e)
+    return reader.finish(cut=False)
+
+
+async def read_stream_async(pieces: AsyncIterable[str], on_verdict: Callable[[bool], None] = None) -> str:
+    reader = StreamReader(on_verdict)
+    try:
+        async for piece in pieces:
+            if reader.feed(piece):
+                return reader.finish(cut=True)
+    except Exception as e:
+        return reader.broken(e)
+    return reader.finish(cut=False)
+
+
+def stream_stats() -> dict:
+    """Streamed replies, how many were cut early, and mean seconds to the verdict vs. the whole reply."""
+    with _STATS_LOCK:
+        stats = dict(_STREAM_STATS)
+    return {
+        "streams": stats["streams"],
+        "cut_early": stats["cut_early"],
+        "avg_seconds_to_verdict": round(stats["seconds_to_verdict"] / stats["verdicts"], 2) if stats["verdicts"] else None,
+        "avg_seconds_total": round(stats["seconds_total"] / stats["streams"], 2) if stats["streams"] else None,
+    }
+
+
+def parse_stats() -> dict:
+    """Reply counts by outcome, and the share of replies that could not be parsed at all."""
+    with _STATS_LOCK:
+        stats = dict(_STATS)
+    stats["parse_failure_rate"] = round(stats["failed"] / stats["replies"], 4) if stats["replies"] else 0.0
+    return stats
@@ -0,0 +1,237 @@
+import hashlib
+import threading
+import time
+from datetime import timedelta
+from typing import Optional
+
+import google.ai.generativelanguage as glm
+
+from llm.clients import gemini_async_model, gemini_cache_client, gemini_model
+
+# Explicit context caching for the static part of a prompt.
+# Prompts are split into a static system prefix (rules, output format) and a small
+# per-row suffix (company, keyword, text). The prefix is uploaded once per API key as a
+# Gemini CachedContent resource and every call then sends only the suffix, so the rule
+# block is billed at the cached-token rate instead of in full on every row.
+#
+# The API only caches prefixes of at least a model-specific size (CONTEXT_CACHE_MIN_TOKENS);
+# smaller prefixes are never sent for caching. When the API refuses a cache anyway (model
+# without explicit caching, quota), that key falls back to sending the prefix as
+# system_instruction for CONTEXT_CACHE_TTL_SECONDS. The prefix still comes first and
+# never changes between rows, which is what implicit / automatic prefix caching needs.
+# Whether a cache is really used shows in the [Prompt cache] line: cached tokens are
+# counted from usage_metadata.cached_content_token_count of every reply.
+
+# --- Configuration Constants ---
+CONTEXT_CACHING = True
+CONTEXT_CACHE_TTL_SECONDS = 3600
+CONTEXT_CACHE_REFRESH_SECONDS = 120   # recreate a cache this long before it expires
+# Smallest prefix the Gemini API caches explicitly, per model (model names match by prefix);
+# smaller prefixes are not even offered. Earlier models (1.5 / 2.0) need the default.
+CONTEXT_CACHE_MIN_TOKENS = {"gemini-2.5-flash": 1024, "gemini-2.5-pro": 4096}
+CONTEXT_CACHE_DEFAULT_MIN_TOKENS = 4096
+CACHED_TOKEN_RATE = 0.25              # cached input tokens are billed at this fraction
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // 4 + 1
+
+
+def min_cache_tokens(model_name: str) -> int:
+    """Smallest prefix (in tokens) the API will cache for `model_name`."""
+    for prefix, tokens in CONTEXT_CACHE_MIN_TOKENS.items():
+        if model_name.startswith(prefix):
+            return tokens
+    return CONTEXT_CACHE_DEFAULT_MIN_TOKENS
+
+
+class PrefixCache:
+    def __init__(self, model_name: str, min_tokens: int = None, ttl: int = CONTEXT_CACHE_TTL_SECONDS):
+        self.model_name = model_name
+        self.min_tokens = min_cache_tokens(model_name) if min_tokens is None else min_tokens
+        self.ttl = ttl
+        self.stats = {"caches_created": 0, "cache_failures": 0, "cached_calls": 0, "uncached_calls": 0,
+                      "prompt_tokens": 0, "cached_tokens": 0}
+        self._entries = {}  # (key, prefix hash) -> (cache name or None, retry/expiry time)
+        self._creating = {}  # (key, prefix hash) -> lock held while that cache is being created
+        self._lock = threading.Lock()
+
+    def _live(self, entry_key: tuple) -> tuple:
+        """(True, cache name or None) while the entry is fresh; (False, None) when it must be (re)created."""
+        with self._lock:
+            name, until = self._entries.get(entry_key, (None, 0.0))
+            if time.time() < until - (CONTEXT_CACHE_REFRESH_SECONDS if name else 0):
+                return True, name
+            return False, None
+
+    def cache_name(self, key: str, prefix: str) -> Optional[str]:
+        """Name of a live CachedContent holding `prefix` for `key`, created on demand; None if unavailable."""
+        if not CONTEXT_CACHING or estimate_tokens(prefix) < self.min_tokens:
+            return None
+        entry_key = (key, hashlib.sha1(prefix.encode("utf-8")).hexdigest())
+        fresh, name = self._live(entry_key)
+        if fresh:
+            return name
+        with self._lock:
+            creating = self._creating.setdefault(entry_key, threading.Lock())
+        # The create call goes over the network: only callers of this key and prefix wait for it
+        with creating:
+            fresh, name = self._live(entry_key)
+            if fresh:
+                return name   # made while this caller waited
+            try:
+                cached = gemini_cache_client(key).create_cached_content(glm.CreateCachedContentRequest(
+                    cached_content=glm.CachedContent(
+                        model=f"models/{self.model_name}",
+                        system_instruction=glm.Content(parts=[glm.Part(text=prefix)]),
+                        ttl=timedelta(seconds=self.ttl),
+                    )))
+                name, stat = cached.name, "caches_created"
+            except Exception as e:
+                print(f"  [WARNING] Context cache unavailable for key ...{key[-4:]}, sending the prefix instead. {e}")
+                name, stat = None, "cache_failures"
+            with self._lock:
+                self.stats[stat] += 1
+                self._entries[entry_key] = (name, time.time() + self.ttl)
+            return name
+
+    def _count(self, cached: bool):
+        with self._lock:
+            self.stats["cached_calls" if cached else "uncached_calls"] += 1
+
+    def model(self, key: str, prefix: str):
+        """GenerativeModel for `key` whose context already holds `prefix` (cached, or as system_instruction)."""
+        name = self.cache_name(key, prefix)
+        self._count(bool(name))
+        if name:
+            return gemini_model(key, self.model_name, cached_content=name)
+        return gemini_model(key, self.model_name, system_instruction=prefix)
+
+    def async_model(self, key: str, prefix: str):
+        name = self.cache_name(key, prefix)
+        self._count(bool(name))
+        if name:
+            return gemini_async_model(key, self.model_name, cached_content=name)
+        return gemini_async_model(key, self.model_name, system_instruction=prefix)
+
+    def record_usage(self, response):
+        """Adds the billed prompt / cached token counts of one response to the stats."""
+        usage = getattr(response, "usage_metadata", None)
+        if usage is None:
+            return
+        with self._lock:
+            self.stats["prompt_tokens"] += usage.prompt_token_count or 0
+            self.stats["cached_tokens"] += usage.cached_content_token_count or 0
+
+    def summary(self) -> dict:
+        with self._lock:
+            stats = dict(self.stats)
+        # Cost in full-price input tokens: cached tokens only cost CACHED_TOKEN_RATE
+        stats["billed_input_tokens"] = round(stats["prompt_tokens"] - stats["cached_tokens"] * (1 - CACHED_TOKEN_RATE))
+        return stats
+
+
+# --- Self-check -------------------------------------------------------------------
+# python -m llm.prompt_cache [rows.json]
+# Runs explain() over a fixture batch against in-process stand-ins for the Gemini
+# generate / cache services, checks that one cache is created per key and every call
+# runs on it, and reports input tokens billed with and without the cache. The minimum
+# prefix size is forced to 0 for this, so the report also says whether the real model
+# would cache this prefix at all.
+
+FIXTURE_ROWS = "llm/fixtures/explain_rows.json"
+
+
+class _MockCacheService:
+    def __init__(self):
+        self.created = {}   # cache name -> prefix text
+
+    def create_cached_content(self, request, **kwargs):
+        name = f"cachedContents/mock-{len(self.created) + 1}"
+        self.created[name] = request.cached_content.system_instruction.parts[0].text
+        return glm.CachedContent(name=name, model=request.cached_content.model)
+
+
+class _MockGenerativeService:
+    def __init__(self, caches: _MockCacheService):
+        self.caches = caches
+        self.requests = []
+
+    def generate_content(self, request, **kwargs):
+        self.requests.append(request)
+        sent = "".join(p.text for c in request.contents for p in c.parts)
+        sent += "".join(p.text for p in request.system_instruction.parts)
+        cached = self.caches.created.get(request.cached_content, "") if request.cached_content else ""
+        return glm.GenerateContentResponse(
+            candidates=[glm.Candidate(
+                content=glm.Content(role="model", parts=[glm.Part(text='{"uses_tech": false, "explanation": "mock"}')]),
+                finish_reason=glm.Candidate.FinishReason.STOP)],
+            usage_metadata=glm.GenerateContentResponse.UsageMetadata(
+                prompt_token_count=estimate_tokens(sent) + estimate_tokens(cached) if cached else estimate_tokens(sent),
+                cached_content_token_count=estimate_tokens(cached) if cached else 0),
+        )
+
+
+def self_check(rows_path: str = FIXTURE_ROWS) -> dict:
+    import json
+    import tempfile
+
+    import explain_url
+    from llm import aimd, clients
+    from llm.key_health import KeyHealth
+    from llm.rate_limit import KeyPool
+    from llm.verdict_cache import VerdictCache
+
+    with open(rows_path, "r", encoding="utf-8") as f:
+        rows = json.load(f)
+
+    keys = ["mock-key-0001", "mock-key-0002"]
+    caches = _MockCacheService()
+    services = {}
+    for key in keys:
+        services[key] = _MockGenerativeService(caches)
+        clients._GEMINI_CLIENTS[key] = services[key]
+        clients._GEMINI_CACHE_CLIENTS[key] = caches
+    # Every state file the run touches goes to a temp directory, as llm.mock_server.use_mock does
+    state_dir = tempfile.mkdtemp(prefix="prompt_cache_check_")
+    aimd.TRACE_FILE = f"{state_dir}/aimd_trace.jsonl"
+    explain_url.key_pool = KeyPool(keys, rpm=10_000, tpm=100_000_000,
+                                   health=KeyHealth(f"{state_dir}/key_health.json"), name="gemini")
+    explain_url.prefix_cache = PrefixCache(explain_url.GEMINI_MODEL, min_tokens=0)
+    explain_url.verdict_cache = VerdictCache(path=f"{state_dir}/verdicts.json")
+    explain_url.usage_log.path = f"{state_dir}/usage.jsonl"
+
+    for row in rows:
+        explain_url.explain(row["chunk_text"], row["keyword_tech"], row["company_name"], "")
+
+    requests = [r for service in services.values() for r in service.requests]
+    prefix = explain_url.system_prompt()
+    assert len(caches.created) == len(keys), "one cache per key"
+    assert all(r.cached_content in caches.created for r in requests), "every call uses the cache"
+    assert not any(prefix.strip()[:80] in "".join(p.text for c in r.contents for p in c.parts) for r in requests), \
+        "the cached prefix is not sent again"
+
+    stats = explain_url.prefix_cache.summary()
+    model_min = min_cache_tokens(explain_url.GEMINI_MODEL)
+    before = sum(estimate_tokens(explain_url.build_prompt(r["chunk_text"], r["keyword_tech"], r["company_name"]))
+                 for r in rows)
+    return {
+        "rows": len(rows),
+        "static_prefix_tokens": estimate_tokens(prefix),
+        "model_min_cache_tokens": model_min,
+        # False: the real model never caches this prefix; calls send it as system_instruction
+        "cached_by_real_model": estimate_tokens(prefix) >= model_min,
+        "caches_created": stats["caches_created"],
+        "cached_calls": f"{stats['cached_calls']}/{len(requests)}",
+        "input_tokens_before": before,
+        "input_tokens_sent_after": stats["prompt_tokens"] - stats["cached_tokens"],
+        "billed_input_tokens_after": stats["billed_input_tokens"],
+        "billed_reduction": f"{1 - stats['billed_input_tokens'] / before:.0%}",
+    }
+
+
+if __name__ == "__main__":
+    import sys
+    report = self_check(sys.argv[1] if len(sys.argv) > 1 else FIXTURE_ROWS)
+    for k, v in report.items():
+        print(f"{k:>26}: {v}")
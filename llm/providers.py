@@ -0,0 +1,307 @@
+import contextvars
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import explain_url
+import kimi
+import kimi_2
+from llm.clients import openai_client
+from llm import parsing
+from llm.parsing import once, openai_response_format, read_stream, verdict_with_retry
+from llm.rate_limit import KeyPool, NoHealthyKeys, is_rate_limited
+from llm.usage import openai_usage, usage_context, usage_log
+from llm.verdict_cache import verdict_cache
+
+# One interface over the three LLM back ends (explain_url: Gemini, kimi: Kimi via
+# OpenRouter, kimi_2: Kimi via Moonshot). Every provider gets the same system prefix +
+# task prompt from explain_url and returns the same verdict shape, and router.explain()
+# is a drop-in for explain_url.explain() that:
+#   * fails over to the next provider on errors, rate limits, or when a provider's keys
+#     need more than FAILOVER_WAIT_SECONDS to free up,
+#   * optionally hedges: if the current provider has not answered within its
+#     HEDGE_PERCENTILE latency, the same request also goes to the next provider and the
+#     first good answer wins,
+#   * records a latency histogram per provider (router.summary()).
+# Providers without an API key are skipped, so with only Gemini keys it behaves as before.
+
+# --- Configuration Constants ---
+PROVIDER_ORDER = ["gemini", "kimi_openrouter", "kimi_moonshot"]
+FAILOVER_WAIT_SECONDS = 5.0      # skip a provider whose keys are busy for longer than this
+HEDGE_ENABLED = False
+HEDGE_PERCENTILE = 0.95          # hedge once the call is slower than this share of past calls
+HEDGE_MIN_SAMPLES = 20           # until then, hedge after HEDGE_DEFAULT_SECONDS
+HEDGE_DEFAULT_SECONDS = 20.0
+HISTOGRAM_BUCKETS = [0.5, 1, 2, 4, 8, 16, 32, 64, 128]   # upper bounds in seconds
+HISTOGRAM_SAMPLES = 500          # recent latencies kept for percentiles
+HEDGE_WORKERS = 8
+
+
+class LatencyHistogram:
+    def __init__(self):
+        self.buckets = [0] * (len(HISTOGRAM_BUCKETS) + 1)
+        self.samples = deque(maxlen=HISTOGRAM_SAMPLES)
+        self.errors = 0
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float):
+        with self._lock:
+            self.samples.append(seconds)
+            index = next((i for i, bound in enumerate(HISTOGRAM_BUCKETS) if seconds <= bound), len(HISTOGRAM_BUCKETS))
+            self.buckets[index] += 1
+
+    def record_error(self):
+        with self._lock:
+            self.errors += 1
+
+    def percentile(self, q: float):
+        with self._lock:
+            ordered = sorted(self.samples)
+        return ordered[int(q * (len(ordered) - 1))] if ordered else None
+
+    def hedge_delay(self) -> float:
+        if len(self.samples) < HEDGE_MIN_SAMPLES:
+            return HEDGE_DEFAULT_SECONDS
+        return self.percentile(HEDGE_PERCENTILE)
+
+    def summary(self) -> dict:
+        labels = [f"<={b}s" for b in HISTOGRAM_BUCKETS] + [f">{HISTOGRAM_BUCKETS[-1]}s"]
+        p50, p90, p99 = (self.percentile(q) for q in (0.5, 0.9, 0.99))
+        return {
+            "calls": sum(self.buckets), "errors": self.errors,
+            "p50": round(p50, 2) if p50 is not None else None,
+            "p90": round(p90, 2) if p90 is not None else None,
+            "p99": round(p99, 2) if p99 is not None else None,
+            "buckets": {label: count for label, count in zip(labels, self.buckets) if count},
+        }
+
+
+class Provider(ABC):
+    """An LLM back end: complete(system, task) -> raw model text."""
+    name = ""
+    model = ""
+
+    def __init__(self):
+        self.histogram = LatencyHistogram()
+
+    def available(self) -> bool:
+        return True
+
+    def wait_time(self, tokens: int) -> float:
+        return 0.0
+
+    @abstractmethod
+    def complete(self, system: str, task: str, failover: bool = False, on_verdict=None) -> str:
+        """Raw reply text. With `failover` set another provider is next in the route, so a
+        429 should be raised at once rather than waited out. A streamed reply calls
+        on_verdict(uses_tech) as soon as the verdict arrives."""
+        ...
+
+
+class GeminiProvider(Provider):
+    name = "gemini"
+
+    def __init__(self):
+        super().__init__()
+        self.model = explain_url.GEMINI_MODEL
+
+    def available(self) -> bool:
+        return len(explain_url.key_pool) > 0
+
+    def wait_time(self, tokens: int) -> float:
+        return explain_url.key_pool.wait_time(tokens)
+
+    def complete(self, system: str, task: str, failover: bool = False, on_verdict=None) -> str:
+        # Key rotation, 429 cooldowns and the cached system prefix all live in _generate
+        return explain_url._generate(task, system=system, retry_rate_limits=not failover, on_verdict=on_verdict)
+
+
+class OpenAICompatibleProvider(Provider):
+    """Chat-completions back end (OpenRouter, Moonshot, ...) with its own key pool."""
+
+    def __init__(self, name: str, base_url: str, model: str, keys: list, rpm: float, tpm: float,
+                 max_tokens: int = 400, response_format: str = "json_object", timeout: float = 300):
+        super().__init__()
+        self.name = name
+        self.base_url = base_url
+        self.model = model
+        self.pool = KeyPool(keys, rpm=rpm, tpm=tpm, name=name)
+        self.max_tokens = max_tokens
+        # "json_schema" where the endpoint enforces schemas, "json_object" for plain JSON mode, None for neither
+        self.response_format = response_format
+        self.timeout = timeout
+
+    def available(self) -> bool:
+        return len(self.pool) > 0
+
+    def wait_time(self, tokens: int) -> float:
+        return self.pool.wait_time(tokens)
+
+    def complete(self, system: str, task: str, failover: bool = False, on_verdict=None) -> str:
+        input_tokens = explain_url.estimate_tokens(system + task)
+        queued = time.perf_counter()
+        state = self.pool.acquire(input_tokens + self.max_tokens)
+        started = time.perf_counter()
+        stream = parsing.STREAM_RESPONSES
+        usage, released = {}, []
+
+        def verdict_arrived(uses_tech: bool):
+            # The rest of the stream is only explanation; let the next call have this slot
+            self.pool.release(state, latency=time.perf_counter() - started)
+            released.append(True)
+            if on_verdict:
+                on_verdict(uses_tech)
+        try:
+            # System prefix first, so automatic prefix caching on these APIs can reuse it
+            response = openai_client(self.base_url, state.key).chat.completions.create(
+                model=self.model,
+                messages=[{"role": "system", "content": system}, {"role": "user", "content": task}],
+                max_tokens=min(self.max_tokens, parsing.max_output_tokens() or self.max_tokens),
+                temperature=0.2,
+                timeout=self.timeout,
+                stream=stream,
+                # The last chunk of a stream carries the token usage only when asked for
+                **({"stream_options": {"include_usage": True}} if stream else {}),
+                **({"response_format": openai_response_format(self.response_format)} if self.response_format else {}),
+            )
+            if stream:
+                text = read_stream(self._pieces(response, usage), verdict_arrived)
+                response.close()   # a stream cut short still holds the connection until closed
+            else:
+                text = response.choices[0].message.content or ""
+                usage = openai_usage(response.usage)
+        except Exception as e:
+            usage_log.record(self.name, self.model, state.suffix, latency=time.perf_counter() - started,
+                             wait=started - queued, error=e)
+            if is_rate_limited(e):
+                self.pool.penalize(state, error=e)
+            else:
+                self.pool.release(state, ok=False, error=e)
+            raise
+        if not released:
+            self.pool.release(state, latency=time.perf_counter() - started)
+        usage_log.record(self.name, self.model, state.suffix, usage, latency=time.perf_counter() - started,
+                         wait=started - queued, estimated={"input_tokens": input_tokens,
+                                                           "output_tokens": explain_url.estimate_tokens(text)})
+        return text
+
+    @staticmethod
+    def _pieces(response, usage: dict):
+        for chunk in response:
+            if getattr(chunk, "usage", None):
+                usage.update(openai_usage(chunk.usage))
+            if chunk.choices:
+                yield chunk.choices[0].delta.content or ""
+
+
+def default_providers() -> dict:
+    return {
+        "gemini": GeminiProvider(),
+        "kimi_openrouter": OpenAICompatibleProvider(
+            "kimi_openrouter", kimi.BASE_URL, kimi.KIMI_MODEL, [kimi.OPENROUTER_API_KEY], rpm=20, tpm=200_000),
+        "kimi_moonshot": OpenAICompatibleProvider(
+            "kimi_moonshot", kimi_2.BASE_URL, kimi_2.KIMI_MODEL, [kimi_2.API_KEY],
+            rpm=kimi_2.MAX_RPM, tpm=kimi_2.MAX_TPM, max_tokens=kimi_2.MAX_OUTPUT_TOKENS),
+    }
+
+
+class Router:
+    def __init__(self, providers: dict, order: list = None):
+        self.providers = [providers[name] for name in (order or PROVIDER_ORDER) if name in providers]
+        self.stats = {"failovers": 0, "hedged": 0, "hedge_wins": 0, "skipped_busy": 0}
+        self._executor = ThreadPoolExecutor(max_workers=HEDGE_WORKERS, thread_name_prefix="llm-hedge")
+        self._lock = threading.Lock()
+
+    def _count(self, stat: str):
+        with self._lock:
+            self.stats[stat] += 1
+
+    def _call(self, provider: Provider, system: str, task: str, failover: bool, on_verdict) -> dict:
+        start = time.perf_counter()
+        try:
+            # A reply that cannot be salvaged is asked again once, on the same provider
+            verdict = verdict_with_retry(lambda text: provider.complete(system, text, failover, on_verdict), task)
+        except Exception:
+            provider.histogram.record_error()
+            raise
+        provider.histogram.record(time.perf_counter() - start)
+        return verdict
+
+    def explain(self, chunk_text, keyword_tech: str, company_name: str, page_url: str = "",
+                usage_indicators: list = None, on_verdict=None) -> dict:
+        """Same contract as explain_url.explain(), answered by the first provider that can."""
+        # A hedged call or a re-asked reply may report a verdict again; the first one counts
+        on_verdict = once(on_verdict)
+        system = explain_url.system_prompt(usage_indicators)
+        task = explain_url.task_prompt(chunk_text, keyword_tech, company_name)
+        version = explain_url.template_version(usage_indicators)
+        # With no keys anywhere, still try the first provider so its own error is reported
+        candidates = [p for p in self.providers if p.available()] or self.providers[:1]
+
+        # A verdict from any provider in the route counts, in route order (one hit or miss per row)
+        keys = [verdict_cache.key(company_name, keyword_tech, chunk_text, p.model, version) for p in candidates]
+        if (cached := verdict_cache.get_any(keys)) is not None:
+            print(f"--> Verdict cache hit for keyword '{keyword_tech}'")
+            return cached
+
+        with usage_context(kind="single", page_url=page_url, keyword=keyword_tech, prompt_version=version):
+            return self._route(candidates, system, task, chunk_text, keyword_tech, company_name, version, on_verdict)
+
+    def _submit(self, provider: Provider, system: str, task: str, failover: bool, on_verdict):
+        # Worker threads do not inherit context variables; carry the usage tags over
+        return self._executor.submit(contextvars.copy_context().run, self._call, provider, system, task, failover,
+                                     on_verdict)
+
+    def _route(self, candidates: list, system: str, task: str, chunk_text, keyword_tech: str, company_name: str,
+               version: str, on_verdict=None) -> dict:
+        tokens = explain_url.estimate_tokens(system + task) + explain_url.OUTPUT_TOKENS_ESTIMATE
+        errors, no_keys, i = [], [], 0
+        while i < len(candidates):
+            primary = candidates[i]
+            if i + 1 < len(candidates) and primary.wait_time(tokens) > FAILOVER_WAIT_SECONDS:
+                self._count("skipped_busy")
+                i += 1
+                continue
+
+            # A provider with another one behind it in the route raises a 429 instead of waiting
+            futures = {self._submit(primary, system, task, i + 1 < len(candidates), on_verdict): primary}
+            if HEDGE_ENABLED and i + 1 < len(candidates):
+                done, _ = wait(futures, timeout=primary.histogram.hedge_delay())
+                if not done:
+                    futures[self._submit(candidates[i + 1], system, task, i + 2 < len(candidates),
+                                         on_verdict)] = candidates[i + 1]
+                    self._count("hedged")
+
+            pending = set(futures)
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    provider = futures[future]
+                    try:
+                        verdict = future.result()
+                    except Exception as e:
+                        errors.append(f"{provider.name}: {e}")
+                        no_keys.append(isinstance(e, NoHealthyKeys))
+                        print(f"  [WARNING] {provider.name} failed for keyword '{keyword_tech}': {e}")
+                        continue
+                    if provider is not primary:
+                        self._count("hedge_wins")
+                    verdict_cache.put(verdict_cache.key(company_name, keyword_tech, chunk_text, provider.model,
+                                                        version), verdict)
+                    return dict(verdict, provider=provider.name)
+            # Everything tried in this round failed; fail over past it
+            i += len(futures)
+            if i < len(candidates):
+                self._count("failovers")
+
+        print(f"Error calling every LLM provider for keyword '{keyword_tech}': {errors}")
+        # Only when every provider was out of healthy keys is the row worth retrying later
+        return dict(explain_url.error_verdict("; ".join(errors)), retry_later=bool(no_keys) and all(no_keys))
+
+    def summary(self) -> dict:
+        return dict(self.stats, latency={p.name: p.histogram.summary() for p in self.providers})
+
+
+router = Router(default_providers())
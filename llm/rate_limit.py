@@ -0,0 +1,171 @@
+import asyncio
+import threading
+import time
+from typing import Optional
+
+from llm import aimd
+from llm.aimd import AIMDController, is_timeout
+from llm.key_health import KeyHealth, fingerprint, is_fatal_error, key_health
+
+# Per-key rate limiting for the LLM layer.
+# Every API key gets its own requests-per-minute and tokens-per-minute token buckets.
+# Calls go to whichever key has capacity right now, a 429 puts only that key into an
+# exponential cooldown, and the pool works both for the serial (blocking) path and for
+# the async dispatcher, so concurrency scales with the number of keys.
+# Keys whose circuit breaker is open (llm.key_health) are skipped until they are due
+# for a probe. With aimd.AIMD_ENABLED each key also has an adaptive in-flight limit,
+# raised while calls succeed and cut on 429s, timeouts and rising latency (llm.aimd).
+
+# --- Configuration Constants ---
+COOLDOWN_BASE_SECONDS = 15
+COOLDOWN_MAX_SECONDS = 300
+POLL_SECONDS = 0.25
+
+
+class TokenBucket:
+    """Classic token bucket: `capacity` tokens, refilled continuously over one minute."""
+
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.tokens = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def available(self, now: float) -> float:
+        self._refill(now)
+        return self.tokens
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """Seconds until `amount` tokens are available (amount is capped at capacity)."""
+        missing = min(amount, self.capacity) - self.available(now)
+        return max(0.0, missing / self.rate) if self.rate else float("inf")
+
+    def take(self, amount: float, now: float):
+        self._refill(now)
+        self.tokens -= min(amount, self.capacity)
+
+
+class KeyState:
+    def __init__(self, key: str, rpm: float, tpm: float, pool_name: str = ""):
+        self.key = key
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.cooldown_until = 0.0
+        self.strikes = 0
+        self.in_flight = 0
+        self.concurrency = AIMDController(f"{pool_name} key ...{key[-4:]}", aimd.INITIAL_CONCURRENCY,
+                                          ident=f"{pool_name} key {fingerprint(key)}")
+
+    @property
+    def suffix(self) -> str:
+        return self.key[-4:]
+
+    def wait_time(self, tokens: int, now: float) -> float:
+        busy = POLL_SECONDS if aimd.AIMD_ENABLED and self.in_flight >= self.concurrency.value else 0.0
+        return max(self.cooldown_until - now,
+                   self.requests.wait_time(1, now),
+                   self.tokens.wait_time(tokens, now),
+                   busy)
+
+
+def is_rate_limited(exc: Exception) -> bool:
+    """True for 429-style errors from either SDK (google ResourceExhausted, openai RateLimitError)."""
+    code = getattr(exc, "code", None) or getattr(exc, "status_code", None)
+    try:
+        if int(code) == 429:
+            return True
+    except (TypeError, ValueError):
+        pass
+    return type(exc).__name__ in ("ResourceExhausted", "RateLimitError", "TooManyRequests")
+
+
+class NoHealthyKeys(RuntimeError):
+    """Every key's circuit breaker is open; waiting would take minutes to hours."""
+
+
+class KeyPool:
+    def __init__(self, keys: list, rpm: float, tpm: float, health: KeyHealth = key_health, name: str = "llm"):
+        self.name = name
+        self.states = [KeyState(k, rpm, tpm, name) for k in keys if k]
+        self.health = health
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.states)
+
+    def try_acquire(self, tokens: int) -> tuple[Optional[KeyState], float]:
+        """Reserves capacity on the key with the most headroom; else returns (None, seconds to wait)."""
+        if not self.states:
+            raise RuntimeError("No API keys configured.")
+        with self._lock:
+            now = time.monotonic()
+            waits = {id(s): self._wait_time(s, tokens, now) for s in self.states}
+            ready = [s for s in self.states if waits[id(s)] == 0]
+            if not ready:
+                if all(self.health.tripped(s.key) for s in self.states):
+                    raise NoHealthyKeys(f"All {len(self.states)} API keys are disabled by their circuit breakers; "
+                                        f"the next probe is due in {min(waits.values()):.0f}s.")
+                return None, min(waits.values())
+            state = max(ready, key=lambda s: (s.requests.available(now), -s.in_flight))
+            state.requests.take(1, now)
+            state.tokens.take(tokens, now)
+            state.in_flight += 1
+            self.health.on_acquire(state.key)
+            return state, 0.0
+
+    def _wait_time(self, state: KeyState, tokens: int, now: float) -> float:
+        return max(state.wait_time(tokens, now), self.health.wait_time(state.key))
+
+    def wait_time(self, tokens: int) -> float:
+        """Seconds until some key could take a call of `tokens` tokens (nothing is reserved)."""
+        with self._lock:
+            now = time.monotonic()
+            return min((self._wait_time(s, tokens, now) for s in self.states), default=float("inf"))
+
+    def acquire(self, tokens: int) -> KeyState:
+        """Blocking acquire for the serial path."""
+        while True:
+            state, wait = self.try_acquire(tokens)
+            if state:
+                return state
+            time.sleep(min(max(wait, POLL_SECONDS), COOLDOWN_MAX_SECONDS))
+
+    async def acquire_async(self, tokens: int) -> KeyState:
+        while True:
+            state, wait = self.try_acquire(tokens)
+            if state:
+                return state
+            await asyncio.sleep(min(max(wait, POLL_SECONDS), COOLDOWN_MAX_SECONDS))
+
+    def release(self, state: KeyState, ok: bool = True, error: Exception = None, latency: float = None):
+        with self._lock:
+            state.in_flight -= 1
+            if ok:
+                state.strikes = 0
+        if ok:
+            state.concurrency.on_success(latency)
+            self.health.record_success(state.key)
+        else:
+            if error is not None and is_timeout(error):
+                state.concurrency.on_overload("timeout")
+            self.health.record_failure(state.key, error)
+
+    def penalize(self, state: KeyState, retry_after: Optional[float] = None, error: Exception = None):
+        """429 on this key: cool only this key down, exponentially on repeated strikes."""
+        with self._lock:
+            state.in_flight -= 1
+            state.strikes += 1
+            cooldown = retry_after or min(COOLDOWN_BASE_SECONDS * 2 ** (state.strikes - 1), COOLDOWN_MAX_SECONDS)
+            state.cooldown_until = time.monotonic() + cooldown
+        print(f"  [Rate limit] Key ...{state.suffix} cooling down for {cooldown:.0f}s")
+        state.concurrency.on_overload("429")
+        # Only a daily-quota / auth 429 trips the breaker; per-minute throttling is what
+        # the cooldown above is for, and must not disable the key for minutes
+        if error is not None and is_fatal_error(error):
+            self.health.record_failure(state.key, error)
+        else:
+            self.health.record_throttled(state.key)
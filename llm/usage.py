@@ -0,0 +1,145 @@
+import contextlib
+import contextvars
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+
+# Token and cost accounting for every LLM call.
+# Each call (Gemini or OpenAI-compatible, single row or batch, success or error) is
+# appended as one JSON line to a sidecar log with provider, model, key suffix, input /
+# cached / output tokens, latency, time spent waiting for a key, rate-limit retries and
+# estimated cost. Callers tag calls with the row they are for (usage_context), so the
+# summary can show which rows, PDFs and prompt versions dominate spend and latency.
+
+# --- Configuration Constants ---
+USAGE_LOG_FILE = "llm_state/usage.jsonl"
+TOP_ROWS = 5                     # most expensive rows listed in the summary
+
+# USD per million tokens: (input, cached input, output). Check against the current price
+# lists; models missing here are logged with cost None.
+PRICES_PER_MILLION = {
+    "gemini-2.0-flash-lite-001": (0.075, 0.01875, 0.30),
+    "gemini-2.0-flash": (0.10, 0.025, 0.40),
+    "gemini-1.5-flash": (0.075, 0.01875, 0.30),
+    "moonshotai/kimi-k2": (0.55, 0.15, 2.20),
+    "moonshotai/kimi-k2:free": (0.0, 0.0, 0.0),
+    "kimi-k2-0711-preview": (0.60, 0.15, 2.50),
+}
+
+_context = contextvars.ContextVar("llm_usage_context", default={})
+
+
+@contextlib.contextmanager
+def usage_context(**fields):
+    """Tags every call made inside the block (page_url, keyword, prompt_version, kind, rows, ...)."""
+    token = _context.set(dict(_context.get(), **fields))
+    try:
+        yield
+    finally:
+        _context.reset(token)
+
+
+def estimate_cost(model: str, input_tokens, cached_tokens, output_tokens):
+    prices = PRICES_PER_MILLION.get(model)
+    if prices is None or input_tokens is None:
+        return None
+    uncached = input_tokens - (cached_tokens or 0)
+    return round((uncached * prices[0] + (cached_tokens or 0) * prices[1] + (output_tokens or 0) * prices[2]) / 1e6, 8)
+
+
+def gemini_usage(response) -> dict:
+    """Token counts from a google-generativeai response (also after a stream was read)."""
+    try:
+        usage = response.usage_metadata
+    except Exception:   # a stream abandoned early may not carry usage yet
+        usage = None
+    if usage is None or not usage.prompt_token_count:
+        return {}
+    return {"input_tokens": usage.prompt_token_count, "cached_tokens": usage.cached_content_token_count or 0,
+            "output_tokens": usage.candidates_token_count or 0}
+
+
+def openai_usage(usage) -> dict:
+    """Token counts from an OpenAI-style `usage` object."""
+    if usage is None:
+        return {}
+    details = getattr(usage, "prompt_tokens_details", None)
+    return {"input_tokens": usage.prompt_tokens, "cached_tokens": getattr(details, "cached_tokens", 0) or 0,
+            "output_tokens": usage.completion_tokens}
+
+
+class UsageLog:
+    def __init__(self, path: str = USAGE_LOG_FILE):
+        self.path = path
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def record(self, provider: str, model: str, key_suffix: str = "", tokens: dict = None, latency: float = 0.0,
+               wait: float = 0.0, retries: int = 0, error: Exception = None, estimated: dict = None):
+        """
+        One finished call. `tokens` are the counts reported by the API; when it reported
+        none (errors, abandoned streams), `estimated` counts are used and flagged.
+        """
+        counts = tokens or estimated or {}
+        entry = dict(
+            _context.get(),
+            time=round(time.time(), 3), provider=provider, model=model, key=key_suffix,
+            input_tokens=counts.get("input_tokens"), cached_tokens=counts.get("cached_tokens", 0),
+            output_tokens=counts.get("output_tokens"), estimated=not tokens and bool(estimated),
+            latency_s=round(latency, 3), wait_s=round(wait, 3), retries=retries,
+            error=str(error)[:200] if error else None,
+        )
+        entry["cost_usd"] = estimate_cost(model, entry["input_tokens"], entry["cached_tokens"], entry["output_tokens"])
+        with self._lock:
+            self.calls.append(entry)
+            try:
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            except IOError as e:
+                print(f"  [WARNING] Could not write usage log {self.path}. {e}")
+
+    def summary(self, rows_processed: int = 0) -> dict:
+        """Totals for this run, cost per 1,000 processed rows, and where the spend and latency went."""
+        with self._lock:
+            calls = list(self.calls)
+        total_cost = sum(c["cost_usd"] or 0 for c in calls)
+
+        def group(key) -> dict:
+            groups = defaultdict(lambda: {"calls": 0, "input_tokens": 0, "output_tokens": 0,
+                                          "cost_usd": 0.0, "latency_s": 0.0})
+            for c in calls:
+                g = groups[key(c)]
+                g["calls"] += 1
+                g["input_tokens"] += c["input_tokens"] or 0
+                g["output_tokens"] += c["output_tokens"] or 0
+                g["cost_usd"] = round(g["cost_usd"] + (c["cost_usd"] or 0), 6)
+                g["latency_s"] = round(g["latency_s"] + c["latency_s"], 2)
+            return dict(groups)
+
+        by_row = group(lambda c: c.get("page_url") or "(batch)")
+        top_rows = sorted(by_row.items(), key=lambda item: (item[1]["cost_usd"], item[1]["latency_s"]), reverse=True)
+        return {
+            "calls": len(calls),
+            "errors": sum(1 for c in calls if c["error"]),
+            # Every attempt is its own record, so a retry is any record past attempt 0
+            "retries": sum(1 for c in calls if c["retries"]),
+            "input_tokens": sum(c["input_tokens"] or 0 for c in calls),
+            "cached_tokens": sum(c["cached_tokens"] or 0 for c in calls),
+            "output_tokens": sum(c["output_tokens"] or 0 for c in calls),
+            "estimated_calls": sum(1 for c in calls if c["estimated"]),
+            "latency_s": round(sum(c["latency_s"] for c in calls), 2),
+            "wait_s": round(sum(c["wait_s"] for c in calls), 2),
+            "cost_usd": round(total_cost, 6),
+            "cost_per_1000_rows": round(total_cost / rows_processed * 1000, 4) if rows_processed else None,
+            "by_model": group(lambda c: f"{c['provider']}:{c['model']}"),
+            "by_prompt_version": group(lambda c: c.get("prompt_version") or "unknown"),
+            "by_source": group(lambda c: "batch" if c.get("kind") == "batch" else
+                               "pdf" if str(c.get("page_url") or "").lower().endswith(".pdf") else "html"),
+            "top_rows": top_rows[:TOP_ROWS],
+        }
+
+
+usage_log = UsageLog()
@@ -0,0 +1,125 @@
+import atexit
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+# Content-addressed cache of LLM verdicts, persisted across runs.
+# The key is a hash of the normalized (company, keyword, contexts) plus the model name and
+# the prompt version, so overlapping sheets and re-runs never pay for the same verdict twice,
+# and any edit to the prompt text produces new keys (old entries simply age out).
+
+# --- Configuration Constants ---
+CACHE_FILE = "llm_state/verdict_cache.json"
+CACHE_TTL_SECONDS = 30 * 24 * 3600   # verdicts older than this are re-asked
+CACHE_MAX_ENTRIES = 50_000           # least recently used entries are evicted beyond this
+CACHE_SAVE_EVERY = 20                # puts between writes to disk (and once more at exit)
+
+
+def _normalize(value, lower: bool = True) -> str:
+    if not isinstance(value, str):
+        value = json.dumps(value, ensure_ascii=False, sort_keys=True)
+    value = re.sub(r"\s+", " ", value).strip()
+    return value.lower() if lower else value
+
+
+def prompt_version(template: str) -> str:
+    """Short fingerprint of a prompt template; changes whenever the prompt text changes."""
+    return hashlib.sha256(template.encode("utf-8")).hexdigest()[:12]
+
+
+class VerdictCache:
+    def __init__(self, path: str = CACHE_FILE, ttl: float = CACHE_TTL_SECONDS, max_entries: int = CACHE_MAX_ENTRIES):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.stats = {"hits": 0, "misses": 0, "expired": 0, "evicted": 0}
+        self._entries = None   # key -> {"verdict", "created"}; loaded on first use, LRU order
+        self._unsaved = 0
+        self._lock = threading.RLock()
+
+    @staticmethod
+    def key(company_name: str, keyword_tech: str, contexts, model: str, version: str) -> str:
+        # Case is collapsed for the company and keyword only: the model reads case in the
+        # text ("Glue" vs "glue", "AWS" vs "aws"), so contexts differing in it are asked apart
+        payload = "\x1f".join([_normalize(company_name), _normalize(keyword_tech), _normalize(contexts, lower=False),
+                               model, version])
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _load(self):
+        if self._entries is not None:
+            return
+        self._entries = OrderedDict()
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                if isinstance(data, dict):
+                    self._entries.update(data)
+            except (json.JSONDecodeError, IOError) as e:
+                print(f"  [WARNING] Verdict cache {self.path} is unreadable, starting empty. {e}")
+
+    def _lookup(self, key: str) -> Optional[dict]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if time.time() - entry.get("created", 0) > self.ttl:
+            del self._entries[key]
+            self.stats["expired"] += 1
+            return None
+        self._entries.move_to_end(key)
+        return dict(entry["verdict"])
+
+    def get(self, key: str) -> Optional[dict]:
+        return self.get_any([key])
+
+    def get_any(self, keys: list) -> Optional[dict]:
+        """Verdict of the first key that has one; counts one hit or one miss however many keys are tried."""
+        with self._lock:
+            self._load()
+            for key in keys:
+                if (verdict := self._lookup(key)) is not None:
+                    self.stats["hits"] += 1
+                    return verdict
+            self.stats["misses"] += 1
+            return None
+
+    def put(self, key: str, verdict: dict):
+        with self._lock:
+            self._load()
+            self._entries[key] = {"verdict": dict(verdict), "created": time.time()}
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.stats["evicted"] += 1
+            self._unsaved += 1
+            if self._unsaved >= CACHE_SAVE_EVERY:
+                self.save()
+
+    def save(self):
+        with self._lock:
+            if self._entries is None or not self._unsaved:
+                return
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            tmp_path = f"{self.path}.tmp"
+            try:
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump(self._entries, f, ensure_ascii=False)
+                os.replace(tmp_path, self.path)  # never leave a half-written cache behind
+                self._unsaved = 0
+            except IOError as e:
+                print(f"  [WARNING] Could not save verdict cache {self.path}. {e}")
+
+    def summary(self) -> dict:
+        with self._lock:
+            total = self.stats["hits"] + self.stats["misses"]
+            return dict(self.stats, size=len(self._entries or {}),
+                        hit_rate=round(self.stats["hits"] / total, 3) if total else 0.0)
+
+
+verdict_cache = VerdictCache()
+atexit.register(verdict_cache.save)
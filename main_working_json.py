@@ -1,11 +1,25 @@
 from extract.normal_3 import *
-from extract.pdf_3_adv import *
 # from extract.pdf_3 import *
 # from urllib.parse import urlparse
 # from explain import *
 from explain_url import *
 from extract.date_me_3 import *
+# date_me_3 star-imports extract.pdf_3, so pdf_3_adv must come after it to win
+from extract.pdf_3_adv import *
+from extract.structured_data import page_metadata
+from llm.aimd import AIMD_ENABLED, controller_state
+from llm.key_health import key_health
+from llm.parsing import parse_stats, stream_stats
+from llm.providers import router
+from llm.usage import usage_log
 from info import *
+from rules import classify, rule_stats
+from dedup import dedup_index, reuse
+from cascade import cascade, cascade_stats
+from company import company_tracker, order_rows
+from triage import TRIAGE_ENABLED, triage, triage_stats
+from prefetch import PREFETCH_ROWS, discard, lookahead, prefetch_stats, wait_for
+from batch_job import ingest_batch_results, load_pending, request_key, save_pending, write_batch_requests
 import pandas as pd
 from datetime import datetime
 import csv
@@ -26,8 +40,36 @@ CHECKPOINT_FILE = f"checkpoint/{csv_name}_checkpoint.csv"
 INPUT_CSV_PATH = f"input/{load}.csv"
 JSON_CHECKPOINT_FILE = f"checkpoint_json/{csv_name}_checkpoint_json.json"
 
+# Rows per batched explain request (1 = one request per row, the old behaviour)
+EXPLAIN_BATCH_SIZE = 1
+# Send the queued rows as concurrent single-row requests across all API keys
+# (explain_many) instead of one packed prompt; the queue size is EXPLAIN_BATCH_SIZE
+CONCURRENT_EXPLAIN = False
+# Judge all pending keyword rows of one URL in a single request (explain_keywords), with
+# one verdict and explanation per keyword. Rows are grouped while they are consecutive,
+# so the input is stably sorted by URL first.
+MULTI_KEYWORD_EXPLAIN = False
+# Single-row explain as a cascade: the best-ranked context first, widening only while the
+# answer is unclear (see cascade.py). Applies to rows routed one at a time.
+CASCADE_EXPLAIN = False
+# Answer "does this company use this keyword" instead of judging every URL: rows are
+# grouped by (domain, keyword), the most promising URLs go first, and once one is "Yes"
+# the group's other URLs are skipped (see company.py). Takes precedence over the URL
+# order of MULTI_KEYWORD_EXPLAIN. A per-company summary is saved next to the results.
+COMPANY_SHORT_CIRCUIT = False
+
+# "online"        : fetch, extract and explain row by row (default)
+# "batch_prepare" : fetch + extract only; write pending prompts as batch-request JSONL (see batch_job.py)
+# "batch_ingest"  : read the batch-results JSONL and join the verdicts into checkpoint and results
+RUN_MODE = "online"
+BATCH_REQUESTS_FILE = f"batch/{csv_name}_requests.jsonl"
+BATCH_RESULTS_FILE = f"batch/{csv_name}_results.jsonl"
+BATCH_PENDING_FILE = f"batch/{csv_name}_pending.json"
+# One JSON line per LLM call: tokens, cost, latency, key, retries (see llm/usage.py)
+USAGE_LOG_FILE = f"usage/{csv_name}_usage.jsonl"
+
 # File Header -------------------------------------
-HEADERS = ["Company Name", "Domain", "Page URL", "Keyword", "Date", "Usage Indicated", "Explanation", "Processing Time (s)"]
+HEADERS = ["Company Name", "Domain", "Page URL", "Keyword", "Date", "Date Method", "Page Type", "Usage Indicated", "Explanation", "Processing Time (s)"]
 # -------------------------------------------------
 
 
@@ -41,8 +83,14 @@ def save_checkpoint(result: dict):
     # --- 1. Save to CSV Checkpoint (Primary) ---
     csv_file_exists = os.path.exists(CHECKPOINT_FILE)
     try:
+        # Keep appending in the column layout the checkpoint was started with,
+        # so a resumed run never misaligns rows under an older header.
+        fieldnames = HEADERS
+        if csv_file_exists:
+            with open(CHECKPOINT_FILE, "r", newline='', encoding='utf-8') as f:
+                fieldnames = next(csv.reader(f), None) or HEADERS
         with open(CHECKPOINT_FILE, "a", newline='', encoding='utf-8') as f:
-            writer = csv.DictWriter(f, fieldnames=HEADERS)
+            writer = csv.DictWriter(f, fieldnames=fieldnames, extrasaction='ignore')
             if not csv_file_exists:
                 writer.writeheader()
             writer.writerow(result)
@@ -85,6 +133,9 @@ def load_processed_items():
             if "Page URL" in df_checkpoint.columns and "Keyword" in df_checkpoint.columns:
                 # Drop rows with missing values to prevent errors
                 df_checkpoint.dropna(subset=["Page URL", "Keyword"], inplace=True)
+                # Company-mode skips (older checkpoints have them) were never judged
+                if "Usage Indicated" in df_checkpoint.columns:
+                    df_checkpoint = df_checkpoint[df_checkpoint["Usage Indicated"] != "Skipped"]
                 processed_set = set(zip(df_checkpoint["Page URL"], df_checkpoint["Keyword"]))
                 if processed_set:
                     print(f"Loaded {len(processed_set)} items from CSV checkpoint.")
@@ -104,6 +155,7 @@ def load_processed_items():
                         (item['Page URL'], item['Keyword'])
                         for item in json_data
                         if isinstance(item, dict) and 'Page URL' in item and 'Keyword' in item
+                        and item.get('Usage Indicated') != "Skipped"
                     }
                     if processed_set:
                         print(f"Loaded {len(processed_set)} items from JSON checkpoint backup.")
@@ -115,35 +167,88 @@ def load_processed_items():
     return set()
 
 
+def load_checkpoint_rows() -> list:
+    """Every row of the CSV checkpoint as a dict ([] when there is none yet)."""
+    if not os.path.exists(CHECKPOINT_FILE):
+        return []
+    try:
+        return pd.read_csv(CHECKPOINT_FILE, dtype=str, keep_default_na=False).to_dict("records")
+    except Exception as e:
+        print(f"Warning: Could not read rows from the CSV checkpoint ({e}).")
+        return []
+
 # -------------------------
 
-# --- Main Execution ---
+# --- Row Processing ---
 
-def main():
-    """Main function to run the processing script."""
-    already_processed = load_processed_items()
-    if already_processed:
-        print(f"Found {len(already_processed)} items in the checkpoint file to skip.")
+def extract_row(current_url, keyword, domain_from_csv, company_name_from_csv):
+    """
+    Fetch & extract stage for one row. Returns (result, contexts). When the row still
+    needs an LLM verdict, result["Usage Indicated"] is None.
+    """
+    # Company Name - Updated part
+    comp_name = info(current_url, company_name_from_csv=company_name_from_csv)
+    # comp_name = info(current_url)
+    print(f"Processing URL: {current_url}, Keyword: {keyword}, Company: {comp_name}")
 
     try:
-        df_input = pd.read_csv(INPUT_CSV_PATH)
-        # --- CHANGE 1: Added 'domain' to the required columns check ---
-        # required_columns = ['company_name', 'company_url', 'keyword', 'domain_name']
-        required_columns = ['domain', 'company_url', 'keyword']
-        if not all(col in df_input.columns for col in required_columns):
-            print(f"Error: Input CSV '{INPUT_CSV_PATH}' must contain columns: {required_columns}")
-            return
-    except FileNotFoundError:
-        print(f"Error: Input CSV file not found at '{INPUT_CSV_PATH}'")
-        return
-    except Exception as e:
-        print(f"An unexpected error occurred while reading the input CSV: {e}")
-        return
-
-    all_new_results = []
-
-    # Place where we take csv as input (Change the column name if needed)
+        if current_url.lower().endswith(".pdf"):
+            contexts, date, date_method = pdf(current_url, keyword)
+            page_type = "pdf"
+            print("-> Using PDF function")
+        else:
+            # One download and one parse, shared by the keyword and date steps
+            page = load_page(current_url)
+            # One structured-data pass, read by the company name, page type and date steps
+            metadata = page_metadata(page)
+            comp_name = info(current_url, company_name_from_csv=company_name_from_csv, metadata=metadata)
+            page_type = metadata.get("page_type") or "other"
+            contexts = normal_from_page(page, keyword)
+            date, date_method = date_from_page(page)
+            print("-> Using HTML function")
+
+        # --- CHANGE 3: Use the domain from the CSV directly. The info() function is no longer needed. ---
+        # home_url = domain_from_csv
+
+        result = {
+            "Company Name": comp_name,
+            "Domain": domain_from_csv,
+            "Page URL": current_url,
+            "Keyword": keyword,
+            "Date": date or "Not found",
+            "Date Method": date_method,
+            "Page Type": page_type,
+            "Usage Indicated": None,
+            "Explanation": None
+        }
+        if not contexts:
+            result["Usage Indicated"] = "No"
+            result["Explanation"] = "No relevant keywords found on the page."
+        elif verdict := classify(contexts, keyword, comp_name, page_type) or triage(contexts, keyword, comp_name):
+            # Obvious rows (acronym mismatch, training only, ...) and rows the local
+            # triage model is confident about never reach the LLM
+            apply_verdict(result, verdict)
+        return result, contexts
 
+    except Exception as e:
+        print(f"  [ERROR] Failed to process {current_url}: {e}")
+        print("  -> Logging error and continuing to next URL.")
+
+        return {
+            "Company Name": comp_name,
+            "Domain": domain_from_csv,
+            "Page URL": current_url,
+            "Keyword": keyword,
+            "Date": "Not found",
+            "Date Method": "error",
+            "Page Type": "",
+            "Usage Indicated": "Error",
+            "Explanation": f"Failed to process URL. Error: {str(e)}"
+        }, []
+
+
+def input_rows(df_input, already_processed: set, already_pending: set):
+    """(url, keyword, domain, company name) of every input row that still needs processing, in order."""
     for index, row in df_input.iterrows():
         # --- CHANGE 2: Read all required columns from the row, including the new domain ---
         # comp_name = row['company_name']
@@ -156,73 +261,142 @@ def main():
         # ----------------------------------------------------------------------
         if (current_url, keyword) in already_processed:
             continue
-        # ----------------------------------------------------------------------
-        # Company Name - Updated part
-        company_name_from_csv = row.get('company_name')
-        comp_name = info(current_url, company_name_from_csv=company_name_from_csv)
-        # comp_name = info(current_url)
+        if request_key(current_url, keyword) in already_pending:
+            continue
+        yield current_url, keyword, domain_from_csv, row.get('company_name')
 
-        start_time = time.time()
-        print(f"Processing URL: {current_url}, Keyword: {keyword}, Company: {comp_name}")
 
-        try:
-            if current_url.lower().endswith(".pdf"):
-                contexts, date = pdf(current_url, keyword)
-                print("-> Using PDF function")
-            else:
-                contexts = normal(current_url, keyword)
-                date = date_me(current_url)
-                print("-> Using HTML function")
-
-            # --- CHANGE 3: Use the domain from the CSV directly. The info() function is no longer needed. ---
-            # home_url = domain_from_csv
-
-            if not contexts:
-                usage_indicated = "No"
-                explanation = "No relevant keywords found on the page."
-            else:
-                gemini_analysis = explain(
-                    chunk_text=contexts,
-                    keyword_tech=keyword,
-                    company_name=comp_name,
-                    page_url=current_url  # Page url to LLM
-                )
-                usage_indicated = "Yes" if gemini_analysis.get("uses_tech") else "No"
-                explanation = gemini_analysis.get("explanation", "No explanation provided.")
-
-            result = {
-                "Company Name": comp_name,
-                "Domain": domain_from_csv,
-                "Page URL": current_url,
-                "Keyword": keyword,
-                "Date": date or "Not found",
-                "Usage Indicated": usage_indicated,
-                "Explanation": explanation
-            }
+def prefetch_row(row: tuple) -> tuple:
+    """
+    Fetch & extract stage for one input row, run ahead of the LLM stage (see prefetch.py).
+    Returns (extract seconds, result, contexts).
+    """
+    started = time.time()
+    result, contexts = extract_row(*row)
+    return time.time() - started, result, contexts
 
-        except Exception as e:
-            print(f"  [ERROR] Failed to process {current_url}: {e}")
-            print("  -> Logging error and continuing to next URL.")
 
-            result = {
-                "Company Name": comp_name,
-                "Domain": domain_from_csv,
-                "Page URL": current_url,
-                "Keyword": keyword,
-                "Date": "Not found",
-                "Usage Indicated": "Error",
-                "Explanation": f"Failed to process URL. Error: {str(e)}"
-            }
+def apply_verdict(result: dict, verdict: dict):
+    """Copies an explain() verdict into the output row."""
+    result["Usage Indicated"] = "Yes" if verdict.get("uses_tech") else "No"
+    result["Explanation"] = verdict.get("explanation", "No explanation provided.")
+
+
+def record_verdict(result: dict, start_time: float, uses_tech: bool):
+    """
+    Records a streamed verdict on the row as soon as "uses_tech" arrives; the row is
+    checkpointed by record_result once its explanation has finished streaming.
+    """
+    result["Usage Indicated"] = "Yes" if uses_tech else "No"
+    print(f"  -> Verdict '{result['Usage Indicated']}' for '{result['Keyword']}' after "
+          f"{time.time() - start_time:.2f} seconds; explanation still streaming.")
+
 
-        duration = time.time() - start_time
-        result["Processing Time (s)"] = round(duration, 2)
+def record_result(result: dict, start_time: float, all_new_results: list, checkpoint: bool = True):
+    """
+    Stamps the processing time and writes the row to the checkpoints. With checkpoint=False
+    (every key disabled by its circuit breaker) the row only goes to this run's results,
+    so the next run processes it again.
+    """
+    duration = time.time() - start_time
+    result["Processing Time (s)"] = round(duration, 2)
 
-        print(f"  -> Completed in {duration:.2f} seconds.")
+    print(f"  -> Completed in {duration:.2f} seconds.")
 
+    if checkpoint:
         save_checkpoint(result)
-        all_new_results.append(result)
+    else:
+        print("  -> No healthy API key; not checkpointed, the next run retries this row.")
+    all_new_results.append(result)
+    company_tracker.record(result)
 
 
+def flush_batch(pending_llm: list, all_new_results: list):
+    """Sends every pending row through one batched (or concurrent) explain and records the results."""
+    if not pending_llm:
+        return
+    # Near-duplicate rows within the batch are asked once and share the answer
+    leaders = dedup_index.cluster([(contexts, result["Keyword"], result["Company Name"])
+                                   for result, contexts, _ in pending_llm])
+    items = [
+        {
+            "id": str(i),
+            "chunk_text": contexts,
+            "keyword_tech": result["Keyword"],
+            "company_name": result["Company Name"],
+            "page_url": result["Page URL"],
+        }
+        for i, (result, contexts, _) in enumerate(pending_llm) if leaders[i][0] is None
+    ]
+    if CONCURRENT_EXPLAIN:
+        answered = explain_many(items, on_verdict=lambda i, uses_tech: record_verdict(
+            pending_llm[int(i)][0], pending_llm[int(i)][2], uses_tech))
+    else:
+        answered = explain_batch(items)
+    verdicts = dict(zip((int(item["id"]) for item in items), answered))
+    for i, (result, contexts, start_time) in enumerate(pending_llm):
+        leader, score = leaders[i]
+        if leader is None:
+            verdict = verdicts[i]
+            dedup_index.add(contexts, result["Keyword"], result["Company Name"], verdict, result["Page URL"])
+        else:
+            verdict = reuse(verdicts[leader], pending_llm[leader][0]["Page URL"], score)
+        apply_verdict(result, verdict)
+        record_result(result, start_time, all_new_results, checkpoint=not verdict.get("retry_later"))
+    pending_llm.clear()
+
+
+def explain_row(result: dict, contexts: list, start_time: float, pending_llm: list, all_new_results: list):
+    """LLM stage for one row: queued for a batched explain, or routed right away."""
+    if EXPLAIN_BATCH_SIZE > 1:
+        pending_llm.append((result, contexts, start_time))
+        if len(pending_llm) >= EXPLAIN_BATCH_SIZE:
+            flush_batch(pending_llm, all_new_results)
+        return
+    if CASCADE_EXPLAIN:
+        gemini_analysis = cascade(contexts, result["Keyword"], result["Company Name"], result["Page URL"],
+                                  router.explain, result["Page Type"])
+    else:
+        # Gemini first, failing over (or hedging) to the Kimi providers that have keys
+        gemini_analysis = router.explain(
+            chunk_text=contexts,
+            keyword_tech=result["Keyword"],
+            company_name=result["Company Name"],
+            page_url=result["Page URL"],  # Page url to LLM
+            on_verdict=lambda uses_tech: record_verdict(result, start_time, uses_tech)
+        )
+    apply_verdict(result, gemini_analysis)
+    dedup_index.add(contexts, result["Keyword"], result["Company Name"], gemini_analysis, result["Page URL"])
+    record_result(result, start_time, all_new_results, checkpoint=not gemini_analysis.get("retry_later"))
+
+
+def flush_url(pending_url: list, pending_llm: list, all_new_results: list):
+    """
+    Rows of one URL, recorded in input order: one multi-keyword explain for the keywords
+    still waiting for a verdict when there are several, rows already decided (rules,
+    near-duplicate reuse) recorded as they are.
+    """
+    undecided = [(result, contexts) for result, contexts, _ in pending_url if result["Usage Indicated"] is None]
+    verdicts = {}
+    if len(undecided) > 1:
+        first = undecided[0][0]
+        verdicts = explain_keywords({result["Keyword"]: contexts for result, contexts in undecided},
+                                    first["Company Name"], first["Page URL"])
+    for result, contexts, start_time in pending_url:
+        if result["Usage Indicated"] is not None:
+            record_result(result, start_time, all_new_results)
+        elif not verdicts:
+            explain_row(result, contexts, start_time, pending_llm, all_new_results)
+        else:
+            verdict = verdicts[result["Keyword"]]
+            apply_verdict(result, verdict)
+            dedup_index.add(contexts, result["Keyword"], result["Company Name"], verdict, result["Page URL"])
+            record_result(result, start_time, all_new_results, checkpoint=not verdict.get("retry_later"))
+    pending_url.clear()
+
+
+def save_results(all_new_results: list):
+    """Writes this run's new rows to the dated results CSV and JSON files."""
     if all_new_results:
         print(f"\n\n--- Processing Complete ---")
         # Create a base filename to use for both file types
@@ -253,5 +427,211 @@ def main():
         print("\n\n--- Processing Complete ---")
         print("No new URLs were processed. All items in the input file were already in the checkpoint.")
 
+
+def save_company_summary():
+    """Writes one row per (domain, keyword) group: verdict, evidence URL, processed and skipped URLs."""
+    summary = company_tracker.summary()
+    print(f"  [Company] {summary['confirmed']} of {summary['groups']} company/keyword groups confirmed; "
+          f"{summary['processed']} URLs processed, {summary['skipped']} skipped")
+    try:
+        os.makedirs("results_csv", exist_ok=True)
+        path = os.path.join("results_csv", f"{csv_name}_companies_{datetime.now().strftime('%d-%m')}.csv")
+        pd.DataFrame(company_tracker.summary_rows()).to_csv(path, index=False)
+        print(f"Saved the per-company summary to '{path}'")
+    except Exception as e:
+        print(f"  [ERROR] Failed to save the per-company summary: {e}")
+
+
+def ingest_batch():
+    """Phase two of the offline batch mode: joins batch verdicts into checkpoint and results."""
+    if not os.path.exists(BATCH_RESULTS_FILE):
+        print(f"Error: Batch results file not found at '{BATCH_RESULTS_FILE}'")
+        return
+    all_new_results = []
+    completed, still_pending = ingest_batch_results(BATCH_RESULTS_FILE, BATCH_PENDING_FILE)
+    for result in completed:
+        save_checkpoint(result)
+        all_new_results.append(result)
+    # Only now that the rows are checkpointed do they leave the pending sidecar
+    save_pending(BATCH_PENDING_FILE, still_pending)
+    print(f"Ingested {len(all_new_results)} batch verdicts; {len(still_pending)} rows still pending.")
+    save_results(all_new_results)
+
+
+# --- Main Execution ---
+
+def main():
+    """Main function to run the processing script."""
+    if RUN_MODE == "batch_ingest":
+        ingest_batch()
+        return
+
+    usage_log.path = USAGE_LOG_FILE
+    already_processed = load_processed_items()
+    if already_processed:
+        print(f"Found {len(already_processed)} items in the checkpoint file to skip.")
+
+    try:
+        df_input = pd.read_csv(INPUT_CSV_PATH)
+        # --- CHANGE 1: Added 'domain' to the required columns check ---
+        # required_columns = ['company_name', 'company_url', 'keyword', 'domain_name']
+        required_columns = ['domain', 'company_url', 'keyword']
+        if not all(col in df_input.columns for col in required_columns):
+            print(f"Error: Input CSV '{INPUT_CSV_PATH}' must contain columns: {required_columns}")
+            return
+    except FileNotFoundError:
+        print(f"Error: Input CSV file not found at '{INPUT_CSV_PATH}'")
+        return
+    except Exception as e:
+        print(f"An unexpected error occurred while reading the input CSV: {e}")
+        return
+    if COMPANY_SHORT_CIRCUIT:
+        # Each (domain, keyword) group's most promising URLs first; earlier runs count too
+        df_input = order_rows(df_input)
+        for domain, keyword in zip(df_input['domain'], df_input['keyword']):
+            company_tracker.expect(domain, keyword)
+        for row in load_checkpoint_rows():
+            company_tracker.record(row)
+    elif MULTI_KEYWORD_EXPLAIN:
+        # Keyword rows of one URL become neighbours, so they can share one request
+        df_input = df_input.sort_values('company_url', kind='stable')
+
+    # Resolve every URL date in one vectorized pass before any fetching
+    input_urls = df_input['company_url'].astype(str)
+    input_urls = input_urls.where(input_urls.str.startswith(("http://", "https://")), "https://" + input_urls)
+    print(f"Pre-resolved dates for {precompute_url_dates(input_urls)} URLs.")
+
+    all_new_results = []
+    pending_llm = []  # (result, contexts, start_time) rows waiting for a batched explain
+    pending_url = []  # the same, for the current URL's keywords (MULTI_KEYWORD_EXPLAIN)
+    batch_rows = []   # (result, contexts, extract_seconds) rows for the offline batch job
+    already_pending = set(load_pending(BATCH_PENDING_FILE)) if RUN_MODE == "batch_prepare" else set()
+
+    # Place where we take csv as input (Change the column name if needed)
+    rows = input_rows(df_input, already_processed, already_pending)
+
+    def confirmed(row: tuple) -> bool:
+        return COMPANY_SHORT_CIRCUIT and company_tracker.confirmed(row[2], row[1]) is not None
+
+    # The next PREFETCH_ROWS rows are fetched and extracted while this one is explained;
+    # everything below still runs one row at a time, in input order
+    for (current_url, keyword, domain_from_csv, company_name), extracted in lookahead(
+            rows, prefetch_row, PREFETCH_ROWS, skip=confirmed):
+        if pending_url and pending_url[0][0]["Page URL"] != current_url:
+            flush_url(pending_url, pending_llm, all_new_results)
+        if confirmed((current_url, keyword, domain_from_csv, company_name)):
+            discard(extracted)   # confirmed while this row was being prefetched
+            print(f"Skipping URL: {current_url}, Keyword: {keyword} (already confirmed for {domain_from_csv})")
+            skipped = company_tracker.skip(domain_from_csv, keyword, current_url, company_name)
+            # Results and company summary only: a checkpointed skip would count as processed,
+            # and a later run without COMPANY_SHORT_CIRCUIT could never judge this URL
+            all_new_results.append(skipped)
+            company_tracker.record(skipped)
+            continue
+
+        extract_seconds, result, contexts = wait_for(extracted)
+        # Processing time is this row's own extraction plus its own LLM stage, not the
+        # earlier rows' LLM time that the prefetch overlapped with
+        start_time = time.time() - extract_seconds
+
+        if result["Usage Indicated"] is None:
+            if RUN_MODE == "batch_prepare":
+                batch_rows.append((result, contexts, time.time() - start_time))
+                continue
+            if reused := dedup_index.lookup(contexts, keyword, result["Company Name"]):
+                # Same boilerplate as a row of this company already judged in this run
+                print(f"--> Reusing the verdict of near-duplicate page {reused['reused_from']}")
+                apply_verdict(result, reused)
+            elif not MULTI_KEYWORD_EXPLAIN:
+                explain_row(result, contexts, start_time, pending_llm, all_new_results)
+                continue
+        if MULTI_KEYWORD_EXPLAIN:
+            # Decided rows wait with the URL's other keywords, so checkpoints stay in input order
+            pending_url.append((result, contexts, start_time))
+            continue
+
+        record_result(result, start_time, all_new_results)
+
+    flush_url(pending_url, pending_llm, all_new_results)
+    flush_batch(pending_llm, all_new_results)
+
+    if RUN_MODE == "batch_prepare":
+        total = write_batch_requests(batch_rows, BATCH_REQUESTS_FILE, BATCH_PENDING_FILE)
+        print(f"Queued {len(batch_rows)} new rows; '{BATCH_REQUESTS_FILE}' now holds {total} batch requests.")
+
+    save_results(all_new_results)
+    if COMPANY_SHORT_CIRCUIT:
+        save_company_summary()
+
+    for name, stats in date_cache_stats().items():
+        print(f"  [Date cache] {name}: {stats['hits']} hits / {stats['misses']} misses ({stats['hit_rate']:.0%})")
+    cache = verdict_cache.summary()
+    print(f"  [Verdict cache] {cache['hits']} hits / {cache['misses']} misses ({cache['hit_rate']:.0%}), "
+          f"{cache['expired']} expired, {cache['evicted']} evicted, {cache['size']} entries")
+    if fired := rule_stats():
+        print(f"  [Rules] {sum(fired.values())} rows resolved without the LLM: "
+              + ", ".join(f"{rule} {count}" for rule, count in sorted(fired.items())))
+    if TRIAGE_ENABLED:
+        triaged = triage_stats()
+        print(f"  [Triage] {triaged['settled_yes']} yes / {triaged['settled_no']} no settled locally, "
+              f"{triaged['escalated']} escalated, {triaged['pairs']} pairs in {triaged['seconds']}s")
+    deduped = dedup_index.summary()
+    if deduped["lookups"]:
+        print(f"  [Dedup] {deduped['reused']} LLM calls avoided by reusing near-duplicate verdicts "
+              f"(similarity >= {deduped['threshold']}), {deduped['indexed']} verdicts indexed")
+    prefetched = prefetch_stats()
+    if PREFETCH_ROWS and prefetched["rows"]:
+        print(f"  [Prefetch] {prefetched['ready']} of {prefetched['rows']} rows extracted before they were needed, "
+              f"{prefetched['waited_seconds']}s spent waiting on extraction, {prefetched['discarded']} discarded")
+    cascaded = cascade_stats()
+    if cascaded["rows"]:
+        print(f"  [Cascade] {cascaded['rows']} rows: {cascaded['avg_snippets']} snippets / "
+              f"{cascaded['avg_tokens']} prompt tokens / {cascaded['avg_calls']} calls per row, vs. "
+              f"{cascaded['avg_snippets_all_at_once']} snippets / {cascaded['avg_tokens_all_at_once']} tokens "
+              f"all at once; exits: {cascaded['exits']}")
+    routed = router.summary()
+    for name, latency in routed["latency"].items():
+        if latency["calls"] or latency["errors"]:
+            print(f"  [LLM {name}] {latency['calls']} calls, {latency['errors']} errors, "
+                  f"p50 {latency['p50']}s / p90 {latency['p90']}s / p99 {latency['p99']}s  {latency['buckets']}")
+    if routed["failovers"] or routed["hedged"] or routed["skipped_busy"]:
+        print(f"  [LLM routing] {routed['failovers']} failovers, {routed['skipped_busy']} busy skips, "
+              f"{routed['hedged']} hedged ({routed['hedge_wins']} won by the hedge)")
+    prefix = prefix_cache.summary()
+    print(f"  [Prompt cache] {prefix['cached_calls']} calls on a cached prefix, {prefix['uncached_calls']} without; "
+          f"{prefix['prompt_tokens']} prompt tokens ({prefix['cached_tokens']} cached), "
+          f"~{prefix['billed_input_tokens']} billed")
+    health = key_health.summary()
+    if health["trips"] or health["unhealthy"]:
+        print(f"  [Key health] {health['trips']} breaker trips, {health['probes']} probes, "
+              f"{health['recovered']} recovered; disabled now: "
+              + (", ".join(f"...{suffix} ({seconds}s left)" for suffix, seconds in health["unhealthy"].items()) or "none"))
+    if AIMD_ENABLED:
+        for control in controller_state().values():
+            if control["successes"] or any(v for k, v in control.items() if k.startswith("cuts_")):
+                print(f"  [AIMD] {control['name']}: limit {control['limit']}, {control['increases']} increases, cuts "
+                      f"{control['cuts_429']} 429 / {control['cuts_timeout']} timeout / "
+                      f"{control['cuts_latency']} latency / {control['cuts_other']} other; p95 {control['p95']}s")
+    streamed = stream_stats()
+    if streamed["streams"]:
+        print(f"  [Streaming] {streamed['streams']} streamed replies, {streamed['cut_early']} cut early; "
+              f"verdict after {streamed['avg_seconds_to_verdict']}s on average, "
+              f"whole reply {streamed['avg_seconds_total']}s")
+    spent = usage_log.summary(rows_processed=len(all_new_results))
+    if spent["calls"]:
+        print(f"  [LLM usage] {spent['calls']} calls ({spent['errors']} errors, {spent['retries']} rate-limit retries), "
+              f"{spent['input_tokens']} input tokens ({spent['cached_tokens']} cached) / {spent['output_tokens']} output, "
+              f"~${spent['cost_usd']:.4f} (${spent['cost_per_1000_rows']} per 1,000 rows); "
+              f"{spent['latency_s']}s in calls, {spent['wait_s']}s waiting for keys. Log: {usage_log.path}")
+        for group in ("by_source", "by_prompt_version"):
+            print(f"    {group.replace('_', ' ')}: " + ", ".join(
+                f"{name} {g['calls']} calls ${g['cost_usd']:.4f} {g['latency_s']}s" for name, g in spent[group].items()))
+        print("    top rows: " + ", ".join(f"{url} ${g['cost_usd']:.4f} {g['latency_s']}s" for url, g in spent["top_rows"]))
+    parsed = parse_stats()
+    if parsed["replies"]:
+        print(f"  [Parsing] {parsed['replies']} replies: {parsed['clean']} clean, {parsed['salvaged']} salvaged, "
+              f"{parsed['retries']} re-asked ({parsed['retry_recovered']} recovered), "
+              f"{parsed['failed']} unparseable ({parsed['parse_failure_rate']:.1%})")
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,72 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Iterable, Iterator
+
+# Look-ahead prefetch for the row loop.
+# The loop used to alternate between two idle waits: the network sat idle while a row
+# waited on its LLM call, and the LLM sat idle while the next row was being downloaded.
+# lookahead() instead runs the fetch & extract stage of the next PREFETCH_ROWS rows on one
+# worker thread while the current row is in the LLM stage. Rows are still handed back,
+# explained and written strictly in input order, so checkpoints and resume
+# (load_processed_items) see the same sequence as before.
+#
+# Memory stays bounded: the worker is never more than PREFETCH_ROWS rows ahead, and
+# extraction keeps only the keyword contexts of a page (the downloaded HTML and its
+# parse tree are dropped before the row is handed over). A row whose prefetch turns out
+# to be unneeded (e.g. its company was confirmed in the meantime) is simply discarded.
+
+# --- Configuration Constants ---
+PREFETCH_ROWS = 2                # rows extracted ahead of the one in the LLM stage (0 = no look-ahead)
+
+_STATS = {"rows": 0, "ready": 0, "waited_seconds": 0.0, "discarded": 0}
+_STATS_LOCK = threading.Lock()
+
+
+def lookahead(jobs: Iterable, work: Callable, depth: int = PREFETCH_ROWS, skip: Callable = None) -> Iterator:
+    """
+    Yields (job, future) for every job in input order, with work(job) already started
+    for up to `depth` jobs beyond the one yielded. Jobs for which skip(job) is true when
+    they come up for prefetching get no work and a None future.
+    """
+    window = deque()
+    # One worker: extraction never runs on two rows at once, only alongside the LLM stage
+    executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="prefetch")
+    try:
+        for job in jobs:
+            window.append((job, None if skip and skip(job) else executor.submit(work, job)))
+            if len(window) > depth:
+                yield window.popleft()
+        while window:
+            yield window.popleft()
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+def wait_for(future: Future):
+    """The prefetched result, noting whether it was ready or the loop had to wait for it."""
+    ready = future.done()
+    started = time.perf_counter()
+    result = future.result()
+    with _STATS_LOCK:
+        _STATS["rows"] += 1
+        _STATS["ready"] += ready
+        _STATS["waited_seconds"] += time.perf_counter() - started
+    return result
+
+
+def discard(future: Future):
+    """Drops a prefetch that is no longer needed (cancelled if it has not started yet)."""
+    if future is None:
+        return
+    future.cancel()
+    with _STATS_LOCK:
+        _STATS["discarded"] += 1
+
+
+def prefetch_stats() -> dict:
+    with _STATS_LOCK:
+        stats = dict(_STATS)
+    stats["waited_seconds"] = round(stats["waited_seconds"], 2)
+    return stats
@@ -0,0 +1,377 @@
+import glob
+import json
+import os
+import re
+import sys
+from collections import Counter
+from typing import Optional
+
+# classify is the main function.
+# A local rule engine for the deterministic parts of the explain_url prompt. It looks at
+# a few words on either side of every keyword mention in the extracted contexts and only
+# answers when every mention points the same way (all "Alliance for Water Stewardship",
+# all physical glue, all training courses, all a partner's or customer's use, ...).
+# A use counts as third-party only when the subject of the usage phrase names a client,
+# customer, partner, vendor or supplier and not the company itself ("we", "the company",
+# the company's name); pronouns like "its"/"their" say nothing about who is acting.
+# The engine only ever excludes: a "Yes" always comes from the LLM. Mentions that are
+# negated or in the past tense ("we do not use", "moved away from") are left unclear.
+# Anything mixed or unclear returns None and goes to the LLM as before.
+#
+# Precision is measured against labeled sheets with:
+#   python rules.py                           (the offline fixture)
+#   python rules.py results_csv/<name>.csv    (rows labeled by "Usage Indicated")
+#   python rules.py input/All_yes.csv         (a whole sheet labeled via SHEET_LABELS)
+
+# --- Configuration Constants ---
+# Off until precision has been measured on the real labeled sheets (python rules.py <sheet>)
+RULES_ENABLED = False
+# Rules that decide rows on their own; drop one here if its measured precision slips.
+# direct_statement / job_posting are still detected (cascade.py ranks contexts by them)
+# but never answer a row.
+ENABLED_RULES = {"context_mismatch", "education_only", "speculation_only", "third_party"}
+WINDOW_WORDS = 12              # words on each side of a mention that a rule looks at
+MIN_RULE_PRECISION = 0.95      # evaluate() flags rules measured below this
+
+FIXTURE_ROWS = "llm/fixtures/explain_rows.json"
+NORMAL_RESULTS_DIR = "normal_results"
+# Sheets that have no label column but are known to be all one label
+SHEET_LABELS = {"All_yes": "Yes", "Red_AWS_Yes": "Yes", "V_all_high": "Yes"}
+
+# Rule names as the prompt in explain_url.py spells them, so explanations read the same
+RULE_TITLES = {
+    "context_mismatch": "CRITICAL - Context Mismatch",
+    "education_only": "CRITICAL - Educational or Certification Use",
+    "speculation_only": "Speculation",
+    "third_party": "Third-Parties",
+    "direct_statement": "Direct Company Statements",
+    "job_posting": "Job Postings",
+}
+
+# What the technology acronyms actually stand for; any other expansion is a mismatch
+TECH_EXPANSIONS = {
+    "aws": "amazon web services", "ec2": "elastic compute cloud", "s3": "simple storage service",
+    "rds": "relational database service", "iam": "identity and access management",
+    "ebs": "elastic block store", "gcp": "google cloud platform", "vpc": "virtual private cloud",
+}
+
+# Non-technology senses of common words, and the markers that prove the technology sense
+WORD_SENSES = {
+    "glue": {
+        "tech": ["aws glue", "glue job", "glue catalog", "data catalog", "glue crawler", "etl", "spark", "pipeline"],
+        "other": ["adhesive", "voc", "bond", "bonding", "chemical", "epoxy", "wood", "laminate", "sealant",
+                  "hot melt", "paper", "flooring", "carpet", "board"],
+    },
+    "shield": {
+        "tech": ["aws shield", "ddos", "waf", "firewall", "cloudfront"],
+        "other": ["heat shield", "face shield", "shielding", "radiation", "protective", "armour", "armor",
+                  "windshield", "splash"],
+    },
+    "lambda": {
+        "tech": ["aws lambda", "serverless", "function", "functions"],
+        "other": ["lambda sensor", "wavelength", "lambda probe", "oxygen sensor"],
+    },
+}
+
+STOP_WORDS = {"for", "of", "and", "the", "in", "on", "to", "&"}
+FIRST_PERSON = {"we", "our", "us", "we've", "we're"}
+USAGE_PHRASES = ["built on", "built with", "runs on", "run on", "running on", "hosted on", "migrated to",
+                 "runs", "run", "hosts", "deployed", "deploy", "use", "uses", "using", "leverage", "leverages", "leveraging",
+                 "powered by", "based on", "adopted", "implemented", "partner with", "partnered with"]
+# Subjects that name someone other than the company ("our partner Contoso uses ...")
+THIRD_PARTY_NOUNS = {"client", "clients", "customer", "customers", "partner", "partners", "vendor", "vendors",
+                     "supplier", "suppliers"}
+SUBJECT_WORDS = 5              # words before a usage phrase searched for its subject
+# Words of a company name that do not identify it ("Acme Inc" is matched on "acme")
+COMPANY_SUFFIXES = {"inc", "ltd", "llc", "corp", "co", "plc", "gmbh", "ag", "sa", "limited", "group",
+                    "company", "the", "and", "&"}
+# Negated or past use: never a clear signal either way, so the LLM reads these
+NEGATION = ["not", "no longer", "don't", "doesn't", "never", "without", "instead of", "stopped", "moved away",
+            "moved off", "migrated away", "migrated off", "migrated from", "replaced", "used to", "formerly",
+            "previously", "retired", "decommissioned", "phased out"]
+EDUCATION = ["training course", "training courses", "training program", "training programs", "certification",
+             "certifications", "certification exam", "certified training", "online course", "online courses",
+             "curriculum", "bootcamp", "students", "learners", "learning path"]
+JOB_MARKERS = ["experience with", "experience in", "hands on", "hands-on", "skills", "requirements",
+               "responsibilities", "qualifications", "role", "hiring", "knowledge of", "proficiency"]
+SPECULATION = ["might use", "might adopt", "might move to", "could use", "could adopt", "could move to",
+               "could explore", "may adopt", "plans to", "planning to", "plan to", "considering",
+               "exploring", "evaluating", "in the future"]
+
+
+def _has(window: str, phrases: list) -> Optional[str]:
+    """First phrase that occurs in `window` as whole words."""
+    for phrase in phrases:
+        if re.search(rf"(?<!\w){re.escape(phrase)}(?!\w)", window):
+            return phrase
+    return None
+
+
+def _context_texts(contexts) -> list:
+    """Context strings from normal()/pdf() dicts, plain strings, or a single string."""
+    if isinstance(contexts, str):
+        contexts = [contexts]
+    texts = []
+    for item in contexts or []:
+        text = item.get("context") if isinstance(item, dict) else item
+        if isinstance(text, str) and text.strip():
+            texts.append(text)
+    return texts
+
+
+def mentions(contexts, keyword: str) -> list:
+    """(words before, keyword as written, words after) for every keyword mention, deduplicated."""
+    pattern = re.compile(rf"(?<!\w){re.escape(keyword)}(?!\w)", re.IGNORECASE)
+    seen, found = set(), []
+    for text in _context_texts(contexts):
+        for match in pattern.finditer(text):
+            before = re.findall(r"[\w'&-]+", text[:match.start()])[-WINDOW_WORDS:]
+            after = re.findall(r"[\w'&-]+", text[match.end():])[:WINDOW_WORDS]
+            key = (" ".join(before[-4:]) + "|" + " ".join(after[:4])).lower()
+            if key not in seen:
+                seen.add(key)
+                found.append((before, match.group(0), after))
+    return found
+
+
+def _acronym_expansion(acronym: str, words: list) -> Optional[str]:
+    """Capitalized words whose initials spell `acronym` (ignoring stop words), e.g. Alliance for Water Stewardship."""
+    letters = acronym.lower()
+    for start in range(len(words)):
+        if words[start].lower() in STOP_WORDS:
+            continue
+        initials, used = "", []
+        for word in words[start:]:
+            used.append(word)
+            if word.lower() in STOP_WORDS:
+                continue
+            if not word[0].isupper():
+                break   # expansions are names ("Alliance for Water Stewardship"), not running text
+            initials += word[0].lower()
+            if not letters.startswith(initials):
+                break
+            if initials == letters:
+                return " ".join(used)
+    return None
+
+
+def _mismatch(keyword: str, before: list, written: str, after: list) -> Optional[str]:
+    """The other meaning this mention has, or None."""
+    window = " ".join(before + [written] + after).lower()
+    base = keyword.lower()
+    if written.isupper() and base in TECH_EXPANSIONS:
+        for words in (before[-6:], after[:6]):
+            expansion = _acronym_expansion(base, words)
+            if expansion and expansion.lower() != TECH_EXPANSIONS[base]:
+                return expansion
+    if base in WORD_SENSES and not _has(window, WORD_SENSES[base]["tech"]):
+        return _has(window, WORD_SENSES[base]["other"])
+    return None
+
+
+def _company_words(company_name: str) -> set:
+    """Lowercased words that identify the company in running text."""
+    return {w for w in re.findall(r"[\w&-]+", (company_name or "").lower())
+            if w not in COMPANY_SUFFIXES and len(w) > 2}
+
+
+def _actor(before: list, written: str, after: list, company_name: str) -> tuple:
+    """
+    (actor, usage phrase) for the usage phrase nearest before the mention (else the first
+    after it): actor is "company" when its subject is "we" / "the company" / the company's
+    name, "third_party" when it is a client, customer, partner, ... and None otherwise.
+    """
+    words = [w.lower() for w in before + [written] + after]
+    starts = []
+    for phrase in USAGE_PHRASES:
+        size = len(phrase.split())
+        starts += [(i, phrase) for i in range(len(words) - size + 1) if " ".join(words[i:i + size]) == phrase]
+    if not starts:
+        return None, None
+    earlier = [found for found in starts if found[0] < len(before)]
+    start, phrase = max(earlier) if earlier else min(starts)
+
+    # The subject is whichever party is named closest before the phrase
+    company = _company_words(company_name)
+    actor = None
+    subject = words[max(0, start - SUBJECT_WORDS):start]
+    for i, word in enumerate(subject):
+        word = word.removesuffix("'s")
+        nxt = subject[i + 1] if i + 1 < len(subject) else ""
+        if word in THIRD_PARTY_NOUNS:
+            actor = "third_party"
+        elif (word in FIRST_PERSON and not (word == "our" and nxt in THIRD_PARTY_NOUNS)) \
+                or word in company or (word == "company" and i and subject[i - 1] == "the"):
+            actor = "company"
+    return actor, phrase
+
+
+def _mention_kind(keyword: str, before: list, written: str, after: list, page_type: Optional[str],
+                  company_name: str = "") -> tuple:
+    """(kind, evidence) for one mention; kind is one of the rule names or "unclear"."""
+    window = " ".join(before + [written] + after).lower()
+    if other := _mismatch(keyword, before, written, after):
+        return "context_mismatch", other
+    if _has(window, NEGATION):
+        return "unclear", None
+    if page_type == "job_posting" and (marker := _has(window, JOB_MARKERS)):
+        return "job_posting", marker
+    if marker := _has(window, SPECULATION):
+        return "speculation_only", marker
+    if (marker := _has(window, EDUCATION)) and not _has(window, JOB_MARKERS):
+        return "education_only", marker
+    actor, phrase = _actor(before, written, after, company_name)
+    if actor == "company":
+        return "direct_statement", phrase
+    if actor == "third_party":
+        return "third_party", phrase
+    return "unclear", None
+
+
+def mention_kinds(contexts, keyword: str, page_type: Optional[str] = None, company_name: str = "") -> list:
+    """The rule kind ("direct_statement", "unclear", ...) of every keyword mention in `contexts`."""
+    return [_mention_kind(keyword, *mention, page_type, company_name)[0] for mention in mentions(contexts, keyword)]
+
+
+_FIRED = Counter()  # rule -> rows resolved this run
+
+
+def classify(contexts, keyword: str, company_name: str = "", page_type: Optional[str] = None) -> Optional[dict]:
+    """
+    Verdict dict like explain() returns, plus "rule", when every mention agrees on a rule.
+    None means the row is ambiguous and needs the LLM.
+    """
+    found = mentions(contexts, keyword)
+    if not RULES_ENABLED or not found:
+        return None
+    kinds = [_mention_kind(keyword, *mention, page_type, company_name) for mention in found]
+    rule = kinds[0][0]
+    if rule == "unclear" or rule not in ENABLED_RULES or any(kind != rule for kind, _ in kinds):
+        return None
+
+    _FIRED[rule] += 1
+    evidence = kinds[0][1]
+    before, written, after = found[0]
+    quote = " ".join(before + [written] + after)
+    uses_tech = rule in ("direct_statement", "job_posting")
+    if rule == "context_mismatch":
+        reason = f"'{keyword}' is used as '{evidence}', not the technology"
+    elif rule == "third_party":
+        reason = f"every use of '{keyword}' ('{evidence}') is by a client, customer or partner, not the company"
+    else:
+        reason = f"every mention of '{keyword}' comes with '{evidence}'"
+    return {
+        "uses_tech": uses_tech,
+        "explanation": f"Rule-based: the text says '{quote}'; {reason}, which "
+                       f"{'meets' if uses_tech else 'fails'} the '{RULE_TITLES[rule]}' rule.",
+        "rule": rule,
+    }
+
+
+def rule_stats() -> dict:
+    """Rows each rule resolved in this run."""
+    return dict(_FIRED)
+
+
+# --- Precision evaluation -----------------------------------------------------------
+
+def _saved_contexts(url: str, keyword: str) -> Optional[list]:
+    """Contexts normal_3 saved for this URL and keyword in an earlier run, if any."""
+    safe_url = re.sub(r'[^a-zA-Z0-9]', '_', url)
+    safe_keyword = re.sub(r'[^a-zA-Z0-9]', '_', keyword)
+    saved = sorted(glob.glob(os.path.join(NORMAL_RESULTS_DIR, f"{safe_url}_{safe_keyword}_*.json")))
+    if not saved:
+        return None
+    with open(saved[-1], "r", encoding="utf-8") as f:
+        return json.load(f).get("results")
+
+
+def _fetch_contexts(url: str, keyword: str) -> list:
+    if url.lower().endswith(".pdf"):
+        from extract.pdf_3_adv import pdf_content
+        return pdf_content(url, keyword)
+    from extract.normal_3 import normal
+    return normal(url, keyword)
+
+
+def load_labeled(path: str) -> list:
+    """
+    Labeled rows {company_name, keyword, contexts, label} from a fixture JSON, a results /
+    checkpoint file ("Usage Indicated" Yes/No) or an input sheet listed in SHEET_LABELS.
+    Contexts come from normal_results/ when saved, otherwise the page is fetched.
+    """
+    if path.endswith(".json"):
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    else:
+        import pandas as pd
+        data = pd.read_csv(path, encoding="utf-8-sig").fillna("").to_dict("records")
+
+    sheet_label = SHEET_LABELS.get(os.path.splitext(os.path.basename(path))[0])
+    rows = []
+    for record in data:
+        label = record.get("label") or record.get("Usage Indicated") or sheet_label
+        if label not in ("Yes", "No"):
+            continue
+        keyword = record.get("keyword_tech") or record.get("keyword") or record.get("Keyword")
+        url = record.get("Page URL") or record.get("company_url") or ""
+        contexts = record.get("chunk_text")
+        if contexts is None:
+            try:
+                contexts = _saved_contexts(url, keyword) or _fetch_contexts(url, keyword)
+            except Exception as e:
+                print(f"  [WARNING] Could not get contexts for {url}: {e}")
+                continue
+        if not _context_texts(contexts):
+            continue  # the pipeline answers these without the LLM or the rules
+        rows.append({
+            "company_name": record.get("company_name") or record.get("Company Name") or "",
+            "keyword": keyword,
+            "contexts": contexts,
+            "page_type": record.get("page_type") or record.get("Page Type") or None,
+            "label": label,
+            "url": url,
+        })
+    return rows
+
+
+def evaluate(rows: list) -> dict:
+    """Per-rule precision of classify() on labeled rows, and the share of rows it resolves."""
+    fired, correct, misses = Counter(), Counter(), []
+    for row in rows:
+        verdict = classify(row["contexts"], row["keyword"], row["company_name"], row.get("page_type"))
+        if verdict is None:
+            continue
+        fired[verdict["rule"]] += 1
+        if ("Yes" if verdict["uses_tech"] else "No") == row["label"]:
+            correct[verdict["rule"]] += 1
+        else:
+            misses.append((row.get("url") or row["company_name"], row["keyword"], verdict["rule"], row["label"]))
+
+    per_rule = {
+        rule: {"fired": fired[rule], "correct": correct[rule], "precision": round(correct[rule] / fired[rule], 3),
+               "trusted": correct[rule] / fired[rule] >= MIN_RULE_PRECISION}
+        for rule in sorted(fired)
+    }
+    resolved = sum(fired.values())
+    return {
+        "rows": len(rows),
+        "resolved": resolved,
+        "coverage": round(resolved / len(rows), 3) if rows else 0.0,
+        "precision": round(sum(correct.values()) / resolved, 3) if resolved else None,
+        "rules": per_rule,
+        "misses": misses,
+    }
+
+
+if __name__ == "__main__":
+    RULES_ENABLED = True   # measure the rules even while the pipeline has them off
+    labeled = [row for path in (sys.argv[1:] or [FIXTURE_ROWS]) for row in load_labeled(path)]
+    report = evaluate(labeled)
+    print(f"Rows: {report['rows']}, resolved by rules: {report['resolved']} ({report['coverage']:.0%}), "
+          f"precision: {report['precision']}")
+    for rule, stats in report["rules"].items():
+        flag = "" if stats["trusted"] else f"   <-- below {MIN_RULE_PRECISION:.0%}, consider removing from ENABLED_RULES"
+        print(f"  {rule:>18}: {stats['correct']}/{stats['fired']} correct ({stats['precision']:.0%}){flag}")
+    for url, keyword, rule, label in report["misses"]:
+        print(f"  [MISS] {rule} on {keyword} @ {url} (labeled {label})")
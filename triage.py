@@ -0,0 +1,136 @@
+import re
+import sys
+import threading
+import time
+from typing import Optional
+
+# triage is the main function.
+# Optional CPU-only triage tier between the rule engine and explain(). A small NLI model
+# scores "<company> operationally uses <keyword>" against the text around every keyword
+# mention. Rows it is confident about are settled locally; everything in between
+# escalates to the LLM. Needs `transformers` (+ torch); without it every row escalates.
+#
+# Measure it on labeled sheets the same way as the rules (see rules.load_labeled):
+#   python triage.py [rows.json | results.csv ...]
+
+# --- Configuration Constants ---
+TRIAGE_ENABLED = False          # off by default: the first run downloads the model
+TRIAGE_MODEL = "MoritzLaurer/xtremedistil-l6-h256-zeroshot-v1.1-all-33"   # ~50 MB, fast on CPU
+TRIAGE_THREADS = 2              # torch intra-op threads per worker process
+TRIAGE_BATCH_SIZE = 16          # premise/hypothesis pairs per forward pass
+YES_THRESHOLD = 0.92            # entailment at or above this on any mention settles "Yes"
+NO_THRESHOLD = 0.05             # entailment at or below this on every mention settles "No"
+SNIPPET_WORDS = 60              # words on each side of a mention fed to the model
+
+HYPOTHESIS = "{company} uses {keyword} in its own operations."
+
+_classifier = None
+_classifier_lock = threading.Lock()
+_STATS = {"rows": 0, "settled_yes": 0, "settled_no": 0, "escalated": 0, "pairs": 0, "seconds": 0.0}
+
+
+def _load_classifier():
+    """The NLI pipeline, loaded once per process and shared by all threads; None if unavailable."""
+    global _classifier
+    with _classifier_lock:
+        if _classifier is None:
+            try:
+                import torch
+                from transformers import pipeline
+                torch.set_num_threads(TRIAGE_THREADS)
+                _classifier = pipeline("text-classification", model=TRIAGE_MODEL, device=-1, top_k=None)
+            except Exception as e:  # ImportError, no network for the first download, ...
+                print(f"  [WARNING] Triage model unavailable, escalating every row to the LLM. {e}")
+                _classifier = False
+        return _classifier or None
+
+
+def _snippets(contexts, keyword: str) -> list:
+    """Text around each keyword mention; contexts are dicts from normal()/pdf() or plain strings."""
+    pattern = re.compile(rf"(?<!\w){re.escape(keyword)}(?!\w)", re.IGNORECASE)
+    snippets = []
+    for item in contexts if isinstance(contexts, list) else [contexts]:
+        text = item.get("context") if isinstance(item, dict) else item
+        if not isinstance(text, str):
+            continue
+        for match in pattern.finditer(text):
+            before = text[:match.start()].split()[-SNIPPET_WORDS:]
+            after = text[match.end():].split()[:SNIPPET_WORDS]
+            snippet = " ".join(before + [match.group(0)] + after)
+            if snippet not in snippets:
+                snippets.append(snippet)
+    return snippets
+
+
+def _entailment(scores: list) -> float:
+    for entry in scores:
+        label = entry["label"].lower()
+        if "entail" in label and not label.startswith(("not", "non")):
+            return entry["score"]
+    return 0.0
+
+
+def triage_batch(rows: list) -> list:
+    """
+    rows: dicts with contexts, keyword, company_name. Returns one verdict (like explain(),
+    plus "triage_score") or None per row. All mentions of all rows go through the model
+    in batches of TRIAGE_BATCH_SIZE.
+    """
+    verdicts = [None] * len(rows)
+    classifier = _load_classifier() if TRIAGE_ENABLED and rows else None
+    if classifier is None:
+        return verdicts
+
+    pairs, owners = [], []
+    for i, row in enumerate(rows):
+        hypothesis = HYPOTHESIS.format(company=row["company_name"] or "The company", keyword=row["keyword"])
+        for snippet in _snippets(row["contexts"], row["keyword"]):
+            pairs.append({"text": snippet, "text_pair": hypothesis})
+            owners.append(i)
+
+    start = time.perf_counter()
+    outputs = classifier(pairs, batch_size=TRIAGE_BATCH_SIZE, truncation=True) if pairs else []
+    best = {}
+    for owner, scores in zip(owners, outputs):
+        best[owner] = max(best.get(owner, 0.0), _entailment(scores))
+    _STATS["seconds"] += time.perf_counter() - start
+    _STATS["pairs"] += len(pairs)
+
+    for i, row in enumerate(rows):
+        _STATS["rows"] += 1
+        score = best.get(i)
+        if score is not None and score >= YES_THRESHOLD:
+            _STATS["settled_yes"] += 1
+            verdicts[i] = {"uses_tech": True, "triage_score": round(score, 3),
+                           "explanation": f"Local triage: the text around '{row['keyword']}' entails operational "
+                                          f"use (score {score:.2f})."}
+        elif score is not None and score <= NO_THRESHOLD:
+            _STATS["settled_no"] += 1
+            verdicts[i] = {"uses_tech": False, "triage_score": round(score, 3),
+                           "explanation": f"Local triage: no mention of '{row['keyword']}' suggests operational "
+                                          f"use (best score {score:.2f})."}
+        else:
+            _STATS["escalated"] += 1
+    return verdicts
+
+
+def triage(contexts, keyword: str, company_name: str) -> Optional[dict]:
+    """Verdict for one row when the model is confident, else None (escalate to explain())."""
+    return triage_batch([{"contexts": contexts, "keyword": keyword, "company_name": company_name}])[0]
+
+
+def triage_stats() -> dict:
+    return dict(_STATS, seconds=round(_STATS["seconds"], 2))
+
+
+if __name__ == "__main__":
+    from rules import FIXTURE_ROWS, load_labeled
+
+    TRIAGE_ENABLED = True
+    labeled = [row for path in (sys.argv[1:] or [FIXTURE_ROWS]) for row in load_labeled(path)]
+    verdicts = triage_batch(labeled)
+    settled = [(row, v) for row, v in zip(labeled, verdicts) if v]
+    correct = sum(1 for row, v in settled if ("Yes" if v["uses_tech"] else "No") == row["label"])
+    print(f"Rows: {len(labeled)}, settled locally: {len(settled)}, "
+          f"precision: {round(correct / len(settled), 3) if settled else None}")
+    print(f"Stats: {triage_stats()}")